@@ -1,22 +1,57 @@
 import os
 import json
+from statistics import median
 
 from groq import Groq
 
 filepath = "verysmallstoreprice.json"
+# Item names of the summarized store sent alongside the statistics.
+SAMPLE_ITEMS = 20
+# Attempts the Groq client makes on rate limits, timeouts and server errors (with backoff).
+# This script stands alone, so it doesn't share the backend scheduler's rate limits (see README).
+MAX_RETRIES = 5
 
 def load_json_file(filepath):
     with open(filepath, 'r') as f:
         data = json.load(f)
     return data
 
+def store_stats(items, top=5):
+    """Aggregate figures for one store's price list, in place of its raw items."""
+    priced = [item for item in items if isinstance(item.get("Price"), (int, float))]
+    stats = {"items": len(items)}
+    if not priced:
+        return stats
+    prices = [item["Price"] for item in priced]
+    stats.update({
+        "minPrice": round(min(prices), 2),
+        "medianPrice": round(median(prices), 2),
+        "maxPrice": round(max(prices), 2),
+        "cheapest": [item["Item"] for item in sorted(priced, key=lambda item: item["Price"])[:top]],
+    })
+    qualities = {}
+    for item in items:
+        if item.get("Quality"):
+            qualities[item["Quality"]] = qualities.get(item["Quality"], 0) + 1
+    if qualities:
+        stats["quality"] = qualities
+    return stats
+
 storename = "good earth natural foods"
-json_data = load_json_file('verysmallstoreprice.json')
-json_string = json.dumps(json_data, indent=2)  # indent for readability in the prompt
+json_data = load_json_file(filepath)
+stores = json_data if isinstance(json_data, list) else [json_data]
+
+# Per-store aggregates instead of the whole price file: the prompt no longer grows with the item count.
+summary_data = {store.get("Store"): store_stats(store.get("Items", [])) for store in stores}
+match = next((store for store in stores if str(store.get("Store", "")).lower() == storename.lower()), None)
+if match:
+    summary_data[match["Store"]]["sampleItems"] = [item.get("Item") for item in match.get("Items", [])[:SAMPLE_ITEMS]]
+json_string = json.dumps(summary_data, indent=2)  # indent for readability in the prompt
 
 client = Groq(
 #
-    api_key="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"
+    api_key="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",
+    max_retries=MAX_RETRIES,
 
 )
 
@@ -38,7 +73,7 @@ chat_completion = client.chat.completions.create(
 
             "role": "user",
 
-            "content": f"Analyze the following JSON data: {json_string}"+" give a summary of "+ storename + "in about 40 words. Focus on summarizing rather than raw numbers",
+            "content": f"Analyze the following per-store price statistics: {json_string}"+" give a summary of "+ storename + "in about 40 words. Focus on summarizing rather than raw numbers",
 
 
         }
@@ -1,21 +1,24 @@
-import json
 import random
 
+from catalog import Catalog
+from changelog import LiveCatalog
+
+STORES_FILE = 'data/stores.json'
+CHANGES_FILE = 'data/stores.changes.jsonl'
+
 def add_ratings():
     # Load the stores data
-    with open('data/stores.json', 'r') as f:
-        data = json.load(f)
+    catalog = Catalog.from_file(STORES_FILE)
+    # Changes go through the change log: a running server picks them up without a restart,
+    # and stores.json is only rewritten when the log is compacted.
+    live = LiveCatalog(catalog, STORES_FILE, CHANGES_FILE, compact_every=0)
     
     # Add a random rating between 3.0 and 5.0 to each store
-    for store in data:
+    for store_id in list(catalog.stores_by_id):
         # Generate a random rating between 3.0 and 5.0 with one decimal place
-        store['rating'] = round(random.uniform(3.0, 5.0), 1)
-    
-    # Save the updated data back to the file
-    with open('data/stores.json', 'w') as f:
-        json.dump(data, f, indent=2)
+        live.update_store(store_id, {"rating": round(random.uniform(3.0, 5.0), 1)})
     
-    print(f"Added ratings to {len(data)} stores.")
+    print(f"Added ratings to {len(catalog)} stores.")
 
 if __name__ == "__main__":
     add_ratings()
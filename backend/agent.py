@@ -1,24 +1,163 @@
 #agent.py - Logic for Agent 1: The Recommender (LIVE & CONTEXT-AWARE)
 
+import os
 import json
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 import google.generativeai as genai
 
+from llm_cache import llm_cache
+from ranking import rank_options
+from slots import parse_slots, fill_slots
+from split_basket import cost_table_from_slots, optimize_split
+from metrics import metrics, span, observe_stage
+from scheduler import scheduler
+
 # --- Configuration ---
 # IMPORTANT: Replace "YOUR_API_KEY_HERE" with your actual key.
 API_KEY = "INSERT_API_KEY_HERE!" 
 genai.configure(api_key=API_KEY)
 
-llm = genai.GenerativeModel('gemini-1.5-flash')
+MODEL_NAME = 'gemini-1.5-flash'
+llm = genai.GenerativeModel(MODEL_NAME)
+# Rate-limit bucket the calls are scheduled against (see scheduler.py).
+LLM_PROVIDER = 'gemini'
+
+
+def use_llm(model, model_name: str = None, provider: str = None):
+    """Points the agent at another model object, e.g. `fake_llm.FakeGenerativeModel` for benchmarks."""
+    global llm, MODEL_NAME, LLM_PROVIDER
+    llm = model
+    MODEL_NAME = model_name or getattr(model, 'model_name', MODEL_NAME)
+    LLM_PROVIDER = provider or getattr(model, 'provider', LLM_PROVIDER)
+
+
+# AGENT_LLM=fake runs the whole pipeline offline against the deterministic stand-in.
+if os.getenv("AGENT_LLM") == "fake":
+    from fake_llm import FakeGenerativeModel
+    use_llm(FakeGenerativeModel(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+                                failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))))
+
+# --- Assembly Fan-out Settings ---
+# How many per-store assembly calls may be in flight at once for a single request.
+ASSEMBLY_MAX_WORKERS = int(os.getenv("ASSEMBLY_MAX_WORKERS", "8"))
+# Seconds a single assembly call may take before the LLM client gives up on it.
+ASSEMBLY_CALL_TIMEOUT = float(os.getenv("ASSEMBLY_CALL_TIMEOUT", "15"))
+# Seconds the whole assembly stage may take. Stores that haven't answered by then are skipped.
+ASSEMBLY_DEADLINE = float(os.getenv("ASSEMBLY_DEADLINE", "20"))
+
+# --- Batched Assembly Settings ---
+# "per_store" (default) sends one assembly prompt per store; "batched" packs several stores into one;
+# "slots" asks the LLM once to break the goal into parts and fills every store locally (see slots.py).
+ASSEMBLY_MODE = os.getenv("ASSEMBLY_MODE", "per_store")
+# Rough token budget for the store inventories packed into a single batched prompt.
+ASSEMBLY_BATCH_TOKEN_BUDGET = int(os.getenv("ASSEMBLY_BATCH_TOKEN_BUDGET", "6000"))
+
+# --- Prompt Inventory Settings ---
+# Rough token budget for one store's inventory in an assembly prompt. Larger inventories are cut
+# down to the items most similar to the user's goal (see retrieval.py); 0 always sends everything.
+PROMPT_INVENTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_INVENTORY_TOKEN_BUDGET", "1500"))
+
+# --- Split Basket Settings ---
+# In "slots" mode, a basket may also be split across up to this many stores when that beats
+# every single store (see split_basket.py). 1 turns splitting off.
+SPLIT_MAX_STORES = int(os.getenv("SPLIT_MAX_STORES", "2"))
+
+# --- Category Settings ---
+# Step 1 takes the local classifier's category (see classifier.py) when its confidence is at least
+# this, and only asks the LLM otherwise. Above 1 always asks the LLM.
+CATEGORY_CONFIDENCE = float(os.getenv("CATEGORY_CONFIDENCE", "0.9"))
+
+# --- Ranking Settings ---
+# How many ranked options are handed to the final response prompt.
+RANKING_TOP_K = 3
+
+# --- Location Settings ---
+# When the user's location is known, only stores this close are considered...
+NEARBY_RADIUS_KM = float(os.getenv("NEARBY_RADIUS_KM", "25"))
+# ...and at most this many of them (closest first), which caps assembly LLM work per request.
+NEARBY_MAX_STORES = int(os.getenv("NEARBY_MAX_STORES", "10"))
+
+
+def _estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for prompt budgeting."""
+    return len(text) // 4 + 1
 
-def _assemble_list_from_inventory(user_request: str, store: dict) -> dict:
+
+def _parse_json_response(text: str, purpose: str = "general"):
+    """Strips markdown fences from an LLM answer and parses it, keeping the raw text in the error."""
+    clean_response_text = text.strip().replace("```json", "").replace("```", "").strip()
+    try:
+        return json.loads(clean_response_text)
+    except json.JSONDecodeError as e:
+        metrics.inc("llm_json_fallbacks_total", purpose=purpose)
+        metrics.inc("llm_failures_total", purpose=purpose)
+        raise ValueError(f"{e}\nRaw Text: {text}") from e
+
+
+# Scheduler lane per purpose; anything not listed is on the user's critical path ("interactive").
+LLM_LANES = {"assembly": "fanout", "assembly_batch": "fanout"}
+
+
+def _count_llm_call(purpose: str, prompt: str):
+    metrics.inc("llm_calls_total", purpose=purpose)
+    metrics.inc("llm_prompt_chars_total", len(prompt), purpose=purpose)
+
+
+def _count_llm_response(purpose: str, text: str):
+    metrics.inc("llm_response_chars_total", len(text), purpose=purpose)
+
+
+def _remaining(stage_deadline: float):
+    """Seconds left until `stage_deadline` (a `time.monotonic()` value), or None without one."""
+    return None if stage_deadline is None else max(0.0, stage_deadline - time.monotonic())
+
+
+def _generate_json(prompt: str, purpose: str, timeout: float = None, tags: dict = None, stage_deadline: float = None):
     """
-    This helper function, formerly in one.py, tries to build a list for a conceptual 
-    request using ONLY the inventory of a single store.
+    Sends `prompt` to the LLM through the response cache and returns the parsed JSON answer.
+    Parsing happens inside the cached call, so malformed answers are never cached.
+    `purpose` labels the call in the metrics (category, assembly, ...). `timeout` bounds each
+    request; retries stop at `stage_deadline`, the `time.monotonic()` time the calling stage ends.
     """
-    print(f"[Unified Agent: Attempting to build '{user_request}' from '{store['name']}' inventory...]")
-    store_inventory_names = [item['itemName'] for item in store['inventory'] if item['inStock']]
+    def request():
+        _count_llm_call(purpose, prompt)
+        return llm.generate_content(prompt, request_options={"timeout": timeout} if timeout else None).text
+
+    def call():
+        try:
+            # Retries (within what is left of the stage's deadline) and coalescing of identical
+            # in-flight prompts happen in the scheduler.
+            text = scheduler.call(LLM_PROVIDER, request, key=(MODEL_NAME, prompt), lane=LLM_LANES.get(purpose, "interactive"),
+                                  timeout=_remaining(stage_deadline))
+        except Exception:
+            metrics.inc("llm_failures_total", purpose=purpose)
+            raise
+        _count_llm_response(purpose, text)
+        return _parse_json_response(text, purpose)
+    return llm_cache.get_or_generate(MODEL_NAME, prompt, call, tags=tags)
+
+
+def _prompt_inventory(user_request: str, store: dict, catalog, count: bool = True) -> list:
+    """
+    The in-stock names of `store` to put in an assembly prompt, shortlisted to the items most
+    relevant to `user_request` when they exceed PROMPT_INVENTORY_TOKEN_BUDGET. `count` records
+    the sent / dropped items in the metrics (off for budget planning).
+    """
+    names = catalog.in_stock_names[store['id']]
+    shortlist = names
+    if PROMPT_INVENTORY_TOKEN_BUDGET and _estimate_tokens(json.dumps(names)) > PROMPT_INVENTORY_TOKEN_BUDGET:
+        shortlist = catalog.retrieval_index().shortlist(user_request, names, PROMPT_INVENTORY_TOKEN_BUDGET)
+    if count:
+        metrics.inc("prompt_inventory_items_total", len(shortlist), result="sent")
+        metrics.inc("prompt_inventory_items_total", len(names) - len(shortlist), result="dropped")
+    return shortlist
 
-    prompt = f"""
+
+def _build_assembly_prompt(user_request: str, store_inventory_names: list) -> str:
+    return f"""
     You are a resourceful shopping assistant. Your task is to act as a personal shopper for a user at a specific store.
 
     **User's Goal:** "{user_request}"
@@ -36,101 +175,320 @@ def _assemble_list_from_inventory(user_request: str, store: dict) -> dict:
     - If you can assemble a complete list, "assembled_list" MUST be a list of the *exact* item names you used from the store's inventory.
     - If you cannot assemble a complete list, "assembled_list" MUST be `null`.
     """
+
+
+def _assemble_list_from_inventory(user_request: str, store: dict, catalog, stage_deadline: float = None) -> dict:
+    """
+    This helper function, formerly in one.py, tries to build a list for a conceptual 
+    request using ONLY the inventory of a single store.
+    """
+    print(f"[Unified Agent: Attempting to build '{user_request}' from '{store['name']}' inventory...]")
+    prompt = _build_assembly_prompt(user_request, _prompt_inventory(user_request, store, catalog))
     try:
-        response = llm.generate_content(prompt)
-        clean_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        llm_output = json.loads(clean_response_text)
-        return llm_output
+        with span("assembly_call", mode="single"):
+            return _generate_json(prompt, "assembly", timeout=ASSEMBLY_CALL_TIMEOUT, tags={store['id']: catalog.inventory_hashes[store['id']]},
+                                  stage_deadline=stage_deadline)
     except Exception as e:
-        print(f"[Unified Agent: FATAL ERROR parsing assembly response. Error: {e}\nRaw Text: {response.text}]")
+        print(f"[Unified Agent: FATAL ERROR parsing assembly response. Error: {e}]")
         return {"assembled_list": None}
 
 
-def get_recommendation(raw_request: str, conversation_history: list, stores_db: list, preference: str) -> str:
+def _batch_stores_by_budget(user_request: str, stores: list, catalog, token_budget: int) -> list:
     """
-    This is the new primary function. It orchestrates the entire process.
+    Groups stores into batches whose packed (shortlisted) inventories stay within `token_budget`.
+    A store that is larger than the budget on its own still gets a batch of one.
     """
-    print("\n[Unified Agent: Processing request...]")
+    batches, current, current_tokens = [], [], 0
+    for store in stores:
+        store_tokens = _estimate_tokens(json.dumps(_prompt_inventory(user_request, store, catalog, count=False)))
+        if current and current_tokens + store_tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(store)
+        current_tokens += store_tokens
+    if current:
+        batches.append(current)
+    return batches
 
-    # Step 1: Determine Category
+
+def _build_batched_assembly_prompt(user_request: str, inventories: dict) -> str:
+    return f"""
+    You are a resourceful shopping assistant. Your task is to act as a personal shopper for a user at several stores.
+    Treat every store separately: each list may ONLY use items from that store's own inventory.
+
+    **User's Goal:** "{user_request}"
+
+    **Available Inventory Per Store (keyed by store id):**
+    {json.dumps(inventories)}
+
+    **Your Task:**
+    For each store, based on the user's goal, assemble a complete and reasonable shopping list using ONLY items from that store's inventory.
+    - If the user wants a "sandwich", select a type of bread, a protein, a cheese, and a condiment from the inventory.
+    - If you cannot create a reasonable and complete list for a store with its inventory, you must indicate failure for that store.
+
+    **Output Format (Strict):**
+    Respond with ONLY a valid JSON object with a single key "assembled_lists", mapping EVERY store id above to its result.
+    - If you can assemble a complete list for a store, its value MUST be a list of the *exact* item names you used from that store's inventory.
+    - If you cannot assemble a complete list for a store, its value MUST be `null`.
+    Example: {{"assembled_lists": {{"store-001": ["bread", "ham"], "store-002": null}}}}
+    """
+
+
+def _collect_batched_lists(llm_output: dict, results: dict) -> dict:
+    """Copies valid per-store lists from a batched answer into `results` (pre-filled with None)."""
+    assembled_lists = llm_output.get("assembled_lists") or {}
+    for store_id, assembled_list in assembled_lists.items():
+        if store_id in results and isinstance(assembled_list, list):
+            results[store_id] = assembled_list
+    return results
+
+
+def _assemble_lists_batched(user_request: str, stores: list, catalog, stage_deadline: float = None) -> dict:
+    """
+    Batched version of `_assemble_list_from_inventory`: one LLM call assembles a list for
+    every store in `stores`. Returns {store_id: assembled_list or None}; stores the model
+    left out of its answer are reported as None.
+    """
+    print(f"[Unified Agent: Attempting to build '{user_request}' from {len(stores)} store(s) in one batch: {[s['name'] for s in stores]}]")
+    inventories = {store['id']: _prompt_inventory(user_request, store, catalog) for store in stores}
+    prompt = _build_batched_assembly_prompt(user_request, inventories)
+    results = {store_id: None for store_id in inventories}
+    try:
+        with span("assembly_call", mode="batched"):
+            llm_output = _generate_json(prompt, "assembly_batch", timeout=ASSEMBLY_CALL_TIMEOUT,
+                                        tags={store['id']: catalog.inventory_hashes[store['id']] for store in stores},
+                                        stage_deadline=stage_deadline)
+        _collect_batched_lists(llm_output, results)
+    except Exception as e:
+        print(f"[Unified Agent: FATAL ERROR parsing batched assembly response. Error: {e}]")
+    return results
+
+
+def _assemble_options_concurrently(user_request: str, stores: list, catalog, max_workers: int = None, deadline: float = None,
+                                   mode: str = None):
+    """
+    Runs the assembly stage for every store on a bounded thread pool and yields
+    (store, assembly_result) pairs in the order they complete. In "batched" mode each
+    pool task covers a batch of stores (see `_batch_stores_by_budget`); otherwise each
+    task is one `_assemble_list_from_inventory` call.
+    Once `deadline` seconds have passed, stores that are still pending are abandoned so
+    the caller can rank whatever has already come back.
+    """
+    if not stores:
+        return
+    max_workers = max_workers or ASSEMBLY_MAX_WORKERS
+    deadline = ASSEMBLY_DEADLINE if deadline is None else deadline
+    started = time.monotonic()
+
+    if (mode or ASSEMBLY_MODE) == "batched":
+        batches = _batch_stores_by_budget(user_request, stores, catalog, ASSEMBLY_BATCH_TOKEN_BUDGET)
+        task = _assemble_lists_batched
+    else:
+        batches = [[store] for store in stores]
+        task = lambda request, batch, catalog, stage_deadline: \
+            {batch[0]['id']: _assemble_list_from_inventory(request, batch[0], catalog, stage_deadline).get("assembled_list")}
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(batches)), thread_name_prefix="assembly")
+    # Each task runs in a copy of the caller's context so spans keep the request's trace id.
+    futures = {executor.submit(contextvars.copy_context().run, task, user_request, batch, catalog, started + deadline): batch
+               for batch in batches}
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            batch = futures[future]
+            try:
+                assembled_lists = future.result()
+            except Exception as e:
+                print(f"[Unified Agent: Assembly for {[s['name'] for s in batch]} failed. Error: {e}]")
+                continue
+            for store in batch:
+                yield store, {"assembled_list": assembled_lists.get(store['id'])}
+    except FuturesTimeoutError:
+        pending = [store['name'] for f, batch in futures.items() if not f.done() for store in batch]
+        print(f"[Unified Agent: Assembly deadline of {deadline}s reached after {time.monotonic() - started:.1f}s. "
+              f"Skipping {len(pending)} store(s): {pending}]")
+    finally:
+        # Don't block on stragglers; queued calls are cancelled and in-flight ones finish on their own.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _build_slots_prompt(user_request: str, store_category: str) -> str:
+    return f"""
+    You are a resourceful shopping assistant. Break the user's goal down into the parts a complete shopping list needs,
+    so that any {store_category} store's inventory can be checked against it.
+
+    **User's Goal:** "{user_request}"
+
+    **Your Task:**
+    - List every part ("slot") the goal needs. If the user wants a "sandwich", the slots are a bread, a protein, a cheese, and a condiment.
+    - For each slot, give short generic item names that would fill it, most typical first, including acceptable substitutes.
+    - Mark a slot as optional if the goal is still met without it.
+
+    **Output Format (Strict):**
+    Respond with ONLY a valid JSON object with a single key "slots".
+    - "slots" MUST be a list of objects with the keys "name", "options" (a list of item names) and "optional" (true/false).
+    - If the goal cannot be met with items from a {store_category} store, "slots" MUST be `null`.
+    Example: {{"slots": [{{"name": "bread", "options": ["bread", "bagel"], "optional": false}}, {{"name": "protein", "options": ["ham", "turkey"], "optional": false}}]}}
+    """
+
+
+def _decompose_goal(user_request: str, store_category: str):
+    """
+    One LLM call that breaks the goal into slots (see slots.py). The answer depends only on the
+    goal and category, so it is cached without inventory tags and shared across stores and users.
+    Returns None if the model can't decompose the goal.
+    """
+    try:
+        with span("assembly_call", mode="slots"):
+            return parse_slots(_generate_json(_build_slots_prompt(user_request, store_category), "slots", timeout=ASSEMBLY_CALL_TIMEOUT,
+                                              stage_deadline=time.monotonic() + ASSEMBLY_DEADLINE))
+    except Exception as e:
+        print(f"[Unified Agent: FATAL ERROR parsing slot decomposition. Error: {e}]")
+        return None
+
+
+def _fill_stores_from_slots(slots: list, stores: list, catalog):
+    """Yields (store, assembly_result) for every store, matching the slots against its in-stock items locally."""
+    for store in stores:
+        yield store, {"assembled_list": fill_slots(slots, catalog.name_index(store['id']))}
+
+
+def _assemble_options(user_request: str, stores: list, catalog, slots: list = None):
+    """
+    The assembly stage: yields (store, assembly_result) pairs. With `slots` (from `_decompose_goal`)
+    every store is filled locally; in "slots" mode without them it falls back to batched LLM assembly.
+    """
+    if slots:
+        print(f"[Unified Agent: Filling {len(stores)} store(s) locally from slots {[slot['name'] for slot in slots]}]")
+        yield from _fill_stores_from_slots(slots, stores, catalog)
+    elif ASSEMBLY_MODE == "slots":
+        print("[Unified Agent: No usable slots; falling back to batched assembly.]")
+        yield from _assemble_options_concurrently(user_request, stores, catalog, mode="batched")
+    else:
+        yield from _assemble_options_concurrently(user_request, stores, catalog)
+
+
+def _build_split_option(slots: list, stores: list, catalog, distances: dict, preference: str):
+    """
+    The best basket spread over 2..SPLIT_MAX_STORES stores as a shopping option (each item tagged
+    with its `storeName`), or None when a single store is at least as good.
+    """
+    if SPLIT_MAX_STORES < 2 or len(stores) < 2:
+        return None
+    with span("split"):
+        split = optimize_split(cost_table_from_slots(slots, stores, catalog), preference, SPLIT_MAX_STORES, distances)
+    if not split or len(split["stores"]) < 2:
+        return None
+    store_info = {
+        "id": "+".join(store['id'] for store in split["stores"]),
+        "name": " + ".join(store['name'] for store in split["stores"]),
+        "stores": [catalog.store_info[store['id']] for store in split["stores"]],
+    }
+    if distances:
+        store_info["distanceKm"] = round(max(distances[store['id']] for store in split["stores"]), 2)
+    print(f"[Unified Agent: Split basket across {store_info['name']}: ${split['totalPrice']:.2f}, {split['averageQuality']}/10]")
+    return {
+        "storeInfo": store_info,
+        "matchedItemsDetails": [{**item, "storeName": store['name']} for item, store in zip(split["items"], split["itemStores"])],
+    }
+
+
+# --- Pipeline Stages ---
+# THE FIX: Hardcode the valid categories as requested by the user for reliability.
+VALID_CATEGORIES = ["Groceries", "Hardware", "Electronics", "Gas"]
+
+# Final answers when the pipeline can't get to a recommendation.
+MSG_UNCLEAR_CATEGORY = "I'm not sure which category of store to look at for that request. Could you be more specific?"
+MSG_NOT_UNDERSTOOD = "I'm having trouble understanding your request. Could you please rephrase?"
+MSG_NO_OPTIONS = "I'm sorry, but after checking the local stores, I couldn't assemble a complete shopping list for that request."
+MSG_FINAL_FAILED = "I had a short circuit in my final recommendation circuits."
+
+
+def _build_category_prompt(raw_request: str, conversation_history: list) -> str:
     full_conversation_for_prompt = conversation_history + [{"role": "user", "content": raw_request}]
     history_prompt = "\n".join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in full_conversation_for_prompt])
-    
-    # THE FIX: Hardcode the valid categories as requested by the user for reliability.
-    valid_categories = ["Groceries", "Hardware", "Electronics", "Gas"]
 
-    prompt_category = f"""
+    return f"""
     Analyze the conversation and determine the single most relevant shopping category for the user's latest request.
 
     **Conversation History:**
     {history_prompt}
 
-    **Valid Categories:** {valid_categories}
+    **Valid Categories:** {VALID_CATEGORIES}
 
     You MUST choose one of the "Valid Categories". Do not invent a new one.
     Respond with ONLY a valid JSON object with a single key "category".
     Example: {{"category": "Groceries"}}
     """
-    print("[Unified Agent: Step 1 - Determining Category...]")
-    try:
-        response = llm.generate_content(prompt_category)
-        clean_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        llm_output = json.loads(clean_response_text)
-        store_category = llm_output.get("category")
-        if store_category not in valid_categories:
-            print(f"[Unified Agent: ERROR - Invalid category '{store_category}' returned.]")
-            # If the AI fails, we try to infer the category from the text as a fallback
-            for cat in valid_categories:
-                if cat.lower() in raw_request.lower():
-                    store_category = cat
-                    break
-            else:
-                 return "I'm not sure which category of store to look at for that request. Could you be more specific?"
-    except Exception as e:
-        print(f"[Unified Agent: FATAL ERROR in Step 1. Error: {e}]")
-        return "I'm having trouble understanding your request. Could you please rephrase?"
-    
-    print(f"[Unified Agent: Category locked: {store_category}]")
 
-    # Step 2: Assemble Options
-    relevant_stores = [store for store in stores_db if store.get('category') == store_category]
-    shopping_options = []
-    
-    for store in relevant_stores:
-        assembly_result = _assemble_list_from_inventory(raw_request, store)
-        if assembly_result and assembly_result.get("assembled_list"):
-            option = {
-                "storeInfo": {k: v for k, v in store.items() if k != 'inventory'}, 
-                "matchedItemsDetails": [item for item in store['inventory'] if item['itemName'] in assembly_result["assembled_list"]]
-            }
-            shopping_options.append(option)
-    
-    if not shopping_options:
-        return "I'm sorry, but after checking the local stores, I couldn't assemble a complete shopping list for that request."
 
-    # Step 3: Augment, Sort, and Respond
-    for option in shopping_options:
-        details = option['matchedItemsDetails']
-        option['totalPrice'] = round(sum(item['price'] for item in details), 2)
-        option['averageQuality'] = round(sum(item['qualityScore'] for item in details) / len(details) if details else 0, 1)
-
-    if preference == 'price':
-        shopping_options.sort(key=lambda x: x['totalPrice'])
-    elif preference == 'quality':
-        shopping_options.sort(key=lambda x: x['averageQuality'], reverse=True)
-    else:
-        shopping_options.sort(key=lambda x: x['averageQuality'] / x['totalPrice'] if x['totalPrice'] > 0 else 0, reverse=True)
+def _resolve_category(llm_output: dict, raw_request: str):
+    """Validates the category the LLM picked, falling back to a substring match on the request. None if both fail."""
+    store_category = llm_output.get("category")
+    if store_category not in VALID_CATEGORIES:
+        print(f"[Unified Agent: ERROR - Invalid category '{store_category}' returned.]")
+        metrics.inc("category_fallbacks_total")
+        # If the AI fails, we try to infer the category from the text as a fallback
+        for cat in VALID_CATEGORIES:
+            if cat.lower() in raw_request.lower():
+                return cat
+        return None
+    return store_category
+
+
+def _classify_category(raw_request: str, conversation_history: list, catalog):
+    """The local classifier's category for the request when it's confident enough, else None (ask the LLM)."""
+    category, confidence = catalog.category_classifier().classify(raw_request, conversation_history)
+    if category in VALID_CATEGORIES and confidence >= CATEGORY_CONFIDENCE:
+        print(f"[Unified Agent: Category '{category}' from the local classifier (confidence {confidence:.2f}).]")
+        metrics.inc("category_decisions_total", path="local")
+        return category
+    metrics.inc("category_decisions_total", path="llm")
+    return None
+
+
+def _select_stores(catalog, store_category: str, location: dict):
+    """Returns (stores to assemble, {store_id: distance_km}) for the locked category."""
+    if location:
+        # An explicit radiusKm of 0 is kept: only stores at the user's own spot.
+        radius_km = NEARBY_RADIUS_KM if location.get('radiusKm') is None else location['radiusKm']
+        nearby = catalog.stores_near(location['lat'], location['long'], store_category,
+                                     radius_km=radius_km, limit=NEARBY_MAX_STORES)
+        print(f"[Unified Agent: {len(nearby)} {store_category} store(s) near the user.]")
+        return [store for store, _ in nearby], {store['id']: distance for store, distance in nearby}
+    return catalog.stores_in_category(store_category), {}
+
+
+def _build_option(catalog, store: dict, assembly_result: dict, distances: dict):
+    """Turns one store's assembly result into a shopping option, or None if the store couldn't cover the goal."""
+    if not (assembly_result and assembly_result.get("assembled_list")):
+        return None
+    store_info = catalog.store_info[store['id']]
+    if store['id'] in distances:
+        store_info = {**store_info, "distanceKm": round(distances[store['id']], 2)}
+    return {
+        "storeInfo": store_info,
+        "matchedItemsDetails": catalog.match_items(store['id'], assembly_result["assembled_list"])
+    }
 
+
+def _summarize_top_options(top_options: list) -> list:
     top_options_for_prompt = []
-    for option in shopping_options[:3]:
+    for option in top_options:
         top_options_for_prompt.append({
             "storeName": option['storeInfo']['name'],
             "totalPrice": f"${option['totalPrice']:.2f}",
             "averageQuality": f"{option['averageQuality']}/10",
-            "items": [item['itemName'] for item in option['matchedItemsDetails']]
+            # Split baskets say which store each item comes from.
+            "items": [f"{item['itemName']} ({item['storeName']})" if 'storeName' in item else item['itemName']
+                      for item in option['matchedItemsDetails']]
         })
+        if 'distanceKm' in option['storeInfo']:
+            top_options_for_prompt[-1]["distanceKm"] = option['storeInfo']['distanceKm']
+    return top_options_for_prompt
+
 
-    prompt_final = f"""
+def _build_final_prompt(raw_request: str, preference: str, top_options_for_prompt: list) -> str:
+    return f"""
     You are a concise and witty AI shopping assistant. Your goal is to give a direct and clear answer to the user's latest request using ONLY the provided data.
     **User's Latest Request:** "{raw_request}"
     **Analysis Results (Ranked by preference '{preference}'):**
@@ -139,14 +497,354 @@ def get_recommendation(raw_request: str, conversation_history: list, stores_db:
     ```
     **Your Task:** Formulate a helpful, conversational response.
     - For an initial query, recommend the #1 store, explaining why it's best based on the preference, and list the items.
+    - An option named "Store A + Store B" splits the basket across those stores; say which items to buy where.
     - If the user asks for alternatives, recommend the #2 store.
     - If the user asks a specific question (like "how much?"), answer it directly for the #1 store.
     """
+
+
+def _stream_text(prompt: str):
+    """
+    Yields the LLM's answer to `prompt` chunk by chunk using the streaming API.
+    A cached answer is yielded in one piece; a freshly streamed one is cached once complete.
+    """
+    found, cached_text = llm_cache.lookup(MODEL_NAME, prompt)
+    if found:
+        yield cached_text
+        return
+    def request():
+        _count_llm_call("final", prompt)
+        return llm.generate_content(prompt, stream=True)
+
+    chunks = []
+    try:
+        # Streams aren't coalesced, but still wait for a rate-limit token and retry failed starts.
+        for chunk in scheduler.call(LLM_PROVIDER, request):
+            text = chunk.text
+            if text:
+                chunks.append(text)
+                yield text
+    except Exception:
+        metrics.inc("llm_failures_total", purpose="final")
+        raise
+    _count_llm_response("final", "".join(chunks))
+    llm_cache.put(MODEL_NAME, prompt, "".join(chunks))
+
+
+def iter_recommendation(raw_request: str, conversation_history: list, catalog, preference: str, location: dict = None):
+    """
+    Runs the pipeline and yields progress events as each stage finishes:
+      {"event": "category", "category": ...}
+      {"event": "store", "storeId": ..., "storeName": ..., "assembled": bool}   (once per store, as it completes)
+      {"event": "ranking", "options": [...]}                                   (the top options sent to the final prompt)
+      {"event": "token", "text": ...}                                          (final answer chunks as they stream in)
+      {"event": "done", "response": ...}                                       (always last; the complete answer)
+    """
+    print("\n[Unified Agent: Processing request...]")
+
+    # Step 1: Determine Category
+    print("[Unified Agent: Step 1 - Determining Category...]")
+    try:
+        with span("category"):
+            store_category = _classify_category(raw_request, conversation_history, catalog) or \
+                _resolve_category(_generate_json(_build_category_prompt(raw_request, conversation_history), "category"), raw_request)
+    except Exception as e:
+        print(f"[Unified Agent: FATAL ERROR in Step 1. Error: {e}]")
+        yield {"event": "done", "response": MSG_NOT_UNDERSTOOD}
+        return
+    if store_category is None:
+        yield {"event": "done", "response": MSG_UNCLEAR_CATEGORY}
+        return
+
+    print(f"[Unified Agent: Category locked: {store_category}]")
+    yield {"event": "category", "category": store_category}
+
+    # Step 2: Assemble Options
+    relevant_stores, distances = _select_stores(catalog, store_category, location)
+    assembly_results = {}
+    stage_started = time.perf_counter()
+    slots = _decompose_goal(raw_request, store_category) if ASSEMBLY_MODE == "slots" and relevant_stores else None
+    for store, result in _assemble_options(raw_request, relevant_stores, catalog, slots):
+        assembly_results[store['id']] = result
+        yield {"event": "store", "storeId": store['id'], "storeName": store['name'],
+               "assembled": bool(result and result.get("assembled_list"))}
+    observe_stage("assembly", stage_started)
+
+    # Calls come back in completion order; walk the stores in catalog order so ties rank the same way every time.
+    shopping_options = []
+    for store in relevant_stores:
+        option = _build_option(catalog, store, assembly_results.get(store['id']), distances)
+        if option:
+            shopping_options.append(option)
+    split_option = _build_split_option(slots, relevant_stores, catalog, distances, preference) if slots else None
+    if split_option:
+        shopping_options.append(split_option)
+
+    if not shopping_options:
+        yield {"event": "done", "response": MSG_NO_OPTIONS}
+        return
+
+    # Step 3: Augment, Sort, and Respond
+    # Totals, means and preference scores are computed column-wise in ranking.py.
+    with span("ranking"):
+        top_options_for_prompt = _summarize_top_options(rank_options(shopping_options, preference, k=RANKING_TOP_K))
+    yield {"event": "ranking", "options": top_options_for_prompt}
+
+    print("[Unified Agent: Step 3 - Generating final response...]")
+    chunks = []
+    stage_started = time.perf_counter()
+    try:
+        for text in _stream_text(_build_final_prompt(raw_request, preference, top_options_for_prompt)):
+            chunks.append(text)
+            yield {"event": "token", "text": text}
+    except Exception as e:
+        print(f"[Unified Agent: FATAL ERROR generating final response. Error: {e}]")
+        yield {"event": "done", "response": MSG_FINAL_FAILED}
+        return
+    observe_stage("final", stage_started)
+    final_response_text = "".join(chunks)
+    print("DEBUG: " + final_response_text)
+    yield {"event": "done", "response": final_response_text}
+
+
+def get_recommendation(raw_request: str, conversation_history: list, catalog, preference: str, location: dict = None) -> str:
+    """
+    This is the new primary function. It orchestrates the entire process.
+    `catalog` is the indexed `catalog.Catalog` built once at startup.
+    `location` is an optional {"lat", "long", "radiusKm"} dict; when given, only nearby stores are assembled.
+    Blocking wrapper around `iter_recommendation` that returns only the final answer.
+    """
+    for event in iter_recommendation(raw_request, conversation_history, catalog, preference, location):
+        if event["event"] == "done":
+            return event["response"]
+
+
+# --- Async Pipeline ---
+# Same stages as above, driven with the async Gemini client so one process can keep many
+# conversations waiting on I/O at once (used by asgi.py). Cancelling the task cancels any
+# in-flight LLM calls.
+
+async def _agenerate_json(prompt: str, purpose: str, timeout: float = None, tags: dict = None, stage_deadline: float = None):
+    """Async counterpart of `_generate_json`."""
+    found, value = llm_cache.lookup(MODEL_NAME, prompt, tags)
+    if found:
+        return value
+    async def request():
+        _count_llm_call(purpose, prompt)
+        response = await llm.generate_content_async(prompt, request_options={"timeout": timeout} if timeout else None)
+        return response.text
+
+    try:
+        text = await scheduler.acall(LLM_PROVIDER, request, key=(MODEL_NAME, prompt), lane=LLM_LANES.get(purpose, "interactive"),
+                                     timeout=_remaining(stage_deadline))
+    except Exception:
+        metrics.inc("llm_failures_total", purpose=purpose)
+        raise
+    _count_llm_response(purpose, text)
+    value = _parse_json_response(text, purpose)
+    llm_cache.put(MODEL_NAME, prompt, value, tags)
+    return value
+
+
+async def _aassemble_batch(user_request: str, batch: list, catalog, mode: str = None, stage_deadline: float = None) -> dict:
+    """Async assembly for one pool task: a batch of stores ("batched" mode) or a single store. Returns {store_id: list or None}."""
+    if (mode or ASSEMBLY_MODE) == "batched":
+        print(f"[Unified Agent: Attempting to build '{user_request}' from {len(batch)} store(s) in one batch: {[s['name'] for s in batch]}]")
+        inventories = {store['id']: _prompt_inventory(user_request, store, catalog) for store in batch}
+        results = {store_id: None for store_id in inventories}
+        try:
+            with span("assembly_call", mode="batched"):
+                llm_output = await _agenerate_json(_build_batched_assembly_prompt(user_request, inventories), "assembly_batch",
+                                                   timeout=ASSEMBLY_CALL_TIMEOUT,
+                                                   tags={store['id']: catalog.inventory_hashes[store['id']] for store in batch},
+                                                   stage_deadline=stage_deadline)
+            _collect_batched_lists(llm_output, results)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Unified Agent: FATAL ERROR parsing batched assembly response. Error: {e}]")
+        return results
+
+    store = batch[0]
+    print(f"[Unified Agent: Attempting to build '{user_request}' from '{store['name']}' inventory...]")
+    try:
+        with span("assembly_call", mode="single"):
+            llm_output = await _agenerate_json(_build_assembly_prompt(user_request, _prompt_inventory(user_request, store, catalog)), "assembly",
+                                               timeout=ASSEMBLY_CALL_TIMEOUT, tags={store['id']: catalog.inventory_hashes[store['id']]},
+                                               stage_deadline=stage_deadline)
+        return {store['id']: llm_output.get("assembled_list")}
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"[Unified Agent: FATAL ERROR parsing assembly response. Error: {e}]")
+        return {store['id']: None}
+
+
+async def _aassemble_options_concurrently(user_request: str, stores: list, catalog, max_workers: int = None, deadline: float = None,
+                                          mode: str = None):
+    """Async counterpart of `_assemble_options_concurrently`: a semaphore bounds concurrency instead of a thread pool."""
+    if not stores:
+        return
+    max_workers = max_workers or ASSEMBLY_MAX_WORKERS
+    deadline = ASSEMBLY_DEADLINE if deadline is None else deadline
+    started = time.monotonic()
+    mode = mode or ASSEMBLY_MODE
+    if mode == "batched":
+        batches = _batch_stores_by_budget(user_request, stores, catalog, ASSEMBLY_BATCH_TOKEN_BUDGET)
+    else:
+        batches = [[store] for store in stores]
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def run(batch):
+        async with semaphore:
+            try:
+                return batch, await asyncio.wait_for(_aassemble_batch(user_request, batch, catalog, mode, started + deadline), ASSEMBLY_CALL_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"[Unified Agent: Assembly for {[s['name'] for s in batch]} timed out after {ASSEMBLY_CALL_TIMEOUT}s.]")
+                return batch, {}
+
+    tasks = [asyncio.ensure_future(run(batch)) for batch in batches]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=deadline):
+            batch, assembled_lists = await next_done
+            for store in batch:
+                yield store, {"assembled_list": assembled_lists.get(store['id'])}
+    except asyncio.TimeoutError:
+        pending = [store['name'] for task, batch in zip(tasks, batches) if not task.done() for store in batch]
+        print(f"[Unified Agent: Assembly deadline of {deadline}s reached after {time.monotonic() - started:.1f}s. "
+              f"Skipping {len(pending)} store(s): {pending}]")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _adecompose_goal(user_request: str, store_category: str):
+    """Async counterpart of `_decompose_goal`."""
+    try:
+        with span("assembly_call", mode="slots"):
+            return parse_slots(await _agenerate_json(_build_slots_prompt(user_request, store_category), "slots", timeout=ASSEMBLY_CALL_TIMEOUT,
+                                                     stage_deadline=time.monotonic() + ASSEMBLY_DEADLINE))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"[Unified Agent: FATAL ERROR parsing slot decomposition. Error: {e}]")
+        return None
+
+
+async def _aassemble_options(user_request: str, stores: list, catalog, slots: list = None):
+    """Async counterpart of `_assemble_options`."""
+    if slots:
+        print(f"[Unified Agent: Filling {len(stores)} store(s) locally from slots {[slot['name'] for slot in slots]}]")
+        for store, result in _fill_stores_from_slots(slots, stores, catalog):
+            yield store, result
+        return
+    if ASSEMBLY_MODE == "slots":
+        print("[Unified Agent: No usable slots; falling back to batched assembly.]")
+        assembled = _aassemble_options_concurrently(user_request, stores, catalog, mode="batched")
+    else:
+        assembled = _aassemble_options_concurrently(user_request, stores, catalog)
+    async for store, result in assembled:
+        yield store, result
+
+
+async def _astream_text(prompt: str):
+    """Async counterpart of `_stream_text`."""
+    found, cached_text = llm_cache.lookup(MODEL_NAME, prompt)
+    if found:
+        yield cached_text
+        return
+    async def request():
+        _count_llm_call("final", prompt)
+        return await llm.generate_content_async(prompt, stream=True)
+
+    chunks = []
+    try:
+        response = await scheduler.acall(LLM_PROVIDER, request)
+        async for chunk in response:
+            text = chunk.text
+            if text:
+                chunks.append(text)
+                yield text
+    except Exception:
+        metrics.inc("llm_failures_total", purpose="final")
+        raise
+    _count_llm_response("final", "".join(chunks))
+    llm_cache.put(MODEL_NAME, prompt, "".join(chunks))
+
+
+async def aiter_recommendation(raw_request: str, conversation_history: list, catalog, preference: str, location: dict = None):
+    """Async counterpart of `iter_recommendation`; yields the same events."""
+    print("\n[Unified Agent: Processing request (async)...]")
+
+    # Step 1: Determine Category
+    print("[Unified Agent: Step 1 - Determining Category...]")
+    try:
+        with span("category"):
+            store_category = _classify_category(raw_request, conversation_history, catalog) or \
+                _resolve_category(await _agenerate_json(_build_category_prompt(raw_request, conversation_history), "category"), raw_request)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"[Unified Agent: FATAL ERROR in Step 1. Error: {e}]")
+        yield {"event": "done", "response": MSG_NOT_UNDERSTOOD}
+        return
+    if store_category is None:
+        yield {"event": "done", "response": MSG_UNCLEAR_CATEGORY}
+        return
+
+    print(f"[Unified Agent: Category locked: {store_category}]")
+    yield {"event": "category", "category": store_category}
+
+    # Step 2: Assemble Options
+    relevant_stores, distances = _select_stores(catalog, store_category, location)
+    assembly_results = {}
+    stage_started = time.perf_counter()
+    slots = await _adecompose_goal(raw_request, store_category) if ASSEMBLY_MODE == "slots" and relevant_stores else None
+    async for store, result in _aassemble_options(raw_request, relevant_stores, catalog, slots):
+        assembly_results[store['id']] = result
+        yield {"event": "store", "storeId": store['id'], "storeName": store['name'],
+               "assembled": bool(result and result.get("assembled_list"))}
+    observe_stage("assembly", stage_started)
+
+    shopping_options = []
+    for store in relevant_stores:
+        option = _build_option(catalog, store, assembly_results.get(store['id']), distances)
+        if option:
+            shopping_options.append(option)
+    split_option = _build_split_option(slots, relevant_stores, catalog, distances, preference) if slots else None
+    if split_option:
+        shopping_options.append(split_option)
+
+    if not shopping_options:
+        yield {"event": "done", "response": MSG_NO_OPTIONS}
+        return
+
+    # Step 3: Augment, Sort, and Respond
+    with span("ranking"):
+        top_options_for_prompt = _summarize_top_options(rank_options(shopping_options, preference, k=RANKING_TOP_K))
+    yield {"event": "ranking", "options": top_options_for_prompt}
+
     print("[Unified Agent: Step 3 - Generating final response...]")
+    chunks = []
+    stage_started = time.perf_counter()
     try:
-        final_response = llm.generate_content(prompt_final)
-        print("DEBUG: " + final_response.text)
-        return final_response.text
+        async for text in _astream_text(_build_final_prompt(raw_request, preference, top_options_for_prompt)):
+            chunks.append(text)
+            yield {"event": "token", "text": text}
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         print(f"[Unified Agent: FATAL ERROR generating final response. Error: {e}]")
-        return "I had a short circuit in my final recommendation circuits."
+        yield {"event": "done", "response": MSG_FINAL_FAILED}
+        return
+    observe_stage("final", stage_started)
+    final_response_text = "".join(chunks)
+    print("DEBUG: " + final_response_text)
+    yield {"event": "done", "response": final_response_text}
+
+
+async def aget_recommendation(raw_request: str, conversation_history: list, catalog, preference: str, location: dict = None) -> str:
+    """Async counterpart of `get_recommendation`."""
+    async for event in aiter_recommendation(raw_request, conversation_history, catalog, preference, location):
+        if event["event"] == "done":
+            return event["response"]
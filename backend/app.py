@@ -2,73 +2,298 @@
 
 import os
 import json
-from flask import Flask, request, jsonify
+import math
+import time
+from flask import Flask, Response, request, jsonify, stream_with_context, g
 from flask_cors import CORS
 
 # Import the primary function from our new unified "LLM Brain"
-from agent import get_recommendation
+from agent import get_recommendation, iter_recommendation
+from llm_cache import llm_cache
+from catalog import Catalog
+from changelog import LiveCatalog
+from columnar import ColumnarCatalog, is_current, write_columns
+from payloads import PayloadCache, Payload, choose_encoding, summarize_store
+from sessions import SessionStore
+from metrics import metrics, new_trace_id, set_trace_id, reset_trace_id, current_trace_id
 
 # --- Constants ---
 STORES_FILE = 'data/stores.json'
+# Live updates are appended here and folded into STORES_FILE periodically (see changelog.py).
+CHANGES_FILE = 'data/stores.changes.jsonl'
+# Memory-mapped copy of STORES_FILE (see columnar.py). Used when present and built from the current
+# STORES_FILE; once it exists it is kept in step by compaction and rebuilt here when it goes stale.
+COLUMNAR_DIR = os.environ.get("CATALOG_COLUMNAR_DIR", 'data/stores.columnar')
+# Seconds between checks of STORES_FILE / CHANGES_FILE for edits made outside this process (0 disables).
+CATALOG_WATCH_SECONDS = float(os.environ.get("CATALOG_WATCH_SECONDS", "2"))
+# Trace every request (not only those sent with an X-Trace-Id header); per-stage timings are then logged.
+TRACE_ALL_REQUESTS = bool(os.environ.get("TRACE_ALL_REQUESTS"))
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 CORS(app)
 
+# Serialized /api/stores bodies, rebuilt only when the catalog version changes.
+STORE_PAYLOADS = PayloadCache()
+
 # --- In-Memory Session Management ---
-CONVERSATION_HISTORY = []
+# One bounded conversation per session id (sent as `sessionId` in the body or an X-Session-Id header).
+SESSIONS = SessionStore()
 
 # --- Data Loading ---
+# The catalog indexes the stores once here; request handlers only do lookups against it.
 try:
-    with open(STORES_FILE, 'r') as f:
-        STORES_DB = json.load(f)
-    print(f"Successfully loaded {STORES_FILE} database.")
+    if is_current(COLUMNAR_DIR, STORES_FILE):
+        CATALOG = ColumnarCatalog.open(COLUMNAR_DIR)
+        print(f"Successfully mapped {COLUMNAR_DIR} database ({len(CATALOG)} stores).")
+    else:
+        CATALOG = Catalog.from_file(STORES_FILE)
+        print(f"Successfully loaded {STORES_FILE} database ({len(CATALOG)} stores).")
+        if os.path.isdir(COLUMNAR_DIR):
+            write_columns(CATALOG.stores, COLUMNAR_DIR, source_path=STORES_FILE)
+            print(f"Rebuilt stale {COLUMNAR_DIR} from {STORES_FILE}.")
 except FileNotFoundError:
     print(f"FATAL ERROR: {STORES_FILE} not found. Please ensure it's in the same directory as app.py.")
-    STORES_DB = []
+    CATALOG = Catalog([])
+
+# Applies PATCH updates to CATALOG and persists them; replays any changes not yet in STORES_FILE.
+LIVE_CATALOG = LiveCatalog(CATALOG, STORES_FILE, CHANGES_FILE, columnar_path=COLUMNAR_DIR if os.path.isdir(COLUMNAR_DIR) else None)
+if CATALOG_WATCH_SECONDS > 0:
+    LIVE_CATALOG.watch(CATALOG_WATCH_SECONDS)
+
+
+# --- Request Tracing ---
+
+@app.before_request
+def _start_trace():
+    g.request_started = time.perf_counter()
+    trace_id = request.headers.get('X-Trace-Id') or (new_trace_id() if TRACE_ALL_REQUESTS else None)
+    g.trace_token = set_trace_id(trace_id) if trace_id else None
+
+
+@app.after_request
+def _finish_trace(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc("http_requests_total", route=route, method=request.method, status=str(response.status_code))
+    metrics.observe("http_request_seconds", time.perf_counter() - g.request_started, route=route)
+    if current_trace_id():
+        response.headers['X-Trace-Id'] = current_trace_id()
+    return response
+
+
+@app.teardown_request
+def _end_trace(exc=None):
+    if g.get('trace_token') is not None:
+        reset_trace_id(g.trace_token)
+        g.trace_token = None
 
 
 # --- API Routes ---
 
+def _session_id(user_data: dict) -> str:
+    return (user_data or {}).get('sessionId') or request.headers.get('X-Session-Id')
+
+
+def _parse_location(data) -> dict:
+    """
+    Reads a {"lat", "long", "radiusKm"} location from a request payload; returns None when absent or
+    invalid (not a finite number, lat outside [-90, 90], long outside [-180, 180], or a negative radius).
+    """
+    if not isinstance(data, dict) or data.get('lat') is None or data.get('long') is None:
+        return None
+    try:
+        location = {"lat": float(data['lat']), "long": float(data['long'])}
+        if data.get('radiusKm') is not None:
+            location['radiusKm'] = float(data['radiusKm'])
+    except (TypeError, ValueError):
+        return None
+    if not all(math.isfinite(value) for value in location.values()):
+        return None
+    if not -90 <= location['lat'] <= 90 or not -180 <= location['long'] <= 180 or location.get('radiusKm', 0) < 0:
+        return None
+    return location
+
+
+def _payload_response(payload: Payload) -> Response:
+    """Serves a pre-serialized payload, honoring If-None-Match and Accept-Encoding."""
+    headers = {"ETag": f'W/"{payload.etag}"', "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if request.if_none_match.contains_weak(payload.etag):
+        return Response(status=304, headers=headers)
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(payload.encoded(encoding), mimetype='application/json', headers=headers)
+
+
+def stores_payload(args) -> Payload:
+    """
+    Builds the /api/stores body for the query `args` (shared with asgi.py).
+    Raises ValueError with a user-facing message on bad parameters.
+    """
+    view = args.get('view', 'full')
+    if view not in ('full', 'summary'):
+        raise ValueError("view must be 'full' or 'summary'.")
+    project = summarize_store if view == 'summary' else CATALOG.full_store
+
+    try:
+        if 'bbox' in args:
+            min_lat, min_lon, max_lat, max_lon = (float(v) for v in args['bbox'].split(','))
+            stores = CATALOG.stores_in_bbox(min_lat, min_lon, max_lat, max_lon)
+        elif 'lat' in args or 'long' in args:
+            radius_km = float(args['radiusKm']) if 'radiusKm' in args else None
+            limit = int(args['limit']) if 'limit' in args else None
+            stores = [store for store, _ in CATALOG.stores_near(float(args['lat']), float(args['long']), radius_km=radius_km, limit=limit)]
+        else:
+            # Unfiltered views are serialized once per catalog version.
+            return STORE_PAYLOADS.get(('stores', view), CATALOG.version, lambda: [project(store) for store in CATALOG.stores])
+    except (KeyError, ValueError):
+        raise ValueError("Use bbox=minLat,minLong,maxLat,maxLong or lat, long and radiusKm/limit.")
+    return Payload([project(store) for store in stores])
+
+
+def inventory_payload(store_id: str):
+    """The /api/stores/<id>/inventory body, or None for an unknown store (shared with asgi.py)."""
+    if store_id not in CATALOG.stores_by_id:
+        return None
+    return STORE_PAYLOADS.get(('inventory', store_id), CATALOG.version, lambda: CATALOG.inventory(store_id))
+
+
 # This route is included to serve store data for the map on the frontend.
 @app.route('/api/stores', methods=['GET'])
 def get_stores():
-    """An endpoint to serve the store data to the frontend."""
-    return jsonify(STORES_DB)
+    """
+    An endpoint to serve the store data to the frontend.
+    `view=summary` drops inventories (use /api/stores/<id>/inventory for those).
+    Optional filters: `bbox=minLat,minLong,maxLat,maxLong`, or `lat` + `long` with `radiusKm` and/or `limit`.
+    """
+    try:
+        return _payload_response(stores_payload(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route('/api/stores/<store_id>/inventory', methods=['GET'])
+def get_store_inventory(store_id):
+    """An endpoint to serve one store's inventory."""
+    payload = inventory_payload(store_id)
+    if payload is None:
+        return jsonify({"error": f"Unknown store '{store_id}'."}), 404
+    return _payload_response(payload)
+
+
+@app.route('/api/stores/<store_id>', methods=['PATCH'])
+def patch_store(store_id):
+    """Updates store attributes (name, category, location, lat, long, rating, tags) without a restart."""
+    try:
+        return jsonify(LIVE_CATALOG.update_store(store_id, request.get_json(silent=True)))
+    except KeyError:
+        return jsonify({"error": f"Unknown store '{store_id}'."}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route('/api/stores/<store_id>/items/<path:item_name>', methods=['PATCH'])
+def patch_item(store_id, item_name):
+    """Updates one inventory item's price, inStock and/or qualityScore without a restart."""
+    try:
+        return jsonify(LIVE_CATALOG.update_item(store_id, item_name, request.get_json(silent=True)))
+    except KeyError:
+        return jsonify({"error": f"Unknown store '{store_id}' or item '{item_name}'."}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route('/api/catalog/stats', methods=['GET'])
+def catalog_stats():
+    """Live update counters: changes applied, replayed, pending compaction, reloads."""
+    return jsonify(LIVE_CATALOG.stats())
 
 
 @app.route('/api/converse', methods=['POST'])
 def converse_with_agent():
     """A single endpoint that calls the primary agent brain."""
-    global CONVERSATION_HISTORY
-
     user_data = request.json
     raw_request = user_data.get('request')
     preference = user_data.get('preference', 'balanced')
+    location = _parse_location(user_data.get('location'))
     
     if not raw_request:
         return jsonify({"error": "No request text provided."}), 400
 
+    session = SESSIONS.get(_session_id(user_data))
+
     print("--- Pipeline Start ---")
-    print(f"User Request: '{raw_request}', Preference: '{preference}'")
+    print(f"User Request: '{raw_request}', Preference: '{preference}', Session: '{session.session_id}'")
     
-    # Call the LLM Brain (agent.py), which now handles all logic internally
-    final_recommendation = get_recommendation(raw_request, CONVERSATION_HISTORY, STORES_DB, preference)
+    # Call the LLM Brain (agent.py), which now handles all logic internally.
+    # The agent only sees a token-budgeted window: a rolling summary plus the most recent turns.
+    final_recommendation = get_recommendation(raw_request, session.window(), CATALOG, preference, location)
     
     # Update history
-    CONVERSATION_HISTORY.append({"role": "user", "content": raw_request})
-    CONVERSATION_HISTORY.append({"role": "model", "content": final_recommendation})
+    session.append("user", raw_request)
+    session.append("model", final_recommendation)
     
     print("--- Pipeline End: In-memory history updated. ---")
 
     return jsonify({"response": final_recommendation})
-git 
+
+
+@app.route('/api/converse/stream', methods=['POST'])
+def converse_with_agent_stream():
+    """
+    Streaming variant of /api/converse (Server-Sent Events). Emits `category`, `store`,
+    `ranking` and `token` events as the pipeline progresses, then a final `done` event
+    carrying the complete response.
+    """
+    user_data = request.json
+    raw_request = user_data.get('request')
+    preference = user_data.get('preference', 'balanced')
+    location = _parse_location(user_data.get('location'))
+
+    if not raw_request:
+        return jsonify({"error": "No request text provided."}), 400
+
+    session = SESSIONS.get(_session_id(user_data))
+    history = session.window()
+
+    print("--- Streaming Pipeline Start ---")
+    print(f"User Request: '{raw_request}', Preference: '{preference}', Session: '{session.session_id}'")
+
+    # The generator runs after this request context's trace is reset, so it re-enters the trace itself.
+    trace_id = current_trace_id()
+
+    def generate():
+        if trace_id:
+            set_trace_id(trace_id)
+        for event in iter_recommendation(raw_request, history, CATALOG, preference, location):
+            if event["event"] == "done":
+                session.append("user", raw_request)
+                session.append("model", event["response"])
+                print("--- Streaming Pipeline End: In-memory history updated. ---")
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the LLM response cache."""
+    return jsonify(llm_cache.stats())
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Pipeline stage latencies, LLM call/cache counters and HTTP counters (Prometheus text format)."""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/memory/clear', methods=['POST'])
 def clear_memory():
-    """An endpoint to wipe the in-memory conversation history."""
-    global CONVERSATION_HISTORY
-    CONVERSATION_HISTORY = []
-    print("In-memory history has been cleared by user request.")
+    """An endpoint to wipe the in-memory conversation history of one session."""
+    session_id = _session_id(request.get_json(silent=True))
+    SESSIONS.clear(session_id)
+    print(f"In-memory history for session '{session_id or 'default'}' has been cleared by user request.")
     return jsonify({"status": "Memory cleared successfully."})
 
 
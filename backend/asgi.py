@@ -0,0 +1,211 @@
+# asgi.py - Async serving mode (FastAPI/uvicorn) with the same API contract as app.py
+#
+# Run from the backend directory with:  uvicorn asgi:app --host 0.0.0.0 --port 5001
+# LLM calls use the async Gemini client, so a single process can hold many conversations
+# that are mostly waiting on I/O. If a client disconnects, its pipeline task is cancelled.
+
+import json
+import time
+import asyncio
+from typing import Any, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+from agent import aget_recommendation, aiter_recommendation
+from llm_cache import llm_cache
+from payloads import Payload, choose_encoding
+from metrics import metrics, new_trace_id, set_trace_id, reset_trace_id
+# The catalog, payload cache and sessions live in app.py so both serving modes share one copy.
+from app import CATALOG, LIVE_CATALOG, SESSIONS, TRACE_ALL_REQUESTS, stores_payload, inventory_payload, _parse_location
+
+# How often a blocking /api/converse checks whether its client is still connected.
+DISCONNECT_POLL_SECONDS = 0.5
+
+app = FastAPI(title="Shopping Assistant")
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Same tracing and HTTP counters as the Flask before/after_request hooks."""
+    started = time.perf_counter()
+    trace_id = request.headers.get("x-trace-id") or (new_trace_id() if TRACE_ALL_REQUESTS else None)
+    token = set_trace_id(trace_id) if trace_id else None
+    try:
+        response = await call_next(request)
+    finally:
+        if token is not None:
+            reset_trace_id(token)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.inc("http_requests_total", route=route, method=request.method, status=str(response.status_code))
+    metrics.observe("http_request_seconds", time.perf_counter() - started, route=route)
+    if trace_id:
+        response.headers["X-Trace-Id"] = trace_id
+    return response
+
+
+# --- Request / Response Models ---
+
+class ConverseRequest(BaseModel):
+    request: Optional[str] = None
+    preference: str = "balanced"
+    sessionId: Optional[str] = None
+    # Parsed like app.py does: a missing or invalid location is ignored, not rejected.
+    location: Any = None
+
+
+class ConverseResponse(BaseModel):
+    response: str
+
+
+class ClearRequest(BaseModel):
+    sessionId: Optional[str] = None
+
+
+class StatusResponse(BaseModel):
+    status: str
+
+
+def _payload_response(request: Request, payload: Payload) -> Response:
+    """Serves a pre-serialized payload, honoring If-None-Match and Accept-Encoding."""
+    etag = f'W/"{payload.etag}"'
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(payload.encoded(encoding), media_type="application/json", headers=headers)
+
+
+def _session_id(body_session_id: Optional[str], request: Request) -> Optional[str]:
+    return body_session_id or request.headers.get("x-session-id")
+
+
+async def _json_body(request: Request):
+    """The request's JSON body, or None when it isn't valid JSON (like Flask's `get_json(silent=True)`)."""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# --- API Routes ---
+
+@app.get("/api/stores")
+async def get_stores(request: Request):
+    """Same contract as the Flask /api/stores (views, bbox/radius filters, ETag, compression)."""
+    try:
+        return _payload_response(request, stores_payload(request.query_params))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+@app.get("/api/stores/{store_id}/inventory")
+async def get_store_inventory(store_id: str, request: Request):
+    payload = inventory_payload(store_id)
+    if payload is None:
+        return JSONResponse({"error": f"Unknown store '{store_id}'."}, status_code=404)
+    return _payload_response(request, payload)
+
+
+@app.patch("/api/stores/{store_id}")
+async def patch_store(store_id: str, request: Request):
+    # Validated by the catalog, as in app.py; the update appends to the change log (and may
+    # compact it), so it runs off the event loop.
+    try:
+        return await run_in_threadpool(LIVE_CATALOG.update_store, store_id, await _json_body(request))
+    except KeyError:
+        return JSONResponse({"error": f"Unknown store '{store_id}'."}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+@app.patch("/api/stores/{store_id}/items/{item_name:path}")
+async def patch_item(store_id: str, item_name: str, request: Request):
+    try:
+        return await run_in_threadpool(LIVE_CATALOG.update_item, store_id, item_name, await _json_body(request))
+    except KeyError:
+        return JSONResponse({"error": f"Unknown store '{store_id}' or item '{item_name}'."}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+@app.get("/api/catalog/stats")
+async def catalog_stats():
+    return LIVE_CATALOG.stats()
+
+
+@app.post("/api/converse", response_model=ConverseResponse)
+async def converse_with_agent(body: ConverseRequest, request: Request):
+    if not body.request:
+        return JSONResponse({"error": "No request text provided."}, status_code=400)
+
+    session = SESSIONS.get(_session_id(body.sessionId, request))
+    location = _parse_location(body.location)
+    print("--- Pipeline Start (async) ---")
+    print(f"User Request: '{body.request}', Preference: '{body.preference}', Session: '{session.session_id}'")
+
+    task = asyncio.ensure_future(aget_recommendation(body.request, session.window(), CATALOG, body.preference, location))
+    while not task.done():
+        await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if not task.done() and await request.is_disconnected():
+            task.cancel()
+            print("--- Pipeline Cancelled: client disconnected. ---")
+            return Response(status_code=499)
+    final_recommendation = task.result()
+
+    session.append("user", body.request)
+    session.append("model", final_recommendation)
+    print("--- Pipeline End: In-memory history updated. ---")
+    return ConverseResponse(response=final_recommendation)
+
+
+@app.post("/api/converse/stream")
+async def converse_with_agent_stream(body: ConverseRequest, request: Request):
+    """Server-Sent Events, same events as the Flask variant. Disconnecting cancels the pipeline."""
+    if not body.request:
+        return JSONResponse({"error": "No request text provided."}, status_code=400)
+
+    session = SESSIONS.get(_session_id(body.sessionId, request))
+    location = _parse_location(body.location)
+    history = session.window()
+
+    async def generate():
+        async for event in aiter_recommendation(body.request, history, CATALOG, body.preference, location):
+            if event["event"] == "done":
+                session.append("user", body.request)
+                session.append("model", event["response"])
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return llm_cache.stats()
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    return Response(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/api/memory/clear", response_model=StatusResponse)
+async def clear_memory(request: Request, body: Optional[ClearRequest] = None):
+    session_id = _session_id(body.sessionId if body else None, request)
+    SESSIONS.clear(session_id)
+    print(f"In-memory history for session '{session_id or 'default'}' has been cleared by user request.")
+    return StatusResponse(status="Memory cleared successfully.")
+
+
+# --- Main Execution ---
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5001)
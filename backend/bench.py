@@ -0,0 +1,134 @@
+# bench.py - In-process benchmarks of the recommendation pipeline (fake LLM + synthetic catalogs)
+#
+# Usage: python bench.py --stores 10,100,1000 --items 50,500 --history 0,50 --latency 0.0 --repeat 3
+# Reports per-stage latency, LLM calls, prompt size, peak allocation and throughput for every
+# combination, so scaling regressions show up without live Gemini calls.
+
+import io
+import json
+import time
+import argparse
+import itertools
+import statistics
+import tracemalloc
+from contextlib import redirect_stdout
+
+import agent
+from catalog import Catalog
+from fake_llm import FakeGenerativeModel
+from llm_cache import llm_cache
+from sessions import Session
+from synth_catalog import generate_catalog
+
+GOALS = {"Groceries": "groceries to bake cookies", "Hardware": "hardware to hang a shelf",
+         "Electronics": "electronics for a home office", "Gas": "gas for a road trip"}
+
+
+def _history(turns: int) -> list:
+    """A session window built from `turns` synthetic turns, the way app.py builds it."""
+    session = Session("bench")
+    for i in range(turns):
+        session.append("user" if i % 2 == 0 else "model", f"Turn {i}: what about something for groceries, maybe option {i}?")
+    return session.window()
+
+
+def _run_once(goal: str, history: list, catalog) -> dict:
+    """Runs the pipeline once and returns the elapsed seconds at each stage boundary."""
+    marks = {}
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        for event in agent.iter_recommendation(goal, history, catalog, "balanced"):
+            now = time.perf_counter() - started
+            if event["event"] == "category":
+                marks["category"] = now
+            elif event["event"] == "store":
+                marks["assembly"] = now
+            elif event["event"] == "ranking":
+                marks["ranking"] = now
+            elif event["event"] == "done":
+                marks["done"] = now
+    return marks
+
+
+def run_case(n_stores: int, n_items: int, history_turns: int, latency: float, repeat: int, category: str = "Groceries") -> dict:
+    stores = generate_catalog(n_stores, n_items)
+    started = time.perf_counter()
+    catalog = Catalog(stores)
+    build_s = time.perf_counter() - started
+
+    model = FakeGenerativeModel(latency=latency)
+    agent.use_llm(model)
+    history = _history(history_turns)
+    goal = GOALS[category]
+
+    samples = []
+    for _ in range(repeat):
+        llm_cache.clear()
+        samples.append(_run_once(goal, history, catalog))
+    calls_per_request = model.calls / repeat
+    prompt_kchars = model.prompt_chars / repeat / 1000
+
+    # Allocation is measured on a separate run; tracemalloc would distort the timings.
+    llm_cache.clear()
+    tracemalloc.start()
+    _run_once(goal, history, catalog)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    def median(key, since=None):
+        values = [s.get(key, s["done"]) - (s.get(since, 0) if since else 0) for s in samples]
+        return statistics.median(values) * 1000
+
+    total_ms = median("done")
+    return {
+        "stores": n_stores,
+        "items": n_items,
+        "history": history_turns,
+        "catalogBuildMs": round(build_s * 1000, 2),
+        "categoryMs": round(median("category"), 2),
+        "assemblyMs": round(median("assembly", "category"), 2),
+        "rankingMs": round(median("ranking", "assembly"), 2),
+        "finalMs": round(median("done", "ranking"), 2),
+        "totalMs": round(total_ms, 2),
+        "llmCalls": round(calls_per_request, 1),
+        "promptKChars": round(prompt_kchars, 1),
+        "peakAllocMb": round(peak_bytes / 1e6, 2),
+        "requestsPerSec": round(1000 / total_ms, 2) if total_ms else None,
+    }
+
+
+def _print_table(rows: list):
+    columns = list(rows[0])
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).rjust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation pipeline against a fake LLM.")
+    parser.add_argument("--stores", default="10,100,1000", help="comma-separated store counts")
+    parser.add_argument("--items", default="50,500", help="comma-separated inventory sizes")
+    parser.add_argument("--history", default="0,50", help="comma-separated conversation lengths (turns)")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake LLM seconds per call")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    def ints(value):
+        return [int(v) for v in value.split(",")]
+
+    rows = []
+    for n_stores, n_items, history_turns in itertools.product(ints(args.stores), ints(args.items), ints(args.history)):
+        rows.append(run_case(n_stores, n_items, history_turns, args.latency, args.repeat))
+        print(f"[Bench: {n_stores} stores x {n_items} items, {history_turns} turns -> {rows[-1]['totalMs']} ms]")
+
+    print()
+    _print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
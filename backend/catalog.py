@@ -0,0 +1,319 @@
+# catalog.py - Indexed in-memory view of the store catalog (built once at load time)
+
+import json
+import threading
+from collections import defaultdict
+
+from llm_cache import inventory_hash
+from geo import GeoIndex
+from slots import NameIndex
+from retrieval import RetrievalIndex
+from classifier import CategoryClassifier
+
+
+def _number(value, minimum=None, maximum=None, integer=False):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (integer and value != int(value)):
+        raise ValueError("must be " + ("an integer" if integer else "a number"))
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        if maximum is None:
+            raise ValueError(f"must be at least {minimum}")
+        if minimum is None:
+            raise ValueError(f"must be at most {maximum}")
+        raise ValueError(f"must be between {minimum} and {maximum}")
+    return int(value) if integer else float(value)
+
+
+def _flag(value):
+    if not isinstance(value, bool):
+        raise ValueError("must be true or false")
+    return value
+
+
+def _text(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError("must be a non-empty string")
+    return value
+
+
+def _mapping(value):
+    if not isinstance(value, dict):
+        raise ValueError("must be an object")
+    return value
+
+
+# Fields a live update may change, with their validators.
+ITEM_FIELDS = {
+    "price": lambda v: _number(v, minimum=0),
+    "inStock": _flag,
+    "qualityScore": lambda v: _number(v, minimum=0, maximum=10, integer=True),
+}
+STORE_FIELDS = {
+    "name": _text,
+    "category": _text,
+    "location": _text,
+    "lat": lambda v: _number(v, minimum=-90, maximum=90),
+    "long": lambda v: _number(v, minimum=-180, maximum=180),
+    "rating": lambda v: _number(v, minimum=0, maximum=5),
+    "tags": _mapping,
+}
+
+
+def _validate(changes, fields: dict) -> dict:
+    """Checks a partial update against `fields`; raises ValueError with a user-facing message."""
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError(f"Send a JSON object with one or more of: {', '.join(fields)}.")
+    unknown = [key for key in changes if key not in fields]
+    if unknown:
+        raise ValueError(f"Unknown field(s) {unknown}; allowed: {', '.join(fields)}.")
+    validated = {}
+    for key, value in changes.items():
+        try:
+            validated[key] = fields[key](value)
+        except ValueError as e:
+            raise ValueError(f"'{key}' {e}.") from None
+    return validated
+
+
+class _CatalogState:
+    """Every index of a `Catalog`, in one object so a whole rebuild can be swapped in by one assignment."""
+
+
+def _state_attribute(name: str):
+    """A property forwarding `name` to the catalog's current `_CatalogState`."""
+    return property(lambda self: getattr(self._state, name), lambda self, value: setattr(self._state, name, value))
+
+
+class Catalog:
+    """
+    Wraps the raw list of store dicts from stores.json with the lookups the agent and
+    the API need, so per-request work doesn't scale with catalog size x inventory size.
+
+    - `stores_by_id`:        store id -> store dict
+    - `stores_by_category`:  category -> [store dict, ...] in catalog order
+    - `store_info`:          store id -> store dict without its inventory
+    - `in_stock_names`:      store id -> [itemName, ...] of in-stock items
+    - `items_by_name`:       store id -> {itemName: item dict}
+    - `inventory_hashes`:    store id -> hash of the store's inventory
+    - `item_index`:          itemName -> [(store id, price, qualityScore), ...] for in-stock items
+    - `geo`:                 `geo.GeoIndex` over the stores' lat/long
+    - `name_index(id)`:      `slots.NameIndex` over a store's in-stock names (built on first use)
+    - `retrieval_index()`:   `retrieval.RetrievalIndex` over every item name (built on first use)
+    - `category_classifier()`: `classifier.CategoryClassifier` over each category's item names (built on first use)
+    - `version`:             bumped whenever the indexes are rebuilt or a store changes, for caches keyed on catalog state
+
+    `update_item` / `update_store` change one store in place of a full rebuild: the store and item
+    dicts are replaced (never mutated), and only that store's index entries are swapped, under
+    a writer lock. Readers never take the lock; they see either the old or the new store.
+    The indexes live in one `_CatalogState`; `replace_stores` builds a new one and swaps that
+    single reference, so a reader never mixes indexes of the old and the new store list.
+
+    Code that needs a store's items goes through `inventory(id)` / `full_store(store)` rather than
+    `store['inventory']`, since `columnar.ColumnarCatalog` keeps inventories out of its store dicts.
+    """
+
+    # Attributes kept in the `_CatalogState` (attached as properties below the class).
+    STATE_FIELDS = ('stores', 'version', 'stores_by_id', 'stores_by_category', 'store_info', 'in_stock_names',
+                    'items_by_name', 'inventory_hashes', 'item_index', 'geo', '_name_indexes', '_retrieval',
+                    '_classifier', '_positions')
+
+    def __init__(self, stores: list):
+        # A subclass may have started the state already (with its own fields) before calling in.
+        if not hasattr(self, '_state'):
+            self._state = _CatalogState()
+        self.stores = stores
+        self.version = 0
+        self._lock = threading.RLock()
+        self._build()
+
+    @classmethod
+    def from_file(cls, path: str) -> "Catalog":
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def _build(self):
+        self.stores_by_id = {}
+        self.stores_by_category = defaultdict(list)
+        self.store_info = {}
+        self.in_stock_names = {}
+        self.items_by_name = {}
+        self.inventory_hashes = {}
+        self.item_index = defaultdict(list)
+        self._name_indexes = {}
+        self._retrieval = None
+        self._classifier = None
+        self._positions = {}
+
+        for position, store in enumerate(self.stores):
+            self._positions[store['id']] = position
+            store_id = store['id']
+            inventory = store.get('inventory', [])
+            self.stores_by_id[store_id] = store
+            self.stores_by_category[store.get('category')].append(store)
+            self.store_info[store_id] = {k: v for k, v in store.items() if k != 'inventory'}
+            self.in_stock_names[store_id] = [item['itemName'] for item in inventory if item['inStock']]
+            self.items_by_name[store_id] = {item['itemName']: item for item in inventory}
+            self.inventory_hashes[store_id] = inventory_hash(store)
+            for item in inventory:
+                if item['inStock']:
+                    self.item_index[item['itemName']].append((store_id, item['price'], item['qualityScore']))
+        self.geo = GeoIndex(self.stores)
+        self.version += 1
+
+    def __len__(self):
+        return len(self.stores)
+
+    def inventory(self, store_id: str) -> list:
+        """The item dicts of `store_id` (KeyError for an unknown store)."""
+        return self.stores_by_id[store_id].get('inventory', [])
+
+    def full_store(self, store: dict) -> dict:
+        """`store` with its inventory, as stored in stores.json."""
+        return store
+
+    # --- Live Updates ---
+
+    def _fresh_state(self, stores: list) -> _CatalogState:
+        """The indexes of `stores`, built without touching this catalog."""
+        return Catalog(stores)._state
+
+    def replace_stores(self, stores: list):
+        """Swaps in a whole new store list (e.g. a reloaded stores.json); indexes are built before the swap."""
+        state = self._fresh_state(stores)
+        with self._lock:
+            state.version = self.version + 1
+            self._state = state
+
+    def update_item(self, store_id: str, item_name: str, changes: dict) -> dict:
+        """
+        Applies a partial update (ITEM_FIELDS) to one inventory item and returns the new item.
+        Raises KeyError for an unknown store or item, ValueError for an invalid update.
+        """
+        changes = _validate(changes, ITEM_FIELDS)
+        with self._lock:
+            store = self.stores_by_id[store_id]
+            old_item = self.items_by_name[store_id][item_name]
+            item = {**old_item, **changes}
+            inventory = [item if entry is old_item else entry for entry in self.inventory(store_id)]
+            self._replace_store(store, {**store, 'inventory': inventory}, changed_items=[item_name])
+            return item
+
+    def update_store(self, store_id: str, changes: dict) -> dict:
+        """
+        Applies a partial update (STORE_FIELDS) to a store's attributes and returns its new info
+        (the store without its inventory). Raises KeyError / ValueError like `update_item`.
+        """
+        changes = _validate(changes, STORE_FIELDS)
+        with self._lock:
+            store = self.stores_by_id[store_id]
+            updated = {**store, **changes}
+            self._replace_store(store, updated)
+            return self.store_info[store_id]
+
+    def apply(self, change: dict):
+        """Applies a change record as written to the change log (see changelog.py)."""
+        if change.get('op') == 'item':
+            return self.update_item(change['storeId'], change['itemName'], change['changes'])
+        if change.get('op') == 'store':
+            return self.update_store(change['storeId'], change['changes'])
+        raise ValueError(f"Unknown change op {change.get('op')!r}.")
+
+    def _replace_store(self, old: dict, new: dict, changed_items: list = ()):
+        """Swaps `new` in for `old` in every index (caller holds the lock)."""
+        store_id = new['id']
+        inventory = new.get('inventory', [])
+        names_changed = self.items_by_name[store_id].keys() != {item['itemName'] for item in inventory}
+        self.stores[self._positions[store_id]] = new
+        self.stores_by_id[store_id] = new
+        self.store_info[store_id] = {k: v for k, v in new.items() if k != 'inventory'}
+        self.items_by_name[store_id] = {item['itemName']: item for item in inventory}
+        self.in_stock_names[store_id] = [item['itemName'] for item in inventory if item['inStock']]
+        self.inventory_hashes[store_id] = inventory_hash(new)
+        self._name_indexes.pop(store_id, None)
+        for item_name in changed_items:
+            item = self.items_by_name[store_id][item_name]
+            entries = [entry for entry in self.item_index.get(item_name, []) if entry[0] != store_id]
+            if item['inStock']:
+                entries.append((store_id, item['price'], item['qualityScore']))
+            self.item_index[item_name] = entries
+
+        category_changed = old.get('category') != new.get('category')
+        for category in {old.get('category'), new.get('category')}:
+            members = [s for s in self.stores if s.get('category') == category] if category_changed else \
+                [new if s is old else s for s in self.stores_by_category.get(category, [])]
+            self.stores_by_category[category] = members
+        if category_changed or old.get('lat') != new.get('lat') or old.get('long') != new.get('long'):
+            self.geo = GeoIndex(self.stores)
+        if names_changed:
+            # Rebuilt from the current names on next use; price and stock changes don't touch it.
+            self._retrieval = None
+        if names_changed or category_changed:
+            self._classifier = None
+        self.version += 1
+
+    def stores_in_category(self, category: str) -> list:
+        return self.stores_by_category.get(category, [])
+
+    def stores_near(self, lat: float, lon: float, category: str = None, radius_km: float = None, limit: int = None) -> list:
+        """
+        [(store dict, distance_km), ...] nearest first. With only `radius_km` every store in the
+        radius is returned; with `limit` the closest `limit` stores (optionally capped by radius).
+        """
+        if limit is None:
+            found = self.geo.within_radius(lat, lon, radius_km, category) if radius_km is not None else self.geo.nearest(lat, lon, len(self.geo), category)
+        else:
+            found = self.geo.nearest(lat, lon, limit, category, max_radius_km=radius_km)
+        return [(self.stores_by_id[store_id], distance) for store_id, distance in found]
+
+    def stores_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float, category: str = None) -> list:
+        return [self.stores_by_id[store_id] for store_id, _ in self.geo.within_bbox(min_lat, min_lon, max_lat, max_lon, category)]
+
+    def match_items(self, store_id: str, item_names: list) -> list:
+        """Returns the item dicts of `store_id` named in `item_names` (unknown names are skipped, duplicates collapsed)."""
+        items = self.items_by_name.get(store_id, {})
+        return [items[name] for name in dict.fromkeys(n for n in item_names if isinstance(n, str)) if name in items]
+
+    def stores_with_item(self, item_name: str) -> list:
+        return self.item_index.get(item_name, [])
+
+    def item_names(self) -> list:
+        """Every distinct item name in the catalog."""
+        return list(dict.fromkeys(name for items in self.items_by_name.values() for name in items))
+
+    def retrieval_index(self) -> RetrievalIndex:
+        """
+        TF-IDF index over `item_names()`, built on first use and again after an update that
+        changes a store's item names (`replace_stores` starts a fresh state).
+        """
+        state = self._state
+        if state._retrieval is None:
+            with self._lock:
+                if state._retrieval is None:
+                    state._retrieval = RetrievalIndex(self.item_names())
+        return state._retrieval
+
+    def category_item_names(self) -> dict:
+        """{category: [distinct item name, ...]} over the stores of each category."""
+        return {category: list(dict.fromkeys(name for store in stores for name in self.items_by_name[store['id']]))
+                for category, stores in self.stores_by_category.items()}
+
+    def category_classifier(self) -> CategoryClassifier:
+        """
+        Classifier over `category_item_names()`, built on first use and again after an update
+        that changes a store's item names or category (`replace_stores` starts a fresh state).
+        """
+        state = self._state
+        if state._classifier is None:
+            with self._lock:
+                if state._classifier is None:
+                    state._classifier = CategoryClassifier(self.category_item_names())
+        return state._classifier
+
+    def name_index(self, store_id: str) -> NameIndex:
+        index = self._name_indexes.get(store_id)
+        if index is None:
+            index = self._name_indexes[store_id] = NameIndex(self.in_stock_names.get(store_id, []))
+        return index
+
+
+for _name in Catalog.STATE_FIELDS:
+    setattr(Catalog, _name, _state_attribute(_name))
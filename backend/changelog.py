@@ -0,0 +1,251 @@
+# changelog.py - Durable live catalog updates: append-only change log, snapshot compaction, file-watch reload
+#
+# Every accepted update is applied to the in-memory `Catalog` and appended as one JSON line to
+# the change log, so a price change costs one small write instead of rewriting stores.json.
+# Every COMPACT_EVERY changes the catalog is written back to the snapshot (stores.json) and
+# the log is truncated. On startup, pending log records are replayed on top of the snapshot.
+#
+# Records hold absolute values ({"op": "item", "storeId", "itemName", "changes": {"price": 2.99}}),
+# so replaying one twice is harmless. Appends and compactions hold an exclusive lock on
+# "<log>.lock" across processes, so no record can land between a compaction's replay of the log
+# and its truncation; a compaction that finds a snapshot written by another process reloads it
+# first, so it never overwrites records that process already folded in. Whole-catalog rewrites
+# (e.g. ingest.py) go through `rewrite`, which redoes its merge on top of such a reload.
+
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows; the thread lock still serializes a single process
+    fcntl = None
+
+from catalog import Catalog
+from columnar import write_columns
+
+# Changes appended to the log before it is folded into the snapshot.
+COMPACT_EVERY = int(os.getenv("CATALOG_COMPACT_EVERY", "1000"))
+
+
+def _signature(path: str):
+    """(mtime_ns, size) of `path`, or None when it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Holds an exclusive flock on `path` (created if missing) for the duration of the block."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def write_json_atomic(path: str, data, **dump_kwargs):
+    """Writes `data` to a temporary file next to `path` and renames it over `path`."""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, **dump_kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class LiveCatalog:
+    """
+    Persists updates to `catalog` (loaded from `snapshot_path`) through the change log at
+    `log_path`, and can watch both files to pick up edits made by other processes:
+      - the snapshot changed (hand edit, maintenance script, another process compacted):
+        reload it and replay the log;
+      - the log grew with records from another process: apply just those records.
+    With `columnar_path`, compaction also rewrites that columnar copy of the snapshot (see columnar.py).
+    """
+
+    def __init__(self, catalog: Catalog, snapshot_path: str, log_path: str, compact_every: int = None, columnar_path: str = None):
+        self.catalog = catalog
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.lock_path = f"{log_path}.lock"
+        self.columnar_path = columnar_path
+        self.compact_every = COMPACT_EVERY if compact_every is None else compact_every
+        # Marks this process's records so the watcher doesn't apply them a second time.
+        self.origin = uuid.uuid4().hex[:12]
+        self._lock = threading.RLock()
+        self._log_offset = 0
+        self._pending = 0
+        self._snapshot_signature = _signature(snapshot_path)
+        self._watcher = None
+        self.counters = {"applied": 0, "replayed": 0, "compactions": 0, "reloads": 0}
+        self._replay_from(0, skip_own=False)
+
+    # --- Updates ---
+
+    def update_item(self, store_id: str, item_name: str, changes: dict) -> dict:
+        """`Catalog.update_item`, persisted to the change log."""
+        with self._lock:
+            item = self.catalog.update_item(store_id, item_name, changes)
+            self._append({"op": "item", "storeId": store_id, "itemName": item_name,
+                          "changes": {key: item[key] for key in changes}})
+            return item
+
+    def update_store(self, store_id: str, changes: dict) -> dict:
+        """`Catalog.update_store`, persisted to the change log."""
+        with self._lock:
+            info = self.catalog.update_store(store_id, changes)
+            self._append({"op": "store", "storeId": store_id, "changes": {key: info[key] for key in changes}})
+            return info
+
+    def _append(self, change: dict):
+        change = {**change, "ts": time.time(), "origin": self.origin}
+        line = json.dumps(change) + "\n"
+        with _file_lock(self.lock_path), open(self.log_path, 'a') as f:
+            f.write(line)
+        self.counters["applied"] += 1
+        self._pending += 1
+        if self.compact_every and self._pending >= self.compact_every:
+            self.compact()
+
+    # --- Compaction ---
+
+    def compact(self):
+        """Writes the current catalog to the snapshot (atomically) and empties the change log."""
+        with self._lock, _file_lock(self.lock_path):
+            self._catch_up()
+            self._write_snapshot()
+
+    def rewrite(self, build):
+        """
+        Replaces the catalog with `build(stores)` (a new list built from the full store dicts) and
+        writes it as the snapshot. `build` runs without the locks first; if the catalog changed
+        meanwhile (here, or in the snapshot or log on disk) it runs again under them, on top of
+        the up-to-date catalog, so no concurrent change is lost.
+        """
+        with self._lock:
+            version = self.catalog.version
+            stores = [self.catalog.full_store(store) for store in self.catalog.stores]
+        stores = build(stores)
+        with self._lock, _file_lock(self.lock_path):
+            self._catch_up()
+            if self.catalog.version != version:
+                print("[Catalog: Catalog changed during the rewrite; rebuilding on top of the current one.]")
+                stores = build([self.catalog.full_store(store) for store in self.catalog.stores])
+            self.catalog.replace_stores(stores)
+            self._write_snapshot()
+
+    def _catch_up(self):
+        """Picks up everything other processes wrote (caller holds both locks)."""
+        if _signature(self.snapshot_path) != self._snapshot_signature:
+            # Another process compacted since we loaded: its records are in its snapshot, no longer in the log.
+            self.reload()
+        else:
+            self._replay_from(self._log_offset)
+
+    def _write_snapshot(self):
+        """Writes the catalog as the snapshot and truncates the log (caller holds both locks, caught up)."""
+        stores = [self.catalog.full_store(store) for store in self.catalog.stores]
+        write_json_atomic(self.snapshot_path, stores, indent=2)
+        if self.columnar_path:
+            write_columns(stores, self.columnar_path, source_path=self.snapshot_path)
+        # A crash here leaves records that are already in the snapshot; replaying them is harmless.
+        with open(self.log_path, 'w'):
+            pass
+        self._log_offset = 0
+        self._pending = 0
+        self._snapshot_signature = _signature(self.snapshot_path)
+        self.counters["compactions"] += 1
+        print(f"[Catalog: Compacted change log into {self.snapshot_path} ({len(self.catalog)} stores).]")
+
+    # --- Replay / Reload ---
+
+    def _replay_from(self, offset: int, skip_own: bool = True) -> int:
+        """
+        Applies log records after byte `offset` and returns how many were applied. This process's
+        own records are already in memory and skipped, unless the catalog was just rebuilt.
+        """
+        applied = 0
+        try:
+            with open(self.log_path, 'r') as f:
+                f.seek(offset)
+                while True:
+                    line = f.readline()
+                    # A partial last line is still being written; pick it up on the next pass.
+                    if not line.endswith("\n"):
+                        break
+                    offset = f.tell()
+                    try:
+                        change = json.loads(line)
+                        if skip_own and change.get("origin") == self.origin:
+                            continue
+                        self.catalog.apply(change)
+                        applied += 1
+                    except (KeyError, ValueError) as e:
+                        print(f"[Catalog: Skipping change log record {line.strip()}: {e!r}]")
+        except FileNotFoundError:
+            pass
+        self._log_offset = offset
+        self._pending += applied
+        self.counters["replayed"] += applied
+        return applied
+
+    def reload(self):
+        """Rebuilds the catalog from the snapshot, then replays the whole change log on top."""
+        with self._lock:
+            with open(self.snapshot_path, 'r') as f:
+                stores = json.load(f)
+            self.catalog.replace_stores(stores)
+            self._snapshot_signature = _signature(self.snapshot_path)
+            self._pending = 0
+            self._log_offset = 0
+            self._replay_from(0, skip_own=False)
+            self.counters["reloads"] += 1
+            print(f"[Catalog: Reloaded {self.snapshot_path} ({len(self.catalog)} stores).]")
+
+    def check_files(self) -> bool:
+        """One watch pass: reloads or replays if either file changed on disk. Returns True if anything changed."""
+        with self._lock:
+            if _signature(self.snapshot_path) != self._snapshot_signature:
+                try:
+                    self.reload()
+                except (OSError, ValueError) as e:
+                    # Probably caught mid-write; the next pass will see it again.
+                    print(f"[Catalog: Could not reload {self.snapshot_path}: {e!r}]")
+                    return False
+                return True
+            log_signature = _signature(self.log_path)
+            log_size = log_signature[1] if log_signature else 0
+            if log_size < self._log_offset:
+                # Truncated by another process's compaction; its snapshot write will trigger a reload.
+                self._log_offset = 0
+                return False
+            return log_size > self._log_offset and self._replay_from(self._log_offset) > 0
+
+    def watch(self, interval: float):
+        """Polls the snapshot and change log every `interval` seconds on a daemon thread."""
+        if self._watcher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check_files()
+                except Exception as e:
+                    print(f"[Catalog: Watch pass failed: {e!r}]")
+
+        self._watcher = threading.Thread(target=loop, name="catalog-watch", daemon=True)
+        self._watcher.start()
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": self._pending, "version": self.catalog.version}
@@ -0,0 +1,89 @@
+# classifier.py - Local store-category classifier for Step 1, so most requests skip the category LLM call
+#
+# A naive Bayes model over word tokens, trained on the catalog itself: every distinct item name
+# stocked in a category counts as one example of that category ("chocolate chips" -> Groceries),
+# plus a few seed words per category for goals that name no item ("fix", "fuel"). Each word
+# votes with the share of each category's names that contain it, so a category with a short
+# list (Gas) isn't outvoted by one with thousands of names just for being small.
+# Earlier user turns add their words at a decaying weight, so a follow-up like "a cheaper one?"
+# stays in the category of the conversation. Requests whose words don't point clearly at one
+# category (low posterior, or no known words at all) are left to the LLM.
+
+import math
+from collections import Counter
+
+from slots import name_tokens
+
+# Seed words per category, counted like item names on top of the catalog's vocabulary.
+CATEGORY_HINTS = {
+    "Groceries": ["grocery food", "cook bake recipe", "breakfast lunch dinner meal", "cookies cake sandwich", "snack drink"],
+    "Hardware": ["hardware tool", "fix repair", "build install", "shelf fence deck", "plumbing paint"],
+    "Electronics": ["electronic gadget", "computer laptop phone", "office desk setup", "gaming tv", "cable charger"],
+    "Gas": ["gas station", "fuel fill tank", "car truck drive", "road trip", "refuel"],
+}
+# Words too common to say anything about the category.
+STOPWORDS = {
+    "a", "an", "and", "the", "to", "for", "of", "with", "in", "on", "at", "or", "some", "any", "i", "me", "my", "we",
+    "need", "want", "make", "buy", "get", "find", "can", "you", "what", "where", "is", "it", "one", "that", "this",
+    "please", "would", "like", "help", "store", "shop", "cheap", "cheaper", "best", "good", "more",
+}
+# A category a word never appears in still gets this fraction of the word's best category rate,
+# so one word can't rule a category out entirely.
+FLOOR = 0.01
+# Weight of the latest earlier user turn; each turn further back counts half as much again.
+CONTEXT_WEIGHT = 0.5
+CONTEXT_TURNS = 3
+
+
+def _words(text: str) -> list:
+    return [token for token in name_tokens(text) if token not in STOPWORDS and not token.isdigit()]
+
+
+class CategoryClassifier:
+    """
+    Built from {category: [item name, ...]} (see `Catalog.category_item_names`). `classify`
+    returns (category, confidence), the confidence being the top category's posterior under a
+    uniform prior; (None, 0.0) when the request and its context hold no known words.
+    """
+
+    def __init__(self, category_names: dict, hints: dict = None):
+        hints = CATEGORY_HINTS if hints is None else hints
+        self.categories = [category for category in category_names if category]
+        rates = {}
+        for category in self.categories:
+            names = list(category_names[category]) + hints.get(category, [])
+            counts = Counter(word for name in names for word in set(_words(name)))
+            for word, count in counts.items():
+                rates.setdefault(word, {})[category] = count / len(names)
+        # {word: {category: log P(category | word)}}; unknown words are ignored at classification.
+        self.word_logs = {}
+        for word, by_category in rates.items():
+            floor = FLOOR * max(by_category.values())
+            shares = {category: max(by_category.get(category, 0.0), floor) for category in self.categories}
+            total = sum(shares.values())
+            self.word_logs[word] = {category: math.log(share / total) for category, share in shares.items()}
+
+    def __len__(self):
+        return len(self.word_logs)
+
+    def scores(self, raw_request: str, conversation_history: list = ()) -> dict:
+        """{category: posterior} for the request and the user turns before it."""
+        weighted = [(word, 1.0) for word in _words(raw_request)]
+        earlier = [msg['content'] for msg in conversation_history if msg.get('role') == 'user' and isinstance(msg.get('content'), str)]
+        for back, text in enumerate(reversed(earlier[-CONTEXT_TURNS:])):
+            weighted.extend((word, CONTEXT_WEIGHT / 2 ** back) for word in _words(text))
+        known = [(self.word_logs[word], weight) for word, weight in weighted if word in self.word_logs]
+        if not known:
+            return {}
+        totals = {category: sum(weight * logs[category] for logs, weight in known) for category in self.categories}
+        peak = max(totals.values())
+        exps = {category: math.exp(total - peak) for category, total in totals.items()}
+        norm = sum(exps.values())
+        return {category: value / norm for category, value in exps.items()}
+
+    def classify(self, raw_request: str, conversation_history: list = ()) -> tuple:
+        scores = self.scores(raw_request, conversation_history)
+        if not scores:
+            return None, 0.0
+        category = max(scores, key=scores.get)
+        return category, scores[category]
@@ -2,14 +2,18 @@
 
 import requests
 import json
+import uuid
 
 # The address of our running Flask backend
 API_BASE_URL = "http://127.0.0.1:5001"
 
+# Each CLI run gets its own conversation memory on the server.
+SESSION_ID = str(uuid.uuid4())
+
 def clear_server_memory():
     """Sends a request to the backend to clear the conversation history."""
     try:
-        response = requests.post(f"{API_BASE_URL}/api/memory/clear")
+        response = requests.post(f"{API_BASE_URL}/api/memory/clear", json={"sessionId": SESSION_ID})
         if response.status_code == 200:
             print("\n[System] Memory cleared. Ready for a fresh start.")
         else:
@@ -52,7 +56,8 @@ def main():
         # Prepare the data payload for the API
         payload = {
             "request": user_input,
-            "preference": preference
+            "preference": preference,
+            "sessionId": SESSION_ID
         }
 
         try:
@@ -0,0 +1,423 @@
+# columnar.py - Compact, memory-mapped catalog format for fast startup and pages shared across workers
+#
+# `python columnar.py` converts stores.json into a directory of flat arrays:
+#   meta.json           format version, counts and the (mtime_ns, size) of the stores.json it was built from
+#   strings.bin         every distinct string once (UTF-8, sorted), so an item name shared by a
+#   string_offsets.npy  thousand stores is stored once; string i is strings.bin[offsets[i]:offsets[i + 1]]
+#   stores.npy          one row per store: string ids, lat/long/rating, precomputed inventory hash
+#   item_offsets.npy    store i's items are items.npy[item_offsets[i]:item_offsets[i + 1]]
+#   items.npy           one row per item: name id, price, qualityScore, inStock
+# Fields outside this layout (a store's tags, extra item keys) ride along as JSON in the string table.
+#
+# The arrays are opened with np.load(mmap_mode='r'): opening costs no parsing, and worker processes
+# serving the same file share its pages through the OS page cache. `ColumnarCatalog` only keeps
+# small store headers in Python objects and builds a store's item dicts the first time it's used.
+
+import os
+import sys
+import json
+import mmap
+import time
+import shutil
+import argparse
+from functools import lru_cache
+
+import numpy as np
+
+from catalog import Catalog, _CatalogState, _state_attribute
+from geo import GeoIndex
+from llm_cache import inventory_hash
+
+FORMAT_VERSION = 1
+# String id for "no value".
+NO_STRING = 0xFFFFFFFF
+# Decoded strings kept per process; item names repeat across stores, so this stays hot.
+STRING_CACHE = 65536
+
+STORE_TEXT_FIELDS = ('id', 'name', 'category', 'location')
+STORE_NUMBER_FIELDS = ('lat', 'long', 'rating')
+ITEM_FIELDS = ('itemName', 'price', 'qualityScore', 'inStock')
+
+STORE_DTYPE = np.dtype([
+    ('id', '<u4'), ('name', '<u4'), ('category', '<u4'), ('location', '<u4'),
+    ('lat', '<f8'), ('long', '<f8'), ('rating', '<f8'),
+    ('extra', '<u4'), ('inventory_hash', 'S40'),
+])
+ITEM_DTYPE = np.dtype([
+    ('name', '<u4'), ('price', '<f8'), ('quality_score', '<i2'), ('in_stock', '?'), ('extra', '<u4'),
+])
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _source_signature(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+# --- Writing ---
+
+def _split_store(store: dict) -> tuple:
+    """(typed fields, leftover fields) of a store; the inventory is handled separately."""
+    typed, extra = {}, {}
+    for key, value in store.items():
+        if key == 'inventory':
+            continue
+        if (key in STORE_TEXT_FIELDS and isinstance(value, str)) or (key in STORE_NUMBER_FIELDS and _is_number(value)):
+            typed[key] = value
+        else:
+            extra[key] = value
+    if 'id' not in typed:
+        raise ValueError(f"Store without a string id: {store.get('name', store)!r}")
+    return typed, extra
+
+
+def _check_item(store_id: str, item: dict):
+    if not (isinstance(item.get('itemName'), str) and _is_number(item.get('price'))
+            and _is_number(item.get('qualityScore')) and item.get('qualityScore') == int(item['qualityScore'])
+            and isinstance(item.get('inStock'), bool)):
+        raise ValueError(f"Store {store_id}: item {item.get('itemName')!r} needs itemName, price, an integer qualityScore and inStock.")
+
+
+def write_columns(stores: list, path: str, source_path: str = None) -> dict:
+    """
+    Writes `stores` (stores.json shape) to the columnar directory `path` and returns its meta.
+    The directory is built next to `path` and swapped in, so readers never see a half-written one;
+    processes that already mapped the old files keep reading them until they reopen.
+    """
+    split = [_split_store(store) for store in stores]
+    for store in stores:
+        for item in store.get('inventory', []):
+            _check_item(store['id'], item)
+
+    # Intern every string, sorted by UTF-8 bytes so lookups by value can bisect the table.
+    texts = set()
+    store_extras, item_extras = [], []
+    for (typed, extra), store in zip(split, stores):
+        texts.update(typed[key] for key in STORE_TEXT_FIELDS if key in typed)
+        store_extras.append(json.dumps(extra, separators=(",", ":")) if extra else None)
+        for item in store.get('inventory', []):
+            texts.add(item['itemName'])
+            leftover = {k: v for k, v in item.items() if k not in ITEM_FIELDS}
+            item_extras.append(json.dumps(leftover, separators=(",", ":")) if leftover else None)
+    texts.update(text for text in store_extras + item_extras if text is not None)
+    encoded = sorted(text.encode('utf-8') for text in texts)
+    string_ids = {text.decode('utf-8'): i for i, text in enumerate(encoded)}
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=string_offsets[1:])
+
+    store_rows = np.zeros(len(stores), dtype=STORE_DTYPE)
+    item_offsets = np.zeros(len(stores) + 1, dtype=np.int64)
+    for i, ((typed, _), store, extra) in enumerate(zip(split, stores, store_extras)):
+        row = store_rows[i]
+        for key in STORE_TEXT_FIELDS:
+            row[key] = string_ids[typed[key]] if key in typed else NO_STRING
+        for key in STORE_NUMBER_FIELDS:
+            row[key] = typed.get(key, np.nan)
+        row['extra'] = string_ids[extra] if extra is not None else NO_STRING
+        row['inventory_hash'] = inventory_hash(store).encode('ascii')
+        item_offsets[i + 1] = item_offsets[i] + len(store.get('inventory', []))
+
+    inventory = [item for store in stores for item in store.get('inventory', [])]
+    item_rows = np.zeros(len(inventory), dtype=ITEM_DTYPE)
+    item_rows['name'] = [string_ids[item['itemName']] for item in inventory]
+    item_rows['price'] = [item['price'] for item in inventory]
+    item_rows['quality_score'] = [item['qualityScore'] for item in inventory]
+    item_rows['in_stock'] = [item['inStock'] for item in inventory]
+    item_rows['extra'] = [string_ids[extra] if extra is not None else NO_STRING for extra in item_extras]
+
+    meta = {
+        "format": FORMAT_VERSION,
+        "stores": len(stores),
+        "items": len(inventory),
+        "strings": len(encoded),
+        "source": _source_signature(source_path) if source_path else None,
+    }
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(parent, f".{os.path.basename(path)}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    with open(os.path.join(tmp_path, 'strings.bin'), 'wb') as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(tmp_path, 'string_offsets.npy'), string_offsets)
+    np.save(os.path.join(tmp_path, 'stores.npy'), store_rows)
+    np.save(os.path.join(tmp_path, 'item_offsets.npy'), item_offsets)
+    np.save(os.path.join(tmp_path, 'items.npy'), item_rows)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    old_path = os.path.join(parent, f".{os.path.basename(path)}.old-{os.getpid()}")
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return meta
+
+
+def is_current(path: str, source_path: str) -> bool:
+    """True when `path` holds a readable columnar catalog built from the current `source_path`."""
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("format") == FORMAT_VERSION and meta.get("source") == _source_signature(source_path)
+
+
+# --- Reading ---
+
+class CatalogColumns:
+    """Read-only, memory-mapped view of a directory written by `write_columns`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path} has format {self.meta.get('format')}, expected {FORMAT_VERSION}; re-run columnar.py.")
+        self.stores = np.load(os.path.join(path, 'stores.npy'), mmap_mode='r')
+        self.items = np.load(os.path.join(path, 'items.npy'), mmap_mode='r')
+        self.item_offsets = np.load(os.path.join(path, 'item_offsets.npy'), mmap_mode='r')
+        self.string_offsets = np.load(os.path.join(path, 'string_offsets.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'strings.bin'), 'rb') as f:
+            # mmap refuses empty files; an empty catalog has no strings to read anyway.
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        self.string = lru_cache(maxsize=STRING_CACHE)(self._decode)
+
+    def __len__(self):
+        return len(self.stores)
+
+    def _bytes(self, string_id: int) -> bytes:
+        start, end = self.string_offsets[string_id:string_id + 2].tolist()
+        return self._blob[start:end]
+
+    def _decode(self, string_id: int):
+        return None if string_id == NO_STRING else self._bytes(string_id).decode('utf-8')
+
+    def find_string(self, text: str):
+        """The id of `text` in the string table, or None."""
+        target = text.encode('utf-8')
+        lo, hi = 0, len(self.string_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self.string_offsets) - 1 and self._bytes(lo) == target else None
+
+    def strings(self, string_ids) -> list:
+        """Decodes many string ids at once (NO_STRING -> None)."""
+        ids = np.asarray(string_ids, dtype=np.int64)
+        present = ids != NO_STRING
+        safe = np.where(present, ids, 0)
+        starts, ends = self.string_offsets[safe].tolist(), self.string_offsets[safe + 1].tolist()
+        return [self._blob[start:end].decode('utf-8') if ok else None
+                for start, end, ok in zip(starts, ends, present.tolist())]
+
+    def store_headers(self) -> list:
+        """Every store as a dict without its inventory, in catalog order."""
+        texts = {field: self.strings(self.stores[field]) for field in STORE_TEXT_FIELDS}
+        numbers = {field: self.stores[field].tolist() for field in STORE_NUMBER_FIELDS}
+        extras = self.strings(self.stores['extra'])
+        # One parse for every store's leftover fields instead of one per store.
+        parsed = json.loads("[" + ",".join(extra or "{}" for extra in extras) + "]")
+        fields = ('id', 'name', 'category', 'lat', 'long', 'location', 'rating')
+        columns = [texts[field] if field in texts else numbers[field] for field in fields]
+        # None marks a missing string, NaN a missing number.
+        return [{**{field: value for field, value in zip(fields, row) if value is not None and value == value}, **extra}
+                for row, extra in zip(zip(*columns), parsed)]
+
+    def inventory_hashes(self) -> list:
+        return [value.decode('ascii') for value in self.stores['inventory_hash'].tolist()]
+
+    def _item(self, name, price, quality_score, in_stock, extra) -> dict:
+        item = {'itemName': self.string(name), 'price': price, 'qualityScore': quality_score, 'inStock': in_stock}
+        if extra != NO_STRING:
+            item.update(json.loads(self.string(extra)))
+        return item
+
+    def inventory(self, position: int) -> list:
+        """The item dicts of the store at `position`."""
+        rows = self.items[int(self.item_offsets[position]):int(self.item_offsets[position + 1])]
+        return [self._item(*row) for row in zip(rows['name'].tolist(), rows['price'].tolist(), rows['quality_score'].tolist(),
+                                                 rows['in_stock'].tolist(), rows['extra'].tolist())]
+
+    def items_named(self, item_name: str) -> list:
+        """[(store position, item dict), ...] for every item called `item_name`."""
+        string_id = self.find_string(item_name)
+        if string_id is None:
+            return []
+        rows = np.flatnonzero(self.items['name'] == string_id)
+        positions = np.searchsorted(self.item_offsets, rows, side='right') - 1
+        return [(int(position), self._item(*self.items[row].tolist())) for position, row in zip(positions.tolist(), rows.tolist())]
+
+
+class _LazyDict(dict):
+    """A dict that fills a missing key from `load(key)` on first access (`load` raises KeyError for unknown keys)."""
+
+    def __init__(self, load):
+        super().__init__()
+        self._load = load
+
+    def __missing__(self, key):
+        # setdefault: a value stored meanwhile by a live update wins over the one loaded here.
+        return self.setdefault(key, self._load(key))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class ColumnarCatalog(Catalog):
+    """
+    A `Catalog` served from `CatalogColumns`. Only the store headers, category lists and geo
+    index are built at open; a store's `items_by_name` / `in_stock_names` entries, and
+    `item_index` entries, are built from the mapped arrays the first time they're read.
+
+    Live updates work as on `Catalog`: the updated store becomes a regular in-memory store
+    dict (with its inventory) and shadows its rows in the arrays. `replace_stores` (a reload
+    of stores.json) turns this into a plain in-memory catalog.
+    """
+
+    # The mapped arrays belong to the catalog state too: `replace_stores` drops them in the same swap.
+    STATE_FIELDS = Catalog.STATE_FIELDS + ('columns', '_materialized')
+
+    def __init__(self, columns: CatalogColumns):
+        self._state = _CatalogState()
+        self.columns = columns
+        self._materialized = set()
+        super().__init__(columns.store_headers())
+
+    @classmethod
+    def open(cls, path: str) -> "ColumnarCatalog":
+        return cls(CatalogColumns(path))
+
+    def _build(self):
+        if self.columns is None:
+            return super()._build()
+        # The lazy loaders read this state, not whatever state the catalog holds when they run.
+        state = self._state
+        self.stores_by_id = {}
+        self.stores_by_category = {}
+        self.store_info = {}
+        self._name_indexes = {}
+        self._retrieval = None
+        self._classifier = None
+        self._positions = {}
+        for position, store in enumerate(self.stores):
+            self._positions[store['id']] = position
+            self.stores_by_id[store['id']] = store
+            self.stores_by_category.setdefault(store.get('category'), []).append(store)
+            # Headers carry no inventory, so the header doubles as the store info.
+            self.store_info[store['id']] = store
+        self.items_by_name = _LazyDict(lambda store_id: self._load_items(state, store_id))
+        self.in_stock_names = _LazyDict(lambda store_id: [name for name, item in state.items_by_name[store_id].items() if item['inStock']])
+        self.inventory_hashes = dict(zip(self.stores_by_id, self.columns.inventory_hashes()))
+        self.item_index = _LazyDict(lambda item_name: self._load_item_entries(state, item_name))
+        self.geo = GeoIndex(self.stores)
+        self.version += 1
+
+    @staticmethod
+    def _load_items(state, store_id: str) -> dict:
+        return {item['itemName']: item for item in state.columns.inventory(state._positions[store_id])}
+
+    @staticmethod
+    def _load_item_entries(state, item_name: str) -> list:
+        entries = []
+        for position, item in state.columns.items_named(item_name):
+            store_id = state.stores[position]['id']
+            if store_id not in state._materialized and item['inStock']:
+                entries.append((store_id, item['price'], item['qualityScore']))
+        for store_id in state._materialized:
+            item = state.items_by_name[store_id].get(item_name)
+            if item is not None and item['inStock']:
+                entries.append((store_id, item['price'], item['qualityScore']))
+        return entries
+
+    def item_names(self) -> list:
+        if self.columns is None:
+            return super().item_names()
+        # Straight from the string table, without building any store's item dicts.
+        names = self.columns.strings(np.unique(self.columns.items['name']))
+        names.extend(name for store_id in self._materialized for name in self.items_by_name[store_id])
+        return list(dict.fromkeys(names))
+
+    def category_item_names(self) -> dict:
+        if self.columns is None:
+            return super().category_item_names()
+        # Distinct (category, item name) pairs straight from the arrays, skipping materialized stores.
+        columns = self.columns
+        counts = np.diff(columns.item_offsets)
+        live = np.array([store['id'] not in self._materialized for store in self.stores], dtype=bool)
+        store_categories = np.where(live, columns.stores['category'].astype(np.int64), -1)
+        # Both ids fit in 32 bits, so each pair packs into one int64 for a 1-D unique.
+        pairs = np.unique((np.repeat(store_categories, counts) << 32) | columns.items['name'].astype(np.int64))
+        pairs = pairs[pairs >= 0]
+        categories = columns.strings(pairs >> 32)
+        names = columns.strings(pairs & 0xFFFFFFFF)
+        result = {}
+        for category, name in zip(categories, names):
+            result.setdefault(category, []).append(name)
+        for store_id in self._materialized:
+            store = self.stores_by_id[store_id]
+            result.setdefault(store.get('category'), []).extend(self.items_by_name[store_id])
+        return {category: list(dict.fromkeys(names)) for category, names in result.items()}
+
+    def inventory(self, store_id: str) -> list:
+        store = self.stores_by_id[store_id]
+        if self.columns is None or 'inventory' in store:
+            return store.get('inventory', [])
+        return list(self.items_by_name[store_id].values())
+
+    def full_store(self, store: dict) -> dict:
+        return store if 'inventory' in store else {**store, 'inventory': self.inventory(store['id'])}
+
+    def _fresh_state(self, stores: list):
+        state = super()._fresh_state(stores)
+        state.columns = None
+        state._materialized = set()
+        return state
+
+    def _replace_store(self, old: dict, new: dict, changed_items: list = ()):
+        if 'inventory' not in new:
+            new = {**new, 'inventory': self.inventory(new['id'])}
+        self._materialized.add(new['id'])
+        super()._replace_store(old, new, changed_items)
+
+
+for _name in ('columns', '_materialized'):
+    setattr(ColumnarCatalog, _name, _state_attribute(_name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert stores.json to the memory-mapped columnar catalog format.")
+    parser.add_argument("--input", default="data/stores.json")
+    parser.add_argument("--output", default="data/stores.columnar")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with open(args.input, 'r') as f:
+        stores = json.load(f)
+    loaded = time.perf_counter()
+    meta = write_columns(stores, args.output, source_path=args.input)
+    written = time.perf_counter()
+    catalog = ColumnarCatalog.open(args.output)
+    opened = time.perf_counter()
+
+    size = sum(os.path.getsize(os.path.join(args.output, name)) for name in os.listdir(args.output))
+    print(f"{args.input}: {os.path.getsize(args.input) / 1e6:.1f} MB, json.load {1000 * (loaded - started):.0f} ms")
+    print(f"{args.output}: {size / 1e6:.1f} MB ({meta['stores']} stores, {meta['items']} items, {meta['strings']} strings), "
+          f"written in {1000 * (written - loaded):.0f} ms, opened in {1000 * (opened - written):.0f} ms ({len(catalog)} stores)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# fake_llm.py - Deterministic local stand-in for the Gemini model (benchmarks and offline runs)
+#
+# Point the agent at it with `agent.use_llm(FakeGenerativeModel())`, or start the server
+# with AGENT_LLM=fake. Answers are schema-valid for every prompt the agent sends and depend
+# only on the prompt text, so runs are reproducible. `failure_rate` (FAKE_LLM_FAILURE_RATE) makes a
+# share of calls fail with a 429, to exercise the scheduler's retries offline.
+
+import re
+import ast
+import json
+import time
+import random
+import asyncio
+import hashlib
+
+
+# Slot decompositions for the goals used in benchmarks and demos, keyed by a word of the goal.
+# Any other goal is decomposed into one slot per content word.
+RECIPES = {
+    "cookies": [["flour"], ["sugar", "brown sugar"], ["butter"], ["eggs"], ["chocolate chips"]],
+    "sandwich": [["bread"], ["ham", "turkey", "chicken"], ["cheddar cheese", "cheese"], ["mayonnaise", "mustard"]],
+    "shelf": [["drill"], ["screws", "nails"], ["level"]],
+    "office": [["monitor"], ["keyboard"], ["mouse"], ["webcam", "headphones"]],
+    "trip": [["standard gas", "premium gas", "diesel"], ["snacks", "water"]],
+}
+STOPWORDS = {"a", "an", "and", "the", "to", "for", "of", "with", "some", "i", "need", "want", "my", "me", "make", "buy", "get"}
+
+
+class FakeRateLimitError(Exception):
+    """Stands in for the provider's 429 (google.api_core's ResourceExhausted carries `code` too)."""
+    code = 429
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-z]+", text.lower()))
+
+
+def _goal(prompt: str) -> str:
+    match = re.search(r'\*\*User\'s (?:Latest Request|Goal):\*\* "(.*?)"', prompt, re.S)
+    return match.group(1) if match else ""
+
+
+def _pick_items(goal: str, names: list, basket_size: int) -> list:
+    """Items sharing a word with the goal first, then catalog order; None when the store is empty."""
+    if not names:
+        return None
+    goal_words = _words(goal)
+    related = [name for name in names if _words(name) & goal_words]
+    others = [name for name in names if name not in related]
+    return (related + others)[:basket_size]
+
+
+class FakeGenerativeModel:
+    """
+    Mimics the parts of `genai.GenerativeModel` the agent uses (`generate_content` and
+    `generate_content_async`, with `stream=True` support). `latency` seconds (plus up to
+    `jitter` seconds, derived from the prompt hash) are slept per call to model network time.
+    """
+
+    # Rate-limit bucket in scheduler.py (unlimited unless LLM_RPM_FAKE is set).
+    provider = "fake"
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, basket_size: int = 4, model_name: str = "fake-llm",
+                 failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.basket_size = basket_size
+        self.model_name = model_name
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self.prompt_chars = 0
+
+    # --- genai-compatible API ---
+
+    def generate_content(self, prompt: str, request_options=None, stream: bool = False):
+        self._account(prompt)
+        time.sleep(self._delay(prompt))
+        self._maybe_fail()
+        text = self.answer(prompt)
+        return [FakeResponse(chunk) for chunk in self._chunks(text)] if stream else FakeResponse(text)
+
+    async def generate_content_async(self, prompt: str, request_options=None, stream: bool = False):
+        self._account(prompt)
+        await asyncio.sleep(self._delay(prompt))
+        self._maybe_fail()
+        text = self.answer(prompt)
+        if not stream:
+            return FakeResponse(text)
+
+        async def chunks():
+            for chunk in self._chunks(text):
+                yield FakeResponse(chunk)
+        return chunks()
+
+    # --- Answers ---
+
+    def answer(self, prompt: str) -> str:
+        """The deterministic answer for `prompt`, recognized by the output schema it asks for."""
+        if '"slots"' in prompt:
+            goal_words = re.findall(r"[a-z]+", _goal(prompt).lower())
+            recipe = next((RECIPES[word] for word in goal_words if word in RECIPES), None)
+            recipe = recipe or [[word] for word in goal_words if word not in STOPWORDS]
+            return json.dumps({"slots": [{"name": options[0], "options": options, "optional": False} for options in recipe] or None})
+        if '"assembled_lists"' in prompt:
+            match = re.search(r"\(keyed by store id\):\*\*\s*(\{.*?\})\s*\n", prompt, re.S)
+            inventories = json.loads(match.group(1)) if match else {}
+            goal = _goal(prompt)
+            return json.dumps({"assembled_lists": {store_id: _pick_items(goal, names, self.basket_size)
+                                                   for store_id, names in inventories.items()}})
+        if '"assembled_list"' in prompt:
+            match = re.search(r"\*\*This Store's Available Inventory:\*\*\s*(\[.*?\])\s*\n", prompt, re.S)
+            names = ast.literal_eval(match.group(1)) if match else []
+            return json.dumps({"assembled_list": _pick_items(_goal(prompt), names, self.basket_size)})
+        if '"category"' in prompt:
+            match = re.search(r"\*\*Valid Categories:\*\*\s*(\[.*?\])", prompt)
+            categories = ast.literal_eval(match.group(1)) if match else ["Groceries"]
+            history = prompt.split("**Conversation History:**")[-1].split("**Valid Categories:**")[0].lower()
+            chosen = next((c for c in categories if c.lower() in history), categories[0])
+            return json.dumps({"category": chosen})
+        return f"Fake recommendation for: {_goal(prompt) or 'your request'}. The #1 store is the best pick."
+
+    # --- Internals ---
+
+    def _account(self, prompt: str):
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+
+    def _maybe_fail(self):
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.failures += 1
+            raise FakeRateLimitError("Fake rate limit exceeded.")
+
+    def _delay(self, prompt: str) -> float:
+        if not self.jitter:
+            return self.latency
+        fraction = int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+        return self.latency + self.jitter * fraction
+
+    @staticmethod
+    def _chunks(text: str, words_per_chunk: int = 4) -> list:
+        words = text.split(" ")
+        return [" ".join(words[i:i + words_per_chunk]) + (" " if i + words_per_chunk < len(words) else "")
+                for i in range(0, len(words), words_per_chunk)]
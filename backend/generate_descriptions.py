@@ -1,8 +1,16 @@
 import json
 import os
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from groq import Groq
 from dotenv import load_dotenv
 
+from llm_cache import llm_cache
+from scheduler import scheduler
+from changelog import write_json_atomic
+
 # Load environment variables
 load_dotenv()
 
@@ -14,8 +22,40 @@ except Exception as e:
     print(f"Error: {str(e)}")
     exit(1)
 
-def generate_store_description(store):
-    """Generate a detailed and engaging description for a store using Groq AI"""
+GROQ_MODEL = "llama3-8b-8192"
+
+# Path to the stores.json file the frontend serves
+INPUT_FILE = "../frontend/chat-interface/public/data/stores.json"
+# Groq calls in flight at once
+MAX_WORKERS = int(os.getenv("DESCRIBE_MAX_WORKERS", "4"))
+# Completed stores between atomic rewrites of the output file (the journal covers the gaps)
+CHECKPOINT_EVERY = 100
+
+
+def _inventory_categories(store):
+    return sorted(set(item.get('category', '') for item in store.get('inventory', []) if item.get('category')))
+
+
+def store_content_hash(store):
+    """
+    Hash of everything the description prompt is built from (name, category, address,
+    inventory categories, rating) plus the model. An unchanged hash means the stored
+    description is still current.
+    """
+    tags = store.get('tags', {})
+    content = {
+        "name": store.get('name'),
+        "category": store.get('category'),
+        "address": [store.get('location'), tags.get('addr:street'), tags.get('addr:city')],
+        "inventoryCategories": _inventory_categories(store),
+        "rating": store.get('rating'),
+        "model": GROQ_MODEL,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def generate_store_description(store, force=False):
+    """Generate a detailed and engaging description for a store using Groq AI (`force` skips the response cache)"""
     name = store['name']
     tags = store.get('tags', {})
     category = store.get('category', 'grocery store')
@@ -47,7 +87,7 @@ def generate_store_description(store):
     # Add inventory context if available
     if 'inventory' in store and store['inventory']:
         # Get unique categories from inventory
-        categories = list(set(item.get('category', '') for item in store['inventory'] if item.get('category')))
+        categories = _inventory_categories(store)
         if categories:
             prompt += f"\nThe store offers products in categories like: {', '.join(categories[:5])}."
     
@@ -65,8 +105,7 @@ def generate_store_description(store):
     Avoid using the store's name more than once in the description.
     """
     
-    try:
-        # Call Groq API
+    def request():
         chat_completion = client.chat.completions.create(
             messages=[
                 {
@@ -78,26 +117,69 @@ def generate_store_description(store):
                     "content": prompt
                 }
             ],
-            model="llama3-8b-8192",
+            model=GROQ_MODEL,
             temperature=0.7,
             max_tokens=150,
             top_p=1,
         )
-        
         return chat_completion.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"Error generating description for {name}: {str(e)}")
-        return f"{name} is a local grocery store offering a variety of products."
+
+    def call():
+        # Background lane: interactive calls sharing this process's Groq budget go first.
+        # Rate limits, timeouts and server errors are retried with jittered backoff by the scheduler.
+        return scheduler.call("groq", request, key=(GROQ_MODEL, prompt), lane="background")
+
+    # Call Groq API (served from the response cache when this exact prompt was seen before;
+    # with `force` always called, and the fresh description replaces the cached one).
+    # Errors propagate so the caller can leave the store to be retried on the next run.
+    if force:
+        description = call()
+        llm_cache.put(GROQ_MODEL, prompt, description)
+        return description
+    return llm_cache.get_or_generate(GROQ_MODEL, prompt, call)
+
+
+def _read_journal(journal_file):
+    """{store id: journal entry} of descriptions finished by an earlier, interrupted run."""
+    entries = {}
+    try:
+        with open(journal_file, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entries[entry['id']] = entry
+                except (ValueError, KeyError):
+                    # A line cut off by the interruption
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _set_description(store, description, content_hash):
+    store.setdefault('tags', {})
+    store['tags']['description'] = description
+    store['tags']['descriptionHash'] = content_hash
+
 
 def main():
-    # Path to the stores.json file
-    input_file = "../frontend/chat-interface/public/data/stores.json"
-    backup_file = "../frontend/chat-interface/public/data/stores_backup.json"
+    parser = argparse.ArgumentParser(description="Generate store descriptions with Groq.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--force", action="store_true", help="regenerate descriptions even for unchanged stores, bypassing the response cache")
+    args = parser.parse_args()
+    input_file = args.input
+    backup_file = os.path.splitext(input_file)[0] + "_backup.json"
+    # Each finished description is appended here, so an interrupted run resumes where it stopped.
+    journal_file = input_file + ".journal"
     
     # Create a backup of the original file
-    import shutil
-    shutil.copy2(input_file, backup_file)
-    print(f"Created backup at {backup_file}")
+    try:
+        shutil.copy2(input_file, backup_file)
+        print(f"Created backup at {backup_file}")
+    except OSError as e:
+        print(f"Error backing up {input_file}: {str(e)}")
+        return
     
     # Read the existing data
     try:
@@ -107,29 +189,54 @@ def main():
         print(f"Error reading {input_file}: {str(e)}")
         return
     
-    # Process each store
-    for i, store in enumerate(stores):
-        print(f"Processing store {i+1}/{len(stores)}: {store['name']}")
-        
-        # Remove existing description if it exists
-        if 'tags' in store and 'description' in store['tags']:
-            del store['tags']['description']
+    # Skip stores whose description was generated from the same content, and reuse
+    # journal entries from an interrupted run whose content still matches.
+    journal = _read_journal(journal_file)
+    hashes = {store['id']: store_content_hash(store) for store in stores}
+    todo, resumed = [], 0
+    for store in stores:
+        entry = journal.get(store['id'])
+        if entry and entry.get('hash') == hashes[store['id']]:
+            _set_description(store, entry['description'], entry['hash'])
+            resumed += 1
+            continue
+        tags = store.get('tags', {})
+        if not args.force and tags.get('description') and tags.get('descriptionHash') == hashes[store['id']]:
+            continue
+        todo.append(store)
+    print(f"{len(stores)} stores: {len(stores) - len(todo) - resumed} unchanged, {resumed} resumed from journal, {len(todo)} to generate")
+    
+    done, failed = 0, 0
+    with open(journal_file, 'a') as journal_out, ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(generate_store_description, store, args.force): store for store in todo}
+        for future in as_completed(futures):
+            store = futures[future]
+            try:
+                description = future.result()
+            except Exception as e:
+                # Left without a hash, so the next run tries again.
+                print(f"Error generating description for {store['name']}: {str(e)}")
+                failed += 1
+                if not store.get('tags', {}).get('description'):
+                    store.setdefault('tags', {})['description'] = f"{store['name']} is a local grocery store offering a variety of products."
+                continue
+            _set_description(store, description, hashes[store['id']])
+            journal_out.write(json.dumps({"id": store['id'], "hash": hashes[store['id']], "description": description}) + "\n")
+            journal_out.flush()
+            done += 1
+            print(f"Processed store {done + failed}/{len(todo)}: {store['name']} - {description[:80]}...")
             
-        # Generate new description
-        description = generate_store_description(store)
-        
-        # Add description to store data
-        if 'tags' not in store:
-            store['tags'] = {}
-        store['tags']['description'] = description
-        
-        print(f"  - Added description: {description[:80]}...")
-        
-        # Save after each store in case of errors
-        with open(input_file, 'w') as f:
-            json.dump(stores, f, indent=2)
+            if done % CHECKPOINT_EVERY == 0:
+                write_json_atomic(input_file, stores, indent=2)
+    
+    if done or resumed or failed:
+        write_json_atomic(input_file, stores, indent=2)
+    # Everything in the journal is now in the output file.
+    if os.path.exists(journal_file):
+        os.remove(journal_file)
     
-    print(f"\nUpdated {len(stores)} stores with descriptions in {input_file}")
+    print(f"\nUpdated {done + resumed} stores with descriptions in {input_file} ({failed} failed)")
+    print(f"LLM cache: {llm_cache.stats()}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,100 @@
+# geo.py - Grid spatial index over store lat/long for nearest-N, radius and bbox queries
+
+import math
+from collections import defaultdict
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance in km from (lat, lon) to every point in the `lats` / `lons` arrays."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class GeoIndex:
+    """
+    Buckets stores into a uniform lat/long grid (`cell_deg` degrees per side) so queries
+    only look at the cells that can contain matches instead of every store in the catalog.
+    Stores without usable coordinates are left out of the index.
+    """
+
+    def __init__(self, stores: list, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        located = [s for s in stores if isinstance(s.get('lat'), (int, float)) and isinstance(s.get('long'), (int, float))]
+        self.store_ids = [s['id'] for s in located]
+        self.categories = [s.get('category') for s in located]
+        self.lats = np.array([s['lat'] for s in located], dtype=np.float64)
+        self.lons = np.array([s['long'] for s in located], dtype=np.float64)
+        self.cells = defaultdict(list)
+        for i, (lat, lon) in enumerate(zip(self.lats.tolist(), self.lons.tolist())):
+            self.cells[self._cell(lat, lon)].append(i)
+
+    def __len__(self):
+        return len(self.store_ids)
+
+    def _cell(self, lat: float, lon: float) -> tuple:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def _indices_in_cells(self, min_lat, min_lon, max_lat, max_lon) -> np.ndarray:
+        (row_lo, col_lo), (row_hi, col_hi) = self._cell(min_lat, min_lon), self._cell(max_lat, max_lon)
+        # Fewer occupied cells than the query window covers: walking the occupied ones is cheaper.
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > len(self.cells):
+            found = [i for (row, col), members in self.cells.items()
+                     if row_lo <= row <= row_hi and col_lo <= col <= col_hi for i in members]
+        else:
+            found = [i for row in range(row_lo, row_hi + 1) for col in range(col_lo, col_hi + 1)
+                     for i in self.cells.get((row, col), ())]
+        return np.array(found, dtype=np.int64)
+
+    def _filter_category(self, indices: np.ndarray, category: str) -> np.ndarray:
+        if category is None:
+            return indices
+        return np.array([i for i in indices.tolist() if self.categories[i] == category], dtype=np.int64)
+
+    # --- Queries ---
+    # All queries return [(store_id, distance_km), ...]; bbox results carry None for distance.
+
+    def within_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float, category: str = None) -> list:
+        candidates = self._filter_category(self._indices_in_cells(min_lat, min_lon, max_lat, max_lon), category)
+        if candidates.size == 0:
+            return []
+        lats, lons = self.lats[candidates], self.lons[candidates]
+        inside = candidates[(lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)]
+        return [(self.store_ids[i], None) for i in np.sort(inside).tolist()]
+
+    def within_radius(self, lat: float, lon: float, radius_km: float, category: str = None) -> list:
+        """Stores within `radius_km` of (lat, lon), nearest first."""
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        # Longitude degrees shrink towards the poles; clamp so the window stays finite.
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        candidates = self._filter_category(self._indices_in_cells(lat - dlat, lon - dlon, lat + dlat, lon + dlon), category)
+        if candidates.size == 0:
+            return []
+        distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        keep = distances <= radius_km
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")
+        return [(self.store_ids[i], float(d)) for i, d in zip(candidates[order].tolist(), distances[order].tolist())]
+
+    def nearest(self, lat: float, lon: float, n: int, category: str = None, max_radius_km: float = None) -> list:
+        """
+        The `n` stores closest to (lat, lon), nearest first. Searches rings of grid cells
+        outwards and stops once `n` stores are found within a radius the ring fully covers.
+        """
+        if n <= 0 or not self.store_ids:
+            return []
+        cell_km = self.cell_deg * math.pi / 180 * EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 1e-6)
+        radius_km = cell_km
+        while True:
+            found = self.within_radius(lat, lon, radius_km, category)
+            if len(found) >= n or (max_radius_km is not None and radius_km >= max_radius_km) or radius_km > 2 * math.pi * EARTH_RADIUS_KM:
+                break
+            radius_km *= 2
+        if max_radius_km is not None:
+            found = [entry for entry in found if entry[1] <= max_radius_km]
+        return found[:n]
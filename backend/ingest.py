@@ -0,0 +1,418 @@
+# ingest.py - Streams supplier price lists (Pythoncode/*.json shape) into the store catalog
+#
+# Price lists look like
+#   [{"Store": "MegaMart", "Items": [{"Item": "Butter (1 lb)", "Price": 4.5, "Quality": "Middle"}, ...]}, ...]
+# They are parsed incrementally, one item object at a time, so memory is bounded by the catalog
+# being merged into, not by the size of the file. Every row is normalized to the catalog's item
+# shape (canonical name and unit, qualityScore from the text label) and merged per store; the
+# merged catalog is written once at the end through the live-catalog snapshot (see changelog.py),
+# which a running server picks up on its next watch pass.
+#
+#   python ingest.py ../Pythoncode/majorstoreprice.json --store "MegaMart=store-001"
+#   python ingest.py dump.json --create-stores --category Groceries --lat 37.87 --long -122.27 --location "Berkeley, CA"
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from functools import lru_cache
+
+from catalog import Catalog
+from changelog import LiveCatalog
+from slots import normalize_name
+
+STORES_FILE = 'data/stores.json'
+CHANGES_FILE = 'data/stores.changes.jsonl'
+COLUMNAR_DIR = 'data/stores.columnar'
+
+# Characters read from the file per refill; one item object never needs more than a couple of these.
+CHUNK_SIZE = 1 << 16
+# Longest single JSON value accepted; beyond this a malformed file is reported instead of buffered.
+MAX_VALUE_CHARS = 1 << 24
+# Rows between progress lines.
+PROGRESS_EVERY = 100_000
+
+# Text quality labels -> qualityScore (0-10). Numeric labels are used as-is.
+QUALITY_SCORES = {
+    "very low": 1, "low": 3, "budget": 3, "economy": 3,
+    "middle": 6, "mid": 6, "medium": 6, "average": 6, "standard": 6,
+    "high": 8, "premium": 9, "very high": 9, "excellent": 10,
+}
+# qualityScore for new items whose row has no usable Quality.
+DEFAULT_QUALITY = 5
+
+# Unit spellings -> canonical unit; counted units become "count".
+UNITS = {
+    "lb": "lb", "lbs": "lb", "pound": "lb", "pounds": "lb",
+    "oz": "oz", "ounce": "oz", "ounces": "oz",
+    "g": "g", "gram": "g", "grams": "g", "kg": "kg",
+    "ml": "ml", "l": "l", "liter": "l", "liters": "l", "litre": "l",
+    "gal": "gallon", "gallon": "gallon", "gallons": "gallon",
+    "qt": "quart", "quart": "quart", "pt": "pint", "pint": "pint",
+    "ct": "count", "count": "count", "pack": "count", "pk": "count", "each": "count", "ea": "count",
+}
+# Count words that carry their own quantity.
+COUNT_WORDS = {"dozen": 12, "half": 0.5}
+
+_LABEL = re.compile(r"^(?P<name>.*?)\s*\((?P<unit>[^()]*)\)\s*$")
+_UNIT_TOKEN = re.compile(r"\d+(?:\.\d+)?|[a-z]+")
+
+
+# --- Streaming parser ---
+
+class _Reader:
+    """A refilling character buffer over a text file, with just enough JSON scanning for price lists."""
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.consumed = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.consumed += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"{message} at character {self.consumed + self.pos}.")
+
+    def peek(self) -> str:
+        """The next non-whitespace character ('' at end of file), without consuming it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise self.error(f"Expected one of {chars!r}, found {char or 'end of file'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decodes the next complete JSON value, reading more of the file until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+                # A value running to the end of the buffer may be cut short ("4.5" read as "4.").
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof or len(self.buffer) - self.pos > MAX_VALUE_CHARS:
+                    raise self.error("Invalid JSON value") from None
+            self._fill()
+
+
+def iter_price_list(f, chunk_size: int = CHUNK_SIZE):
+    """
+    Yields (store name, raw item dict) for every entry of a price-list file opened in text mode
+    (a list of stores, or a single store object). Items listed before their store's "Store" key
+    are held until the name is read.
+    """
+    reader = _Reader(f, chunk_size)
+    if reader.peek() == "{":
+        yield from _iter_store(reader)
+        return
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield from _iter_store(reader)
+        if reader.expect(",]") == "]":
+            return
+
+
+def _iter_store(reader: _Reader):
+    reader.expect("{")
+    store_name, pending = None, []
+    if reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == "Store":
+            store_name = reader.value()
+            if not isinstance(store_name, str):
+                raise reader.error("\"Store\" must be a string")
+            yield from ((store_name, item) for item in pending)
+            pending = []
+        elif key == "Items":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    item = reader.value()
+                    if store_name is None:
+                        pending.append(item)
+                    else:
+                        yield store_name, item
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            reader.value()
+        if reader.expect(",}") == "}":
+            break
+    if pending:
+        raise reader.error("Store entry with items but no \"Store\" name")
+
+
+# --- Normalization ---
+
+@lru_cache(maxsize=1024)
+def _quality_label(label: str):
+    return QUALITY_SCORES.get(" ".join(label.lower().replace("-", " ").split()))
+
+
+def quality_score(label):
+    """qualityScore for a Quality label ("High", "middle", 7), or None when it can't be read."""
+    if isinstance(label, (int, float)) and not isinstance(label, bool):
+        return max(0, min(10, int(round(label))))
+    if isinstance(label, str):
+        return _quality_label(label)
+    return None
+
+
+def canonical_unit(text: str) -> tuple:
+    """
+    (label, quantity, unit) for a unit suffix: "5 lb bag" -> ("5 lb bag", 5.0, "lb"),
+    "half gallon" -> ("0.5 gallon", 0.5, "gallon"), "dozen" -> ("12 count", 12.0, "count"),
+    "500ml" -> ("500 ml", 500.0, "ml"). Suffixes without a measure ("box", "family size") keep
+    their words and have no quantity.
+    """
+    tokens = _UNIT_TOKEN.findall(text.lower())
+    quantity, unit, words = None, None, []
+    for token in tokens:
+        if token[0].isdigit():
+            quantity = float(token) * (quantity or 1)
+        elif token in COUNT_WORDS:
+            quantity = float(COUNT_WORDS[token]) * (quantity or 1)
+            if token == "dozen":
+                unit = unit or "count"
+        elif token in UNITS and unit is None:
+            unit = UNITS[token]
+        else:
+            words.append(token)
+    if unit is None:
+        return " ".join(tokens), None, None
+    quantity = quantity or 1.0
+    return " ".join([f"{quantity:g} {unit}"] + words), quantity, unit
+
+
+# Supplier lists repeat the same few thousand labels across stores, so parsing is memoized.
+@lru_cache(maxsize=65536)
+def parse_label(label: str) -> tuple:
+    """
+    (canonical item name, merge key, quantity, unit) of an item label: "Eggs  (dozen)" ->
+    ("Eggs (12 count)", ("egg", "12 count"), 12.0, "count"). The key is the normalized name plus
+    the canonical unit, so "apple (1 LB)" and "Apples (1 lb)" merge into one item.
+    """
+    label = " ".join(label.split())
+    match = _LABEL.match(label)
+    if not match:
+        return label, (normalize_name(label), None), None, None
+    name = match.group("name")
+    unit_label, quantity, unit = canonical_unit(match.group("unit"))
+    return (f"{name} ({unit_label})" if unit_label else name), (normalize_name(name), unit_label or None), quantity, unit
+
+
+def item_key(item_name: str) -> tuple:
+    """Merge key of an item name (see `parse_label`)."""
+    return parse_label(item_name)[1]
+
+
+def normalize_row(raw: dict):
+    """The catalog item for one price-list row, or None when it has no usable name or price."""
+    if not isinstance(raw, dict):
+        return None
+    label, price = raw.get("Item"), raw.get("Price")
+    if not isinstance(label, str) or isinstance(price, bool) or not isinstance(price, (int, float)) or price < 0:
+        return None
+    name, key, quantity, unit = parse_label(label)
+    if not key[0]:
+        return None
+    item = {"itemName": name, "price": round(float(price), 2)}
+    score = quality_score(raw.get("Quality"))
+    if score is not None:
+        item["qualityScore"] = score
+    item["inStock"] = raw["InStock"] if isinstance(raw.get("InStock"), bool) else True
+    if unit is not None:
+        item["quantity"], item["unit"] = quantity, unit
+    return item
+
+
+# --- Merging ---
+
+class PriceListMerger:
+    """
+    Merges normalized rows into a list of store dicts. A row updates the store's item with the same
+    `item_key` (price, stock, and qualityScore when the row has one) or is appended as a new item.
+    Rows for stores that aren't in the catalog (by `aliases`, id or case-insensitive name) are
+    skipped, unless `new_store` is given: then it builds the store to create from the name.
+    Touched stores are copied before they change, so `stores` itself is never mutated.
+    """
+
+    def __init__(self, stores: list, aliases: dict = None, new_store=None):
+        self.stores = list(stores)
+        self.new_store = new_store
+        self.aliases = dict(aliases or {})
+        self._by_id = {store['id']: position for position, store in enumerate(self.stores)}
+        self._by_name = {}
+        for position, store in enumerate(self.stores):
+            self._by_name.setdefault(str(store.get('name', '')).casefold(), position)
+        self._item_positions = {}
+        self._last = (None, None)
+        self.counters = {"rows": 0, "added": 0, "updated": 0, "skipped": 0, "unknownStore": 0, "storesCreated": 0}
+
+    def _store_position(self, store_name: str):
+        # Rows arrive grouped by store, so the previous row's answer is usually this row's.
+        if self._last[0] == store_name:
+            return self._last[1]
+        position = self._resolve_store(store_name)
+        self._last = (store_name, position)
+        return position
+
+    def _resolve_store(self, store_name: str):
+        store_id = self.aliases.get(store_name)
+        if store_id is not None:
+            return self._by_id.get(store_id)
+        position = self._by_id.get(store_name)
+        if position is None:
+            position = self._by_name.get(store_name.casefold())
+        if position is None and self.new_store is not None:
+            store = self.new_store(store_name, set(self._by_id))
+            position = len(self.stores)
+            self.stores.append({**store, 'inventory': []})
+            self._by_id[store['id']] = position
+            self._by_name[store_name.casefold()] = position
+            self.counters["storesCreated"] += 1
+        return position
+
+    def _items(self, position: int) -> dict:
+        """item key -> inventory index of a store, copying the store on first touch."""
+        positions = self._item_positions.get(position)
+        if positions is None:
+            store = self.stores[position]
+            self.stores[position] = {**store, 'inventory': list(store.get('inventory', []))}
+            positions = self._item_positions[position] = {
+                item_key(item['itemName']): i for i, item in enumerate(self.stores[position]['inventory'])}
+        return positions
+
+    def add(self, store_name: str, raw: dict):
+        self.counters["rows"] += 1
+        position = self._store_position(store_name)
+        if position is None:
+            self.counters["unknownStore"] += 1
+            return
+        item = normalize_row(raw)
+        if item is None:
+            self.counters["skipped"] += 1
+            return
+        positions = self._items(position)
+        inventory = self.stores[position]['inventory']
+        key = item_key(item['itemName'])
+        if key in positions:
+            existing = inventory[positions[key]]
+            # Keep the catalog's own name for the item; the price list only moves its numbers.
+            inventory[positions[key]] = {**existing, **item, 'itemName': existing['itemName']}
+            self.counters["updated"] += 1
+        else:
+            positions[key] = len(inventory)
+            inventory.append({**item, 'qualityScore': item.get('qualityScore', DEFAULT_QUALITY)})
+            self.counters["added"] += 1
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-") or "store"
+
+
+def ingest(paths: list, live: LiveCatalog, aliases: dict = None, new_store=None) -> dict:
+    """
+    Streams every file in `paths` into `live`'s catalog, writes the snapshot once and returns the counters.
+    If the catalog changes while the files are parsed (e.g. a server compacts its change log), they are
+    merged again on top of the new catalog before anything is written.
+    """
+    started = time.perf_counter()
+    size = sum(os.path.getsize(path) for path in paths)
+    merged = {}
+
+    def merge(stores: list) -> list:
+        merger = merged['merger'] = PriceListMerger(stores, aliases, new_store)
+        merge_started = time.perf_counter()
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                for store_name, raw in iter_price_list(f):
+                    merger.add(store_name, raw)
+                    if merger.counters["rows"] % PROGRESS_EVERY == 0:
+                        elapsed = time.perf_counter() - merge_started
+                        print(f"[Ingest: {merger.counters['rows']:,} rows, {merger.counters['rows'] / elapsed:,.0f} rows/s]")
+        merged['seconds'] = time.perf_counter() - merge_started
+        return merger.stores
+
+    live.rewrite(merge)
+    elapsed = time.perf_counter() - started
+    counters, parse_seconds = merged['merger'].counters, max(merged['seconds'], 1e-9)
+    rows = counters["rows"]
+    print(f"[Ingest: {rows:,} rows ({size / 1e6:.1f} MB) in {elapsed:.2f}s: {rows / parse_seconds:,.0f} rows/s, "
+          f"{size / 1e6 / parse_seconds:.1f} MB/s parsing; {elapsed - parse_seconds:.2f}s writing]")
+    return {**counters, "bytes": size, "seconds": round(elapsed, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream supplier price lists into the store catalog.")
+    parser.add_argument("paths", nargs="+", help="Price-list JSON files ([{\"Store\", \"Items\": [{\"Item\", \"Price\", \"Quality\"}]}])")
+    parser.add_argument("--store", action="append", default=[], metavar="NAME=ID",
+                        help="Map a price-list store name to a catalog store id (repeatable)")
+    parser.add_argument("--create-stores", action="store_true", help="Add stores that aren't in the catalog yet")
+    parser.add_argument("--category", default="Groceries", help="Category of created stores")
+    parser.add_argument("--lat", type=float, help="Latitude of created stores")
+    parser.add_argument("--long", type=float, help="Longitude of created stores")
+    parser.add_argument("--location", help="Address of created stores")
+    args = parser.parse_args()
+
+    aliases = {}
+    for mapping in args.store:
+        name, sep, store_id = mapping.partition("=")
+        if not sep:
+            parser.error(f"--store expects NAME=ID, got {mapping!r}")
+        aliases[name] = store_id
+    new_store = None
+    if args.create_stores:
+        if args.lat is None or args.long is None or not args.location:
+            parser.error("--create-stores needs --lat, --long and --location for the new stores")
+
+        def new_store(name, taken):
+            store_id, n = f"store-{_slug(name)}", 2
+            while store_id in taken:
+                store_id, n = f"store-{_slug(name)}-{n}", n + 1
+            return {'id': store_id, 'name': name, 'category': args.category,
+                    'lat': args.lat, 'long': args.long, 'location': args.location}
+
+    catalog = Catalog.from_file(STORES_FILE)
+    live = LiveCatalog(catalog, STORES_FILE, CHANGES_FILE, compact_every=0,
+                       columnar_path=COLUMNAR_DIR if os.path.isdir(COLUMNAR_DIR) else None)
+    counters = ingest(args.paths, live, aliases, new_store)
+    print(f"Added {counters['added']}, updated {counters['updated']}, created {counters['storesCreated']} stores; "
+          f"skipped {counters['skipped']} invalid rows and {counters['unknownStore']} rows for unknown stores.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# llm_cache.py - Response cache for LLM calls (in-memory LRU + optional SQLite tier)
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from metrics import metrics
+
+# --- Configuration ---
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+# Path to a SQLite file for the persistent tier. Empty disables it.
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses whitespace so indentation changes in prompt templates don't bust the cache."""
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def make_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+def inventory_hash(store: dict) -> str:
+    """Stable hash of a store's inventory, used to invalidate assembly entries when it changes."""
+    payload = json.dumps(store.get("inventory", []), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Caches LLM results keyed on model + normalized prompt.
+
+    Entries can carry `tags`, a {tag: version} dict (e.g. {store_id: inventory_hash}).
+    When a tag is seen with a new version, every entry carrying that tag is dropped, and
+    entries whose recorded version no longer matches are never served.
+    Only values that `generate` returned successfully are stored, so callers should parse
+    and validate inside `generate` and raise on bad output.
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_seconds: float = LLM_CACHE_TTL, db_path: str = LLM_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # key -> (expires_at, tags, value)
+        self._tag_versions = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "invalidations": 0, "evictions": 0}
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, model TEXT, tags TEXT, value TEXT, expires_at REAL)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache_tags (tag TEXT, key TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_tags_tag ON llm_cache_tags (tag)")
+            self._db.commit()
+
+    # --- Public API ---
+
+    def get_or_generate(self, model: str, prompt: str, generate, tags: dict = None):
+        """Returns the cached value for (model, prompt), calling `generate()` and storing its result on a miss."""
+        key = make_key(model, prompt)
+        tags = tags or {}
+        self._observe_tags(tags)
+
+        found, value = self._lookup(key, tags)
+        if found:
+            return value
+
+        value = generate()
+        self._store(key, model, tags, value)
+        return value
+
+    def lookup(self, model: str, prompt: str, tags: dict = None):
+        """Returns (found, value) without generating anything on a miss."""
+        tags = tags or {}
+        self._observe_tags(tags)
+        return self._lookup(make_key(model, prompt), tags)
+
+    def put(self, model: str, prompt: str, value, tags: dict = None):
+        """Stores a value produced outside `get_or_generate` (e.g. a fully consumed stream)."""
+        self._store(make_key(model, prompt), model, tags or {}, value)
+
+    def invalidate_tag(self, tag: str):
+        """Drops every entry carrying `tag`."""
+        with self._lock:
+            self._invalidate_tag_locked(tag)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._tag_versions.clear()
+            if self._db:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.execute("DELETE FROM llm_cache_tags")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hitRate": round(self.counters["hits"] / lookups, 3) if lookups else 0.0,
+                "memoryEntries": len(self._memory),
+                "diskEnabled": self._db is not None,
+            }
+
+    # --- Internals ---
+
+    def _observe_tags(self, tags: dict):
+        with self._lock:
+            for tag, version in tags.items():
+                previous = self._tag_versions.get(tag)
+                if previous is not None and previous != version:
+                    self._invalidate_tag_locked(tag)
+                self._tag_versions[tag] = version
+
+    def _invalidate_tag_locked(self, tag: str):
+        stale = [key for key, (_, tags, _) in self._memory.items() if tag in tags]
+        for key in stale:
+            del self._memory[key]
+        if self._db:
+            self._db.execute("DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache_tags WHERE tag = ?)", (tag,))
+            self._db.execute("DELETE FROM llm_cache_tags WHERE tag = ?", (tag,))
+            self._db.commit()
+        self.counters["invalidations"] += 1
+
+    def _lookup(self, key: str, tags: dict):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, entry_tags, value = entry
+                if expires_at > now and entry_tags == tags:
+                    self._memory.move_to_end(key)
+                    self.counters["hits"] += 1
+                    self.counters["memory_hits"] += 1
+                    metrics.inc("llm_cache_lookups_total", result="memory_hit")
+                    return True, value
+                del self._memory[key]
+
+            if self._db:
+                row = self._db.execute("SELECT tags, value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry_tags, value, expires_at = json.loads(row[0]), json.loads(row[1]), row[2]
+                    if expires_at > now and entry_tags == tags:
+                        self._remember_locked(key, expires_at, tags, value)
+                        self.counters["hits"] += 1
+                        self.counters["disk_hits"] += 1
+                        metrics.inc("llm_cache_lookups_total", result="disk_hit")
+                        return True, value
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.counters["misses"] += 1
+            metrics.inc("llm_cache_lookups_total", result="miss")
+            return False, None
+
+    def _store(self, key: str, model: str, tags: dict, value):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            # Don't store results computed against a version that changed while the call was in flight.
+            if any(self._tag_versions.get(tag) != version for tag, version in tags.items()):
+                return
+            self._remember_locked(key, expires_at, tags, value)
+            self.counters["stores"] += 1
+            if self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, tags, value, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, model, json.dumps(tags, sort_keys=True), json.dumps(value), expires_at),
+                )
+                self._db.execute("DELETE FROM llm_cache_tags WHERE key = ?", (key,))
+                self._db.executemany("INSERT INTO llm_cache_tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in tags])
+                self._db.commit()
+
+    def _remember_locked(self, key: str, expires_at: float, tags: dict, value):
+        self._memory[key] = (expires_at, tags, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+
+# Shared instance used by the agent and the maintenance scripts.
+llm_cache = LLMCache()
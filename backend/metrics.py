@@ -0,0 +1,166 @@
+# metrics.py - In-process counters, latency histograms and timing spans (Prometheus text format)
+
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Seconds; covers sub-millisecond local work up to slow LLM round-trips.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# The trace id of the request being handled (set per request by the servers, inherited by spans).
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+_HELP = {
+    "pipeline_stage_seconds": "Latency of pipeline stages (category, assembly, ranking, final, ...).",
+    "llm_calls_total": "LLM requests sent to the provider (retries included), by purpose.",
+    "llm_failures_total": "LLM calls that raised or returned unusable output, by purpose.",
+    "llm_prompt_chars_total": "Characters sent to the LLM, by purpose.",
+    "llm_response_chars_total": "Characters received from the LLM, by purpose.",
+    "llm_json_fallbacks_total": "LLM answers that could not be parsed as JSON, by purpose.",
+    "llm_cache_lookups_total": "LLM response cache lookups, by result.",
+    "llm_queue_seconds": "Time LLM calls waited for a rate-limit token, by provider and lane.",
+    "llm_retries_total": "LLM calls retried after a transient failure, by provider.",
+    "llm_coalesced_total": "LLM calls that shared an identical in-flight call's result, by provider.",
+    "prompt_inventory_items_total": "Inventory items sent in (or dropped from) assembly prompts by the retrieval shortlist.",
+    "category_fallbacks_total": "Requests whose category came from the substring fallback instead of the LLM.",
+    "category_decisions_total": "Step 1 category decisions, by path (local classifier or LLM).",
+    "http_request_seconds": "Latency of HTTP requests, by route.",
+    "http_requests_total": "HTTP requests handled, by route.",
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class _Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms keyed by metric name + labels."""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(value)
+
+    def counter_value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda kv: kv[0])
+            lines, seen = [], set()
+
+            def header(name, kind):
+                if name not in seen:
+                    seen.add(name)
+                    if name in _HELP:
+                        lines.append(f"# HELP {name} {_HELP[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+
+            for (name, labels), value in counters:
+                header(name, "counter")
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (name, labels), histogram in histograms:
+                header(name, "histogram")
+                # Bucket counts are already cumulative (observe() bumps every bucket >= the value).
+                for bound, count in zip(LATENCY_BUCKETS, histogram.bucket_counts):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Shared registry used by the agent, cache and servers.
+metrics = MetricsRegistry()
+
+
+# --- Tracing ---
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def set_trace_id(trace_id: str = None):
+    """Sets the trace id for the current request context; returns a token for `reset_trace_id`."""
+    return _trace_id.set(trace_id or new_trace_id())
+
+
+def reset_trace_id(token):
+    _trace_id.reset(token)
+
+
+def current_trace_id() -> str:
+    return _trace_id.get()
+
+
+def observe_stage(stage: str, started: float, **labels):
+    """
+    Records the time since `started` (a `time.perf_counter()` value) into
+    `pipeline_stage_seconds{stage=...}` and logs it with the current trace id.
+    """
+    elapsed = time.perf_counter() - started
+    metrics.observe("pipeline_stage_seconds", elapsed, stage=stage, **labels)
+    trace_id = current_trace_id()
+    if trace_id:
+        print(f"[Trace {trace_id}: {stage} took {elapsed * 1000:.1f} ms]")
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Times a block as a pipeline stage, e.g. `with span("ranking"): ...`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, started, **labels)
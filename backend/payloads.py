@@ -0,0 +1,85 @@
+# payloads.py - Pre-serialized, pre-compressed JSON response bodies with ETags
+
+import gzip
+import json
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Fields the map needs; everything except the (large) inventory.
+SUMMARY_FIELDS = ("id", "name", "category", "lat", "long", "location", "rating", "tags")
+
+
+def summarize_store(store: dict) -> dict:
+    return {field: store[field] for field in SUMMARY_FIELDS if field in store}
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """Picks "br", "gzip" or None from an Accept-Encoding header."""
+    offered = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name.strip().lower()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class Payload:
+    """One JSON body serialized once, with its ETag and lazily compressed variants."""
+
+    def __init__(self, data):
+        self.body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self._encoded = {None: self.body}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding: str) -> bytes:
+        with self._lock:
+            if encoding not in self._encoded:
+                if encoding == "br":
+                    self._encoded[encoding] = brotli.compress(self.body)
+                elif encoding == "gzip":
+                    self._encoded[encoding] = gzip.compress(self.body, compresslevel=6)
+                else:
+                    raise ValueError(f"Unsupported encoding: {encoding}")
+            return self._encoded[encoding]
+
+
+class PayloadCache:
+    """
+    Keeps `Payload`s for the current catalog version. Asking for a newer version drops
+    everything built for older ones, so a catalog change never serves stale bytes.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build) -> Payload:
+        """Returns the payload for `key` at `version`, serializing `build()` on first use."""
+        with self._lock:
+            if version != self._version:
+                self._payloads = {}
+                self._version = version
+            payload = self._payloads.get(key)
+        if payload is None:
+            payload = Payload(build())
+            with self._lock:
+                if version == self._version:
+                    payload = self._payloads.setdefault(key, payload)
+        return payload
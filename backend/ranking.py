@@ -0,0 +1,123 @@
+# ranking.py - Vectorized scoring and top-k selection for shopping options
+
+import numpy as np
+
+
+# --- Preference Functions ---
+# Each takes the (total_prices, average_qualities) arrays of all candidates and returns one
+# score per candidate. Higher scores rank first.
+
+def price_preference(total_prices: np.ndarray, average_qualities: np.ndarray) -> np.ndarray:
+    return -total_prices
+
+
+def quality_preference(total_prices: np.ndarray, average_qualities: np.ndarray) -> np.ndarray:
+    return average_qualities
+
+
+def balanced_preference(total_prices: np.ndarray, average_qualities: np.ndarray) -> np.ndarray:
+    """Quality per dollar; free baskets score 0 like the original lambda did."""
+    return np.divide(average_qualities, total_prices, out=np.zeros_like(average_qualities), where=total_prices > 0)
+
+
+PREFERENCES = {
+    "price": price_preference,
+    "quality": quality_preference,
+    "balanced": balanced_preference,
+}
+DEFAULT_PREFERENCE = "balanced"
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    spread = scores.max() - scores.min() if scores.size else 0
+    return (scores - scores.min()) / spread if spread > 0 else np.zeros_like(scores)
+
+
+def weighted_preference(weights: dict):
+    """
+    Combines registered preferences into one, e.g. weighted_preference({"price": 0.7, "quality": 0.3}).
+    Each component is min-max normalized over the candidates first so the weights are comparable.
+    """
+    components = [(PREFERENCES[name], weight) for name, weight in weights.items()]
+
+    def preference(total_prices, average_qualities):
+        scores = np.zeros(total_prices.shape, dtype=np.float64)
+        for fn, weight in components:
+            scores += weight * _min_max(fn(total_prices, average_qualities))
+        return scores
+    return preference
+
+
+def register_preference(name: str, fn):
+    """Makes `fn` available as a preference name for `score` / `rank_options`."""
+    PREFERENCES[name] = fn
+
+
+# --- Columnar Basket Table ---
+
+class BasketTable:
+    """
+    Holds candidate baskets as flat NumPy columns (one row per matched item plus the index
+    of the basket it belongs to) and computes per-basket totals and means in one pass.
+    """
+
+    def __init__(self, baskets: list):
+        lengths = np.fromiter((len(basket) for basket in baskets), dtype=np.int64, count=len(baskets))
+        n_items = int(lengths.sum())
+        self.basket_ids = np.repeat(np.arange(len(baskets)), lengths)
+        self.prices = np.fromiter((item['price'] for basket in baskets for item in basket), dtype=np.float64, count=n_items)
+        self.qualities = np.fromiter((item['qualityScore'] for basket in baskets for item in basket), dtype=np.float64, count=n_items)
+        self.lengths = lengths
+
+        # bincount handles empty baskets (they sum to 0) without special-casing.
+        price_sums = np.bincount(self.basket_ids, weights=self.prices, minlength=len(baskets))
+        quality_sums = np.bincount(self.basket_ids, weights=self.qualities, minlength=len(baskets))
+        means = np.divide(quality_sums, lengths, out=np.zeros_like(quality_sums), where=lengths > 0)
+
+        # Rounded exactly like the values shown to the user, so ranking agrees with what they see.
+        self.total_prices = np.round(price_sums, 2)
+        self.average_qualities = np.round(means, 1)
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+# --- Ranking ---
+
+def score(table: BasketTable, preference) -> np.ndarray:
+    """Scores every basket; `preference` is a registered name or a preference function."""
+    fn = preference if callable(preference) else PREFERENCES.get(preference, PREFERENCES[DEFAULT_PREFERENCE])
+    return fn(table.total_prices, table.average_qualities)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the `k` highest scores, best first. Uses a partition to find the k-th best
+    score so only the selected candidates get sorted; ties keep their original (catalog)
+    order, matching what a stable full sort would return.
+    """
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def rank_options(shopping_options: list, preference, k: int = None) -> list:
+    """
+    Fills in `totalPrice` / `averageQuality` on every option (from its `matchedItemsDetails`)
+    and returns the best `k` options for `preference`, best first.
+    """
+    table = BasketTable([option['matchedItemsDetails'] for option in shopping_options])
+    for option, total_price, average_quality in zip(shopping_options, table.total_prices.tolist(), table.average_qualities.tolist()):
+        option['totalPrice'] = total_price
+        option['averageQuality'] = average_quality
+    indices = top_k(score(table, preference), len(table) if k is None else k)
+    return [shopping_options[i] for i in indices.tolist()]
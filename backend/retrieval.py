@@ -0,0 +1,127 @@
+# retrieval.py - Character n-gram TF-IDF index over item names, for goal-relevant prompt shortlists
+#
+# Assembly prompts used to carry a store's whole in-stock list, so their size (and LLM cost and
+# latency) grew with the inventory. `RetrievalIndex` scores item names against the user's goal by
+# cosine similarity of character trigram TF-IDF vectors, and `shortlist` keeps the best-scoring
+# names that fit a token budget. Trigrams make the match tolerant of plurals, typos and
+# compound names ("choc chip" still finds "chocolate chips").
+
+import math
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from slots import normalize_name
+
+NGRAM = 3
+# Query score vectors kept per index; the same goal is scored against many stores per request.
+QUERY_CACHE_SIZE = 256
+
+
+def ngrams(text: str) -> Counter:
+    """Character n-grams of each normalized word, padded so word starts and ends count ("^ap", "le$")."""
+    grams = Counter()
+    for word in normalize_name(text).split():
+        padded = f"^{word}$"
+        if len(padded) <= NGRAM:
+            grams[padded] += 1
+            continue
+        for i in range(len(padded) - NGRAM + 1):
+            grams[padded[i:i + NGRAM]] += 1
+    return grams
+
+
+def list_tokens(names: list) -> int:
+    """Token estimate of `names` as a JSON list, on the same ~4 characters per token rule as agent.py."""
+    return (sum(len(name) for name in names) + 4 * len(names)) // 4 + 1
+
+
+class RetrievalIndex:
+    """
+    TF-IDF vectors (sublinear tf, smoothed idf, L2-normalized) over a vocabulary of item names,
+    stored as per-n-gram postings so a query only touches names sharing an n-gram with it.
+    Names that aren't in the vocabulary (added by a live update later) are vectorized on demand.
+    """
+
+    def __init__(self, names):
+        self.names = list(dict.fromkeys(names))
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.grams = {}
+        rows, cols, tfs = [], [], []
+        for row, name in enumerate(self.names):
+            for gram, count in ngrams(name).items():
+                rows.append(row)
+                cols.append(self.grams.setdefault(gram, len(self.grams)))
+                tfs.append(1.0 + math.log(count))
+        rows = np.array(rows, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int64)
+        document_frequency = np.bincount(cols, minlength=len(self.grams))
+        self.idf = np.log((1 + len(self.names)) / (1 + document_frequency)) + 1.0
+        weights = np.array(tfs, dtype=np.float64) * self.idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(self.names)))
+        weights /= np.where(norms > 0, norms, 1.0)[rows]
+        # Postings grouped by n-gram: the names (and weights) for gram g are [starts[g]:starts[g + 1]].
+        order = np.argsort(cols, kind='stable')
+        self.posting_rows = rows[order]
+        self.posting_weights = weights[order]
+        self.posting_starts = np.zeros(len(self.grams) + 1, dtype=np.int64)
+        np.cumsum(document_frequency, out=self.posting_starts[1:])
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def vector(self, text: str) -> dict:
+        """{gram id: weight} of `text`, L2-normalized; n-grams outside the vocabulary carry no weight."""
+        weights = {self.grams[gram]: (1.0 + math.log(count)) * self.idf[self.grams[gram]]
+                   for gram, count in ngrams(text).items() if gram in self.grams}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return {gram: w / norm for gram, w in weights.items()} if norm else {}
+
+    def query_scores(self, text: str) -> np.ndarray:
+        """Cosine similarity of `text` to every vocabulary name."""
+        with self._lock:
+            if text in self._queries:
+                self._queries.move_to_end(text)
+                return self._queries[text]
+        query = self.vector(text)
+        scores = np.zeros(len(self.names), dtype=np.float64)
+        if query:
+            spans = [(self.posting_starts[g], self.posting_starts[g + 1], w) for g, w in query.items()]
+            rows = np.concatenate([self.posting_rows[a:b] for a, b, _ in spans])
+            weights = np.concatenate([self.posting_weights[a:b] * w for a, b, w in spans])
+            scores = np.bincount(rows, weights=weights, minlength=len(self.names))
+        with self._lock:
+            self._queries[text] = scores
+            if len(self._queries) > QUERY_CACHE_SIZE:
+                self._queries.popitem(last=False)
+        return scores
+
+    def scores(self, text: str, names: list) -> np.ndarray:
+        """Cosine similarity of `text` to each of `names`."""
+        all_scores = self.query_scores(text)
+        ids = np.array([self.ids.get(name, -1) for name in names], dtype=np.int64)
+        result = all_scores[np.maximum(ids, 0)] if len(self.names) else np.zeros(len(names))
+        result = np.where(ids >= 0, result, 0.0)
+        missing = np.flatnonzero(ids < 0).tolist()
+        if missing:
+            query = self.vector(text)
+            for position in missing:
+                vector = self.vector(names[position])
+                result[position] = sum(w * vector.get(gram, 0.0) for gram, w in query.items())
+        return result
+
+    def shortlist(self, text: str, names: list, token_budget: int) -> list:
+        """
+        The names most similar to `text` that fit `token_budget` (see `list_tokens`), returned in
+        their original order. Lists that already fit are returned unchanged; at least one name is kept.
+        """
+        if list_tokens(names) <= token_budget:
+            return list(names)
+        order = np.argsort(-self.scores(text, names), kind='stable')
+        costs = np.array([len(names[i]) + 4 for i in order.tolist()], dtype=np.int64)
+        keep = max(1, int(np.searchsorted(np.cumsum(costs), 4 * (token_budget - 1), side='right')))
+        return [names[i] for i in np.sort(order[:keep]).tolist()]
+
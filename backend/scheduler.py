@@ -0,0 +1,277 @@
+# scheduler.py - Central gate for LLM calls: per-provider rate limits, priority lanes, retries, single-flight
+#
+# Every Gemini / Groq call goes through `scheduler.call` (threads) or `scheduler.acall` (asyncio):
+#   - a token bucket per provider (LLM_RPM_<PROVIDER> requests per minute, LLM_BURST_<PROVIDER>
+#     burst) keeps bursts under the provider's rate limit; callers queue for tokens by lane, so an
+#     interactive answer is served before assembly fan-out, and both before background jobs;
+#   - transient failures (429, 5xx, timeouts, dropped connections) are retried with jittered
+#     exponential backoff, within the caller's deadline;
+#   - calls made with the same `key` while one is already in flight share that call's result.
+#
+# The fake provider (fake_llm.py) is unlimited unless LLM_RPM_FAKE is set, so the whole path can be
+# exercised offline.
+
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import concurrent.futures
+
+from metrics import metrics
+
+# Requests per minute per provider; 0 means unlimited. LLM_RPM_<PROVIDER> overrides.
+DEFAULT_RPM = {"gemini": 60, "groq": 30}
+# Lanes in priority order: the lowest number is served first when callers queue for tokens.
+LANES = {"interactive": 0, "fanout": 1, "background": 2}
+# Attempts per call (first try included) and the backoff between them.
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# How often an async caller that isn't first in line re-checks its provider's bucket.
+ASYNC_POLL_SECONDS = 0.02
+
+# Exceptions worth retrying, by class name, across the Gemini (google.api_core), Groq and stdlib clients.
+RETRYABLE_ERRORS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded",
+    "GatewayTimeout", "BadGateway", "RateLimitError", "APIConnectionError", "APITimeoutError",
+    "TimeoutError", "ConnectionError", "ConnectionResetError",
+}
+
+
+class SchedulerTimeout(TimeoutError):
+    """Raised when a call can't get a rate-limit token (or its next retry) before its deadline."""
+
+
+def retry_delay(error, attempt: int, max_attempts: int = None):
+    """Seconds to wait before retrying `error` after `attempt` tries, or None if it isn't worth retrying."""
+    max_attempts = MAX_ATTEMPTS if max_attempts is None else max_attempts
+    status = getattr(error, 'status_code', None)
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code
+    retryable = status in (408, 409, 429) or (status is not None and status >= 500) or \
+        any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+    if not retryable or attempt >= max_attempts:
+        return None
+    # Honor the server's Retry-After on rate limits when it sends one.
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after') is not None:
+            return min(float(headers['retry-after']), BACKOFF_MAX_SECONDS)
+    except (TypeError, ValueError):
+        pass
+    # Full jitter keeps concurrent callers from retrying in lockstep.
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+class _Bucket:
+    """Token bucket whose tokens go to queued callers in (lane, arrival) order."""
+
+    def __init__(self, rpm: float, burst: float):
+        self.rate = rpm / 60.0
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.queue = []
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def poll(self, ticket: tuple, now: float) -> float:
+        """0.0 if `ticket` got a token (and left the queue), else roughly how long until it might."""
+        self._refill(now)
+        if self.queue[0] != ticket:
+            return (1.0 - min(self.tokens, 1.0)) / self.rate + ASYNC_POLL_SECONDS
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            heapq.heappop(self.queue)
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def leave(self, ticket: tuple):
+        self.queue.remove(ticket)
+        heapq.heapify(self.queue)
+
+
+class LLMScheduler:
+    """See the module comment. `limits` ({provider: rpm}) overrides DEFAULT_RPM and the environment."""
+
+    def __init__(self, limits: dict = None, max_attempts: int = None):
+        self.max_attempts = MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self._limits = dict(limits or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._sequence = itertools.count()
+        self._inflight = {}
+        self._ainflight = {}
+
+    def configure(self, provider: str, rpm: float, burst: float = None):
+        """Sets (or with rpm=0 removes) the rate limit of `provider`."""
+        with self._lock:
+            self._limits[provider] = rpm
+            self._buckets[provider] = _Bucket(rpm, burst if burst is not None else max(1.0, rpm / 6)) if rpm else None
+
+    def _bucket(self, provider: str):
+        # Caller holds the lock.
+        if provider not in self._buckets:
+            key = provider.upper()
+            rpm = float(self._limits.get(provider, os.getenv(f"LLM_RPM_{key}", DEFAULT_RPM.get(provider, 0))))
+            burst = float(os.getenv(f"LLM_BURST_{key}", max(1.0, rpm / 6)))
+            self._buckets[provider] = _Bucket(rpm, burst) if rpm else None
+        return self._buckets[provider]
+
+    # --- Rate limiting ---
+
+    def _enter(self, provider: str, lane: str):
+        with self._lock:
+            bucket = self._bucket(provider)
+            if bucket is None:
+                return None, None
+            ticket = (LANES.get(lane, len(LANES)), next(self._sequence))
+            heapq.heappush(bucket.queue, ticket)
+            return bucket, ticket
+
+    def acquire(self, provider: str, lane: str = "interactive", deadline: float = None):
+        """Blocks until `provider` has a token for this caller; `deadline` is a time.monotonic() value."""
+        started = time.monotonic()
+        bucket, ticket = self._enter(provider, lane)
+        if bucket is None:
+            return
+        with self._ready:
+            while True:
+                now = time.monotonic()
+                wait = bucket.poll(ticket, now)
+                if not wait:
+                    break
+                if deadline is not None and now + min(wait, ASYNC_POLL_SECONDS) > deadline:
+                    bucket.leave(ticket)
+                    self._ready.notify_all()
+                    raise SchedulerTimeout(f"No {provider} rate-limit token before the deadline.")
+                self._ready.wait(wait if deadline is None else min(wait, deadline - now))
+            # The next caller in line may now be at the head of the queue.
+            self._ready.notify_all()
+        metrics.observe("llm_queue_seconds", time.monotonic() - started, provider=provider, lane=lane)
+
+    async def aacquire(self, provider: str, lane: str = "interactive", deadline: float = None):
+        """Async counterpart of `acquire` (polls instead of blocking the event loop)."""
+        started = time.monotonic()
+        bucket, ticket = self._enter(provider, lane)
+        if bucket is None:
+            return
+        try:
+            while True:
+                with self._ready:
+                    now = time.monotonic()
+                    wait = bucket.poll(ticket, now)
+                    if not wait:
+                        self._ready.notify_all()
+                        break
+                if deadline is not None and now + min(wait, ASYNC_POLL_SECONDS) > deadline:
+                    raise SchedulerTimeout(f"No {provider} rate-limit token before the deadline.")
+                await asyncio.sleep(min(wait, ASYNC_POLL_SECONDS) if bucket.queue and bucket.queue[0] != ticket else wait)
+        except BaseException:
+            # Timed out or cancelled while queued: give the place in line up.
+            with self._ready:
+                if ticket in bucket.queue:
+                    bucket.leave(ticket)
+                self._ready.notify_all()
+            raise
+        metrics.observe("llm_queue_seconds", time.monotonic() - started, provider=provider, lane=lane)
+
+    # --- Calls ---
+
+    def _log_retry(self, provider: str, error, attempt: int, delay: float):
+        metrics.inc("llm_retries_total", provider=provider)
+        print(f"[Scheduler: {provider} call failed with {type(error).__name__}, "
+              f"retrying in {delay:.1f}s (attempt {attempt}/{self.max_attempts})]")
+
+    def _run(self, provider: str, fn, lane: str, deadline: float):
+        attempt = 1
+        while True:
+            self.acquire(provider, lane, deadline)
+            try:
+                return fn()
+            except Exception as e:
+                delay = retry_delay(e, attempt, self.max_attempts)
+                if delay is None or (deadline is not None and time.monotonic() + delay > deadline):
+                    raise
+                self._log_retry(provider, e, attempt, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    async def _arun(self, provider: str, fn, lane: str, deadline: float):
+        attempt = 1
+        while True:
+            await self.aacquire(provider, lane, deadline)
+            try:
+                return await fn()
+            except Exception as e:
+                delay = retry_delay(e, attempt, self.max_attempts)
+                if delay is None or (deadline is not None and time.monotonic() + delay > deadline):
+                    raise
+                self._log_retry(provider, e, attempt, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def call(self, provider: str, fn, key=None, lane: str = "interactive", timeout: float = None):
+        """
+        Runs `fn()` (one provider request) under `provider`'s rate limit, retrying transient
+        failures within `timeout` seconds. Callers passing the same hashable `key` while a call
+        with that key is running wait for it and get its result (or exception) instead.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if key is None:
+            return self._run(provider, fn, lane, deadline)
+        key = (provider, key)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = concurrent.futures.Future()
+        if not leader:
+            metrics.inc("llm_coalesced_total", provider=provider)
+            return future.result(timeout=timeout)
+        try:
+            result = self._run(provider, fn, lane, deadline)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def acall(self, provider: str, fn, key=None, lane: str = "interactive", timeout: float = None):
+        """
+        Async counterpart of `call`; `fn()` returns an awaitable. A coalesced call is cancelled
+        only when every caller waiting on it has been cancelled.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if key is None:
+            return await self._arun(provider, fn, lane, deadline)
+        key = (provider, key, id(asyncio.get_running_loop()))
+        entry = self._ainflight.get(key)
+        if entry is None:
+            entry = self._ainflight[key] = {"task": asyncio.ensure_future(self._arun(provider, fn, lane, deadline)), "waiters": 0}
+            entry["task"].add_done_callback(lambda _: self._ainflight.pop(key, None) if self._ainflight.get(key) is entry else None)
+        else:
+            metrics.inc("llm_coalesced_total", provider=provider)
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(entry["task"])
+        except asyncio.CancelledError:
+            if entry["waiters"] == 1:
+                entry["task"].cancel()
+            raise
+        finally:
+            entry["waiters"] -= 1
+
+
+# Shared scheduler used by the agent and the description jobs.
+scheduler = LLMScheduler()
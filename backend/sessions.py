@@ -0,0 +1,117 @@
+# sessions.py - Per-session, bounded conversation memory with token-budgeted history windows
+
+import os
+import threading
+from collections import OrderedDict
+
+# --- Configuration ---
+# Sessions kept in memory at once; the least recently used one is dropped beyond this.
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+# Approximate tokens of history handed to the agent per turn (summary + verbatim turns).
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# Hard cap on the rolling summary so it can't grow without bound either.
+SUMMARY_MAX_CHARS = 1200
+# Characters kept from each turn when it is folded into the summary.
+SUMMARY_TURN_CHARS = 160
+
+DEFAULT_SESSION_ID = "default"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def summarize_turns(previous_summary: str, turns: list) -> str:
+    """
+    Default local summarizer: appends a clipped line per folded turn to the previous summary
+    and keeps only the most recent SUMMARY_MAX_CHARS. No LLM call, so folding costs nothing.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for turn in turns:
+        content = " ".join(turn['content'].split())
+        if len(content) > SUMMARY_TURN_CHARS:
+            content = content[:SUMMARY_TURN_CHARS].rsplit(" ", 1)[0] + "..."
+        lines.append(f"{turn['role'].capitalize()} said: {content}")
+    summary = "\n".join(lines)
+    return summary[-SUMMARY_MAX_CHARS:]
+
+
+class Session:
+    """
+    One user's conversation. Recent turns are kept verbatim; turns that fall outside the
+    token budget are folded into `summary` once and then dropped, so memory stays bounded.
+    """
+
+    def __init__(self, session_id: str, summarize=summarize_turns):
+        self.session_id = session_id
+        self.turns = []
+        self.summary = ""
+        self._summarize = summarize
+        self._lock = threading.Lock()
+
+    def append(self, role: str, content: str):
+        with self._lock:
+            self.turns.append({"role": role, "content": content})
+
+    def window(self, token_budget: int = HISTORY_TOKEN_BUDGET) -> list:
+        """
+        Returns the history to show the agent: a "summary" message for older turns (if any)
+        followed by as many recent turns as fit in `token_budget`.
+        """
+        with self._lock:
+            budget = token_budget - (estimate_tokens(self.summary) if self.summary else 0)
+            keep_from = len(self.turns)
+            for i in range(len(self.turns) - 1, -1, -1):
+                cost = estimate_tokens(self.turns[i]['content'])
+                if cost > budget:
+                    break
+                budget -= cost
+                keep_from = i
+
+            if keep_from > 0:
+                # Fold everything older than the window into the cached summary exactly once.
+                self.summary = self._summarize(self.summary, self.turns[:keep_from])
+                self.turns = self.turns[keep_from:]
+
+            history = list(self.turns)
+            if self.summary:
+                history.insert(0, {"role": "summary", "content": self.summary})
+            return history
+
+    def clear(self):
+        with self._lock:
+            self.turns = []
+            self.summary = ""
+
+
+class SessionStore:
+    """Sessions keyed by id with LRU eviction beyond `max_sessions`."""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, summarize=summarize_turns):
+        self.max_sessions = max_sessions
+        self._summarize = summarize
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Session:
+        """Returns the session, creating it (and evicting the least recently used one) if needed."""
+        session_id = session_id or DEFAULT_SESSION_ID
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Session(session_id, self._summarize)
+                while len(self._sessions) > self.max_sessions:
+                    evicted_id, _ = self._sessions.popitem(last=False)
+                    print(f"[Sessions: Evicted least recently used session '{evicted_id}'.]")
+            else:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def clear(self, session_id: str) -> bool:
+        """Forgets a session. Returns False if it didn't exist."""
+        with self._lock:
+            return self._sessions.pop(session_id or DEFAULT_SESSION_ID, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,128 @@
+# slots.py - Local basket assembly: match a goal's slots (parts + substitutes) against a store's inventory
+#
+# The LLM decomposes a goal once per request, e.g. "a sandwich" ->
+#   [{"name": "bread", "options": ["bread", "bagel"]}, {"name": "protein", "options": ["ham", "turkey"]}, ...]
+# and every store is then filled from that list here, without any further LLM calls.
+
+import re
+import difflib
+from functools import lru_cache
+from collections import defaultdict
+
+# Minimum difflib ratio for a typo-level match ("chedar cheese" -> "cheddar cheese").
+FUZZY_CUTOFF = 0.85
+# Fuzzy matches always rank below token matches.
+FUZZY_WEIGHT = 0.5
+
+
+def _singular(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith("oes"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+# Store vocabularies overlap heavily, so tokenizing is memoized across stores and requests.
+@lru_cache(maxsize=65536)
+def name_tokens(name: str) -> tuple:
+    """Lowercased, singularized word tokens of an item name ("Chocolate Chips" -> ("chocolate", "chip"))."""
+    return tuple(_singular(token) for token in re.findall(r"[a-z0-9]+", name.lower()))
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name_tokens(name))
+
+
+class NameIndex:
+    """
+    Token index over one store's in-stock item names. `best_match(term)` scores candidates:
+      - 1.0 for the same normalized name,
+      - |term tokens| / |item tokens| when every term token appears in the item ("flour" -> "organic flour"),
+      - FUZZY_WEIGHT * similarity for near-identical spellings.
+    Ties go to the item listed first in the inventory.
+    """
+
+    def __init__(self, names: list):
+        self.names = list(names)
+        self.normalized = [normalize_name(name) for name in self.names]
+        self.token_sets = [set(name_tokens(name)) for name in self.names]
+        self.postings = defaultdict(list)
+        for position, tokens in enumerate(self.token_sets):
+            for token in tokens:
+                self.postings[token].append(position)
+
+    def __len__(self):
+        return len(self.names)
+
+    def best_match(self, term: str, exclude: set = ()) -> tuple:
+        """(item name, score) of the best in-stock item for `term`, or (None, 0.0)."""
+        tokens = set(name_tokens(term))
+        if not tokens:
+            return None, 0.0
+        # Only items carrying the term's rarest token can contain all of its tokens.
+        rarest = min(tokens, key=lambda token: len(self.postings.get(token, ())))
+        best, best_score = None, 0.0
+        for position in self.postings.get(rarest, ()):
+            if self.names[position] in exclude or not tokens <= self.token_sets[position]:
+                continue
+            score = len(tokens) / len(self.token_sets[position])
+            if score > best_score:
+                best, best_score = self.names[position], score
+        if best is not None:
+            return best, best_score
+
+        normalized = " ".join(name_tokens(term))
+        for candidate in difflib.get_close_matches(normalized, self.normalized, n=3, cutoff=FUZZY_CUTOFF):
+            position = self.normalized.index(candidate)
+            if self.names[position] not in exclude:
+                return self.names[position], FUZZY_WEIGHT * difflib.SequenceMatcher(None, normalized, candidate).ratio()
+        return None, 0.0
+
+
+def parse_slots(llm_output: dict):
+    """Validates a {"slots": [...]} answer into [{"name", "options", "optional"}, ...]; None if unusable."""
+    raw_slots = llm_output.get("slots") if isinstance(llm_output, dict) else None
+    if not isinstance(raw_slots, list):
+        return None
+    slots = []
+    for raw in raw_slots:
+        if not isinstance(raw, dict):
+            continue
+        options = [option for option in raw.get("options") or [] if isinstance(option, str) and option.strip()]
+        name = raw.get("name") if isinstance(raw.get("name"), str) else (options[0] if options else None)
+        if not name:
+            continue
+        slots.append({"name": name, "options": options or [name], "optional": bool(raw.get("optional"))})
+    return slots or None
+
+
+def match_slots(slots: list, index: NameIndex) -> list:
+    """
+    The item name `index` offers for each slot (None where it has nothing). For each slot the
+    options are tried in order and the best-scoring match wins (earlier options break ties);
+    an item fills at most one slot.
+    """
+    matched, used = [], set()
+    for slot in slots:
+        best, best_score = None, 0.0
+        for option in slot["options"]:
+            name, score = index.best_match(option, exclude=used)
+            if score > best_score:
+                best, best_score = name, score
+                if score == 1.0:
+                    break
+        matched.append(best)
+        if best is not None:
+            used.add(best)
+    return matched
+
+
+def fill_slots(slots: list, index: NameIndex):
+    """Exact item names filling `slots` from one store, or None when a required slot can't be filled."""
+    matched = match_slots(slots, index)
+    if any(name is None and not slot["optional"] for slot, name in zip(slots, matched)):
+        return None
+    return [name for name in matched if name is not None] or None
@@ -0,0 +1,221 @@
+# split_basket.py - Best basket split across up to K stores (price / quality / balanced, with a travel penalty)
+#
+# A basket may take each part from a different store. For a set of stores S, every part comes
+# from the store in S where it costs least, so
+#     cost(S) = sum over parts j of min_{s in S} cost[s, j]  +  sum_{s in S} travel[s]
+# which is minimized over |S| <= K by dominance filtering plus a branch-and-bound search whose
+# leaves are evaluated as NumPy rows. Optional parts are covered like the single-store baskets
+# cover them (whenever a chosen store has one); a set missing an optional part pays a penalty
+# above any store's cost for it instead of being ruled out.
+
+import numpy as np
+
+from slots import match_slots
+
+# Travel penalty per km between the user and each store used, in the objective's own units:
+# dollars for "price" and "balanced", summed quality points for "quality".
+DISTANCE_WEIGHTS = {"price": 0.5, "quality": 0.2, "balanced": 0.5}
+# Dinkelbach iterations for the quality-per-dollar ("balanced") objective; it converges in a handful.
+MAX_RATIO_ITERATIONS = 8
+# Quality ties are broken toward the cheaper item.
+PRICE_TIEBREAK = 1e-6
+# Search nodes one solve may expand before it settles for the best basket found so far. Deeper
+# store counts are searched last, so the best 1- and 2-store baskets are always exact.
+MAX_SEARCH_NODES = 5000
+# How many of the strongest stores every store is checked against for dominance.
+DOMINATORS = 64
+
+
+class CostTable:
+    """
+    Per-store price and quality of the item each store would use for every part.
+    `prices` / `qualities` are (stores x parts) arrays; `available` marks which entries exist and
+    `items[s][j]` is the item dict behind entry (s, j), or None. `optional[j]` marks parts a
+    basket may go without.
+    """
+
+    def __init__(self, stores: list, items: list, parts: list, optional: list = None):
+        self.stores = stores
+        self.items = items
+        self.parts = parts
+        self.optional = np.array(optional if optional is not None else [False] * len(parts), dtype=bool)
+        shape = (len(stores), len(parts))
+        self.available = np.array([[item is not None for item in row] for row in items], dtype=bool).reshape(shape)
+        self.prices = np.array([[item['price'] if item else 0.0 for item in row] for row in items], dtype=np.float64).reshape(shape)
+        self.qualities = np.array([[item['qualityScore'] if item else 0.0 for item in row] for row in items], dtype=np.float64).reshape(shape)
+
+    def __len__(self):
+        return len(self.stores)
+
+
+def cost_table_from_slots(slots: list, stores: list, catalog) -> CostTable:
+    """
+    Cost table for every slot of a goal decomposition (see slots.py), matched exactly as
+    `slots.fill_slots` matches them for single-store baskets, so split and single-store
+    options are the same basket. Optional slots no store can fill are left out.
+    """
+    rows = []
+    for store in stores:
+        items = catalog.items_by_name[store['id']]
+        names = match_slots(slots, catalog.name_index(store['id']))
+        rows.append([items[name] if name else None for name in names])
+    keep = [j for j, slot in enumerate(slots) if not slot["optional"] or any(row[j] is not None for row in rows)]
+    return CostTable(stores, [[row[j] for j in keep] for row in rows], [slots[j]["name"] for j in keep],
+                     [slots[j]["optional"] for j in keep])
+
+
+# --- Search ---
+
+def _undominated(criteria: np.ndarray) -> np.ndarray:
+    """
+    Indices of rows not dominated by any of the strongest DOMINATORS rows, where every column of
+    `criteria` is lower-is-better: b dominates a when it is no worse in every column (of identical
+    rows only the first is kept). A dominated store can always be swapped for its dominator without
+    making any basket worse, and checking against a few strong rows keeps this O(stores).
+    """
+    n = len(criteria)
+    finite = np.isfinite(criteria)
+    strongest = np.lexsort((np.where(finite, criteria, 0).sum(axis=1), (~finite).sum(axis=1)))[:DOMINATORS]
+    dominators = criteria[strongest]
+    # no_worse[a, d]: dominator d is at least as good as row a everywhere.
+    no_worse = (dominators[None, :, :] <= criteria[:, None, :]).all(axis=2)
+    same = (dominators[None, :, :] == criteria[:, None, :]).all(axis=2)
+    dominated = no_worse & (~same | (strongest[None, :] < np.arange(n)[:, None]))
+    return np.flatnonzero(~dominated.any(axis=1))
+
+
+def _best_store_set(costs: np.ndarray, travel: np.ndarray, max_stores: int, incumbent: tuple = (np.inf, ())) -> tuple:
+    """
+    (value, store indices) minimizing cost(S) over |S| <= max_stores, or (inf, ()) if no set
+    covers every part (or none beats `incumbent`). Missing entries in `costs` must be +inf.
+    Sets of 3+ stores are searched within MAX_SEARCH_NODES.
+    """
+    n = len(costs)
+    if not n:
+        return incumbent
+    # Complete, strong single stores first, so good incumbents are found early and prune more.
+    finite = np.isfinite(costs)
+    singles = np.where(finite, costs, 0).sum(axis=1) + travel
+    order = np.lexsort((singles, (~finite).sum(axis=1)))
+    costs, travel = costs[order], travel[order]
+    suffix_min = np.minimum.accumulate(costs[::-1], axis=0)[::-1]
+    best = list(incumbent)
+    nodes = [0]
+
+    def search(start: int, current_min: np.ndarray, chosen: tuple, chosen_travel: float, depth_limit: int):
+        nodes[0] += 1
+        # Every one-store extension of `chosen` is scored at once.
+        extended = np.minimum(current_min, costs[start:])
+        values = extended.sum(axis=1) + chosen_travel + travel[start:]
+        i = int(np.argmin(values))
+        if values[i] < best[0]:
+            best[0], best[1] = float(values[i]), tuple(int(order[t]) for t in chosen + (start + i,))
+        if len(chosen) + 1 >= depth_limit or start + 1 >= n:
+            return
+        # Lower bound of any larger set through store t: its parts can at best drop to the cheapest later store.
+        bounds = np.minimum(extended[:-1], suffix_min[start + 1:]).sum(axis=1) + chosen_travel + travel[start:-1]
+        # A store that improves no part only adds travel, so it never belongs in an optimal set.
+        useful = (costs[start:-1] < current_min).any(axis=1)
+        for offset in np.flatnonzero(useful & (bounds < best[0])):
+            if bounds[offset] >= best[0] or (depth_limit > 2 and nodes[0] >= MAX_SEARCH_NODES):
+                continue
+            t = start + int(offset)
+            search(t + 1, extended[offset], chosen + (t,), chosen_travel + travel[t], depth_limit)
+
+    # Iterative deepening: the best 1- and 2-store baskets make the bound for larger sets tight.
+    for depth_limit in range(1, max_stores + 1):
+        search(0, np.full(costs.shape[1], np.inf), (), 0.0, depth_limit)
+    return tuple(best)
+
+
+def _with_optional_penalty(table: CostTable, costs: np.ndarray) -> np.ndarray:
+    """`costs` (missing entries +inf) with missing optional entries priced above any store's cost for that part."""
+    finite = np.where(table.available, costs, -np.inf).max(axis=0)
+    known = np.isfinite(finite)
+    # Zeroed first so a part no store has doesn't compute -inf + inf.
+    finite = np.where(known, finite, 0.0)
+    penalty = np.where(known, finite + np.abs(finite) + 1.0, 0.0)
+    return np.where(~table.available & table.optional[None, :], penalty[None, :], costs)
+
+
+def _split_totals(table: CostTable, store_set: tuple, costs: np.ndarray, travel_km: np.ndarray) -> tuple:
+    """
+    Per-part store choice for `store_set` (-1 for an optional part none of them has), plus the
+    resulting (total price, mean quality, travel km) over the parts actually bought.
+    """
+    rows = np.array(store_set)
+    choice = rows[np.argmin(costs[rows], axis=0)]
+    parts = np.arange(costs.shape[1])
+    choice = np.where(table.available[choice, parts], choice, -1)
+    bought = choice >= 0
+    total_price = float(table.prices[choice[bought], parts[bought]].sum())
+    average_quality = float(table.qualities[choice[bought], parts[bought]].mean())
+    return choice, total_price, average_quality, float(travel_km[np.unique(choice[bought])].sum())
+
+
+def optimize_split(table: CostTable, preference: str, max_stores: int, distances: dict = None, distance_weight: float = None):
+    """
+    Best basket over at most `max_stores` stores for `preference` ("price", "quality" or
+    "balanced"; other names use "balanced"). `distances` ({store_id: km}) adds a travel
+    penalty of `distance_weight` per km per store used (DISTANCE_WEIGHTS by default).
+    Returns None when no set covers every required part, else a dict with the chosen `stores`,
+    and per part bought `items` / `itemStores`, plus `totalPrice`, `averageQuality` and `travelKm`.
+    """
+    if not len(table) or table.optional.all() or max_stores < 1:
+        return None
+    preference = preference if preference in DISTANCE_WEIGHTS else "balanced"
+    weight = DISTANCE_WEIGHTS[preference] if distance_weight is None else distance_weight
+    travel_km = np.array([(distances or {}).get(store['id'], 0.0) for store in table.stores], dtype=np.float64)
+
+    # Only stores that fill some part and that no other store dominates can be in the best basket.
+    # Dominance on (prices, -qualities, travel) holds for every objective below at once.
+    prices = np.where(table.available, table.prices, np.inf)
+    qualities = np.where(table.available, -table.qualities, np.inf)
+    if preference == "price":
+        criteria = np.column_stack([prices, travel_km])
+    elif preference == "quality":
+        criteria = np.column_stack([qualities, prices, travel_km])
+    else:
+        criteria = np.column_stack([prices, qualities, travel_km])
+    candidates = np.flatnonzero(table.available.any(axis=1))
+    candidates = candidates[_undominated(criteria[candidates])]
+
+    def solve(item_costs, travel, incumbent=(np.inf, ())):
+        costs = _with_optional_penalty(table, np.where(table.available, item_costs, np.inf))
+        _, store_set = _best_store_set(costs[candidates], travel[candidates], max_stores, incumbent)
+        store_set = tuple(int(candidates[i]) for i in store_set)
+        return (store_set, *_split_totals(table, store_set, costs, travel_km)) if store_set else None
+
+    if preference == "price":
+        found = solve(table.prices, weight * travel_km)
+    elif preference == "quality":
+        found = solve(PRICE_TIEBREAK * table.prices - table.qualities, weight * travel_km)
+    else:
+        # Dinkelbach: maximizing quality / (price + travel cost) becomes a sequence of additive problems
+        # min  ratio * (price + travel cost) - mean quality, each raising `ratio` until it stops improving.
+        # Starting from the cheapest basket's ratio usually leaves only one or two rounds.
+        found = solve(table.prices, weight * travel_km)
+        if found is None:
+            return None
+        for _ in range(MAX_RATIO_ITERATIONS):
+            _, _, total_price, average_quality, travel = found
+            denominator = total_price + weight * travel
+            ratio = average_quality / denominator if denominator > 0 else 0.0
+            # The current basket scores exactly 0 at its own ratio; only a negative value is an improvement.
+            solution = solve(ratio * table.prices - table.qualities / len(table.parts), ratio * weight * travel_km, (-1e-12, ()))
+            if solution is None:
+                break
+            found = solution
+    if found is None:
+        return None
+
+    store_set, choice, total_price, average_quality, travel = found
+    bought = [(j, s) for j, s in enumerate(choice.tolist()) if s >= 0]
+    return {
+        "stores": [table.stores[i] for i in store_set if i in choice],
+        "items": [table.items[s][j] for j, s in bought],
+        "itemStores": [table.stores[s] for _, s in bought],
+        "totalPrice": round(total_price, 2),
+        "averageQuality": round(average_quality, 1),
+        "travelKm": round(travel, 2),
+    }
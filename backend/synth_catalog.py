@@ -0,0 +1,97 @@
+# synth_catalog.py - Generates stores.json-shaped catalogs of any size for benchmarks
+#
+# Usage: python synth_catalog.py --stores 10000 --items 1000 --out data/synth_stores.json
+
+import json
+import random
+import argparse
+
+# Base vocabulary per category, seeded from the kinds of items in data/stores.json.
+BASE_ITEMS = {
+    "Groceries": ["flour", "sugar", "eggs", "butter", "milk", "bread", "cheddar cheese", "ham", "turkey", "lettuce",
+                  "tomato", "mayonnaise", "mustard", "chocolate chips", "baking soda", "vanilla extract", "salt",
+                  "brown sugar", "rice", "pasta", "olive oil", "chicken breast", "ground beef", "apples", "bananas",
+                  "yogurt", "cereal", "coffee", "tea", "peanut butter", "jelly", "oats", "honey", "onions", "garlic"],
+    "Hardware": ["hammer", "nails", "screwdriver", "screws", "drill", "drill bits", "paint", "paint brush", "roller",
+                 "tape measure", "level", "wrench", "pliers", "sandpaper", "wood glue", "duct tape", "light bulb",
+                 "extension cord", "pipe wrench", "plumber's tape", "caulk", "saw", "ladder", "gloves"],
+    "Electronics": ["laptop", "mouse", "keyboard", "monitor", "hdmi cable", "usb-c cable", "charger", "headphones",
+                    "speaker", "webcam", "microphone", "router", "phone case", "power bank", "smart watch", "tablet",
+                    "ssd", "memory card", "printer", "ink cartridge"],
+    "Gas": ["standard gas", "premium gas", "ultra premium gas", "diesel", "coffee", "water", "snacks", "windshield fluid"],
+}
+VARIANTS = ["organic", "store-brand", "premium", "value", "family-size", "low-fat", "large", "small", "deluxe",
+            "classic", "imported", "local", "extra", "mini", "bulk", "eco", "pro", "lite", "artisan", "fresh"]
+NAME_PARTS = ["Super", "Budget", "Fresh", "Corner", "Green", "Value", "City", "Prime", "Golden", "Market", "Tech",
+              "Depot", "Galaxy", "Bay", "Hill", "Valley", "Union", "Metro"]
+STREETS = ["Main St", "4th St", "B St", "Las Gallinas Ave", "Bellam Blvd", "Francisco Blvd", "Lincoln Ave", "Grand Ave"]
+
+
+def item_vocabulary(category: str, size: int) -> list:
+    """`size` distinct item names for a category: the base items, then "<variant> <base>" combinations."""
+    base = BASE_ITEMS[category]
+    names = list(base)
+    for variant in VARIANTS:
+        names.extend(f"{variant} {item}" for item in base)
+    suffix = 2
+    while len(names) < size:
+        names.extend(f"{name} #{suffix}" for name in names[:size - len(names)])
+        suffix += 1
+    return names[:size]
+
+
+def generate_catalog(n_stores: int, items_per_store: int, seed: int = 0,
+                     center: tuple = (37.97, -122.53), spread_deg: float = 0.5) -> list:
+    """
+    Returns a list of `n_stores` store dicts shaped like data/stores.json, each with
+    `items_per_store` inventory entries. The same arguments always produce the same catalog.
+    """
+    rng = random.Random(seed)
+    categories = list(BASE_ITEMS)
+    vocabularies = {category: item_vocabulary(category, max(items_per_store * 2, len(BASE_ITEMS[category])))
+                    for category in categories}
+
+    stores = []
+    for i in range(n_stores):
+        category = categories[i % len(categories)]
+        vocabulary = vocabularies[category]
+        names = rng.sample(vocabulary, min(items_per_store, len(vocabulary)))
+        name = f"{rng.choice(NAME_PARTS)} {rng.choice(NAME_PARTS)} {category} #{i + 1}"
+        stores.append({
+            "id": f"store-{i + 1:06d}",
+            "name": name,
+            "category": category,
+            "lat": center[0] + rng.uniform(-spread_deg, spread_deg),
+            "long": center[1] + rng.uniform(-spread_deg, spread_deg),
+            "location": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}, San Rafael, CA 94901",
+            "rating": round(rng.uniform(3.0, 5.0), 1),
+            "inventory": [
+                {
+                    "itemName": item_name,
+                    "price": round(rng.uniform(0.5, 50.0), 2),
+                    "qualityScore": rng.randint(1, 10),
+                    "inStock": rng.random() > 0.1,
+                }
+                for item_name in names
+            ],
+            "tags": {"description": f"{name} is a synthetic {category.lower()} store used for benchmarks."},
+        })
+    return stores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic stores.json-shaped catalog.")
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="data/synth_stores.json")
+    args = parser.parse_args()
+
+    stores = generate_catalog(args.stores, args.items, args.seed)
+    with open(args.out, 'w') as f:
+        json.dump(stores, f)
+    print(f"Wrote {len(stores)} stores x {args.items} items to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
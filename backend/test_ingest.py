@@ -0,0 +1,41 @@
+import json
+
+import ingest
+from catalog import Catalog
+from changelog import LiveCatalog
+
+
+def _write_catalog(tmp_path):
+    snapshot = tmp_path / "stores.json"
+    snapshot.write_text(json.dumps([{
+        "id": "store-001", "name": "Corner Market", "category": "Groceries", "lat": 37.9, "long": -122.5,
+        "inventory": [{"itemName": "Bread", "price": 3.0, "qualityScore": 6, "inStock": True}],
+    }]))
+    return str(snapshot), str(tmp_path / "stores.changes.jsonl")
+
+
+def test_rows_survive_a_compaction_by_another_process_mid_ingest(tmp_path, monkeypatch):
+    snapshot, log = _write_catalog(tmp_path)
+    price_list = tmp_path / "prices.json"
+    price_list.write_text(json.dumps([{"Store": "Corner Market", "Items": [{"Item": "Milk (gallon)", "Price": 4.5}]}]))
+    live = LiveCatalog(Catalog.from_file(snapshot), snapshot, log, compact_every=0)
+    # Another process (e.g. the server) updates an item and compacts while the file is being parsed.
+    server = LiveCatalog(Catalog.from_file(snapshot), snapshot, log, compact_every=0)
+    parse = ingest.iter_price_list
+    interrupted = []
+
+    def iter_price_list(f):
+        yield from parse(f)
+        if not interrupted:
+            interrupted.append(True)
+            server.update_item("store-001", "Bread", {"price": 2.5})
+            server.compact()
+
+    monkeypatch.setattr(ingest, "iter_price_list", iter_price_list)
+    counters = ingest.ingest([str(price_list)], live)
+
+    assert counters["added"] == 1
+    for catalog in (live.catalog, Catalog.from_file(snapshot)):
+        items = catalog.items_by_name["store-001"]
+        assert items["Milk (1 gallon)"]["price"] == 4.5
+        assert items["Bread"]["price"] == 2.5
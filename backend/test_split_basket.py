@@ -0,0 +1,51 @@
+from catalog import Catalog
+from ranking import rank_options
+from split_basket import cost_table_from_slots, optimize_split
+
+SLOTS = [
+    {"name": "bread", "options": ["bread"], "optional": False},
+    {"name": "ham", "options": ["ham"], "optional": False},
+    {"name": "mustard", "options": ["mustard"], "optional": True},
+]
+
+
+def _store(store_id: str, prices: dict) -> dict:
+    return {
+        "id": store_id, "name": f"Store {store_id}", "category": "Groceries", "lat": 37.9, "long": -122.5,
+        "inventory": [{"itemName": name, "price": price, "qualityScore": 5, "inStock": True} for name, price in prices.items()],
+    }
+
+
+def test_single_store_with_optional_item_beats_split_that_drops_it():
+    # B + C undercut A on the required items alone, but neither sells mustard: on the full
+    # basket (plus travel) A is cheapest, so no split may outrank it.
+    catalog = Catalog([
+        _store("A", {"bread": 3, "ham": 3, "mustard": 1}),
+        _store("B", {"bread": 5, "ham": 2.5}),
+        _store("C", {"bread": 3, "ham": 5}),
+    ])
+    distances = {"A": 2.0, "B": 2.0, "C": 0.0}
+    split = optimize_split(cost_table_from_slots(SLOTS, catalog.stores, catalog), "price", 2, distances)
+    assert [store["id"] for store in split["stores"]] == ["A"]
+    assert [item["itemName"] for item in split["items"]] == ["bread", "ham", "mustard"]
+
+    single = {"storeInfo": {"id": "A"}, "matchedItemsDetails": catalog.match_items("A", ["bread", "ham", "mustard"])}
+    assert rank_options([single], "price")[0]["totalPrice"] == split["totalPrice"]
+
+
+def test_split_takes_optional_item_from_a_chosen_store():
+    catalog = Catalog([
+        _store("A", {"bread": 1, "ham": 9, "mustard": 1}),
+        _store("B", {"bread": 9, "ham": 1}),
+    ])
+    split = optimize_split(cost_table_from_slots(SLOTS, catalog.stores, catalog), "price", 2)
+    assert sorted(store["id"] for store in split["stores"]) == ["A", "B"]
+    assert [item["itemName"] for item in split["items"]] == ["bread", "ham", "mustard"]
+    assert split["totalPrice"] == 3.0
+
+
+def test_optional_slot_no_store_has_is_left_out():
+    catalog = Catalog([_store("A", {"bread": 1, "ham": 9}), _store("B", {"bread": 9, "ham": 1})])
+    table = cost_table_from_slots(SLOTS, catalog.stores, catalog)
+    assert table.parts == ["bread", "ham"]
+    assert optimize_split(table, "price", 2)["totalPrice"] == 2.0
@@ -46,11 +46,13 @@ function App() {
   const chatRef = useRef(null);
   const startX = useRef(0);
   const startWidth = useRef(0);
+  // Identifies this browser tab's conversation to the backend's per-session memory
+  const sessionId = useRef(crypto.randomUUID());
   
   // Load grocery stores from backend API
   const fetchLocalGroceryStores = async () => {
     try {
-      const response = await fetch('http://localhost:5001/api/stores');
+      const response = await fetch('http://localhost:5001/api/stores?view=summary');
       if (!response.ok) {
         throw new Error('Failed to load stores data from server')
       }
@@ -242,7 +244,8 @@ function App() {
         },
         body: JSON.stringify({
           request: inputValue,
-          preference: 'balanced' // or get this from user input
+          preference: 'balanced', // or get this from user input
+          sessionId: sessionId.current
         }),
       });
 